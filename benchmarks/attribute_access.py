@@ -0,0 +1,101 @@
+"""
+Times attribute access on hydrated schema instances.
+    
+    python benchmarks/attribute_access.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+from dockit import schema
+from dockit.schema.serializer import UntypedData
+
+class Address(schema.Schema):
+    city = schema.CharField()
+    
+    class Meta:
+        app_label = 'benchmarks'
+
+class Person(schema.Schema):
+    name = schema.CharField()
+    age = schema.IntegerField()
+    address = schema.SchemaField(Address)
+    tags = schema.ListField(schema.CharField())
+    
+    def greeting(self):
+        return self.name
+    
+    class Meta:
+        app_label = 'benchmarks'
+
+class Thread(schema.Schema):
+    comments = schema.ListField(schema.SchemaField(Address))
+    
+    class Meta:
+        app_label = 'benchmarks'
+
+class Settings(schema.Schema):
+    values = schema.DictField()
+    
+    class Meta:
+        app_label = 'benchmarks'
+
+class CodecAddress(Address):
+    class Meta:
+        app_label = 'benchmarks'
+        codec = True
+
+class CodecPerson(Person):
+    address = schema.SchemaField(CodecAddress)
+    
+    class Meta:
+        app_label = 'benchmarks'
+        codec = True
+
+person_data = {'name': u'joe', 'age': 30, 'address': {'city': u'here'}, 'tags': [u'a', u'b']}
+def read_all(instance):
+    return instance.name, instance.age, instance.address.city, instance.tags
+
+person = Person.to_python(dict(person_data))
+read_all(person) #hydrate
+codec_person = CodecPerson.to_python(dict(person_data))
+
+CASES = [
+    ('field', lambda: person.name),
+    ('nested field', lambda: person.address.city),
+    ('method', lambda: person.greeting),
+    ('meta', lambda: person._meta),
+    ('set field', lambda: setattr(person, 'age', 31)),
+    ('field lookup', lambda: 'name' in Person._meta.fields),
+    ('to_primitive', lambda: Person.to_primitive(person)),
+    ('codec to_prim', lambda: CodecPerson.to_primitive(codec_person)),
+    ('load and read', lambda: read_all(Person.to_python(dict(person_data)))),
+    ('codec load', lambda: read_all(CodecPerson.to_python(dict(person_data)))),
+]
+
+thread_data = {'comments': [{'city': 'city %s' % index} for index in range(5000)]}
+tagged = Person.to_python({'tags': [u'tag %s' % index for index in range(10000)]})
+settings_data = {'values': dict([(u'key %s' % index, {u'size': index, u'tags': [u'a']}) for index in range(1000)])}
+plain_settings_data = UntypedData(settings_data)
+
+CONTAINER_CASES = [
+    ('10 of 5000', lambda: Thread.to_python(dict(thread_data)).comments[:10]),
+    ('all of 5000', lambda: list(Thread.to_python(dict(thread_data)).comments)),
+    ('assign 10000', lambda: setattr(tagged, 'tags', tagged.tags)),
+    ('dict of 1000', lambda: Settings.to_python(dict(settings_data)).values),
+    ('plain 1000', lambda: Settings.to_python(UntypedData(plain_settings_data)).values),
+]
+
+def run(number=200000):
+    for label, func in CASES:
+        best = min(timeit.repeat(func, number=number, repeat=3))
+        print '%-14s %6.0f ns' % (label, best / number * 1e9)
+    for label, func in CONTAINER_CASES:
+        best = min(timeit.repeat(func, number=20, repeat=3))
+        print '%-14s %6.2f ms' % (label, best / 20 * 1e3)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,44 @@
+"""
+Times the json codecs that are installed on stored document shapes.
+    
+    python benchmarks/json_codecs.py
+"""
+import datetime
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+from dockit.backends.jsoncodec import get_available_codecs
+
+small_document = {'title': u'a book', 'slug': u'a-book', 'published': True,
+                  'countries': [u'US', u'GB'],
+                  '@natural_key': {'uuid': u'0f8fad5b-d9cb-469f-a165-70867728950e'},
+                  '@natural_key_hash': u'5545305821442551595'}
+dated_document = dict(small_document, created=datetime.datetime(2012, 1, 2, 3, 4, 5),
+                      price=Decimal('10.50'))
+large_document = dict(small_document, chapters=[
+    {'title': u'chapter %s' % index, 'pages': index * 10, 'tags': [u'a', u'b'], 'rating': index / 3.0}
+    for index in range(200)])
+
+DOCUMENTS = [
+    ('small', small_document),
+    ('dates', dated_document),
+    ('200 entries', large_document),
+]
+
+def run(number=2000):
+    for codec_class in get_available_codecs():
+        codec = codec_class()
+        for label, document in DOCUMENTS:
+            text = codec.dumps(document)
+            dumps = min(timeit.repeat(lambda: codec.dumps(document), number=number, repeat=3))
+            loads = min(timeit.repeat(lambda: codec.loads(text), number=number, repeat=3))
+            print '%-10s %-12s dumps %8.1f us  loads %8.1f us' % (codec.name, label,
+                dumps / number * 1e6, loads / number * 1e6)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,101 @@
+"""
+Reports the memory held by hydrated schema instances, in bytes per document.
+    
+    python benchmarks/memory_usage.py
+"""
+import gc
+import json
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+from dockit import schema
+from dockit.schema.fields import BaseField
+
+class Address(schema.Schema):
+    street = schema.CharField()
+    city = schema.CharField()
+    
+    class Meta:
+        app_label = 'benchmarks'
+        slots = True
+
+class Person(schema.Schema):
+    name = schema.CharField()
+    age = schema.IntegerField()
+    address = schema.SchemaField(Address)
+    addresses = schema.ListField(schema.SchemaField(Address))
+    tags = schema.ListField(schema.CharField())
+    
+    class Meta:
+        app_label = 'benchmarks'
+        slots = True
+
+class CompactAddress(Address):
+    class Meta:
+        app_label = 'benchmarks'
+        keep_primitive_data = False
+
+class CompactPerson(Person):
+    address = schema.SchemaField(CompactAddress)
+    addresses = schema.ListField(schema.SchemaField(CompactAddress))
+    
+    class Meta:
+        app_label = 'benchmarks'
+        keep_primitive_data = False
+
+def make_data(index):
+    address = {'street': 'street %s' % index, 'city': 'city %s' % index}
+    return json.dumps({'name': 'person %s' % index, 'age': index,
+                       'address': address, 'addresses': [address] * 5,
+                       'tags': ['tag %s' % i for i in range(5)]})
+
+def hydrate(person):
+    for field in person._meta.fields.keys():
+        value = getattr(person, field)
+        if isinstance(value, schema.Schema):
+            hydrate(value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, schema.Schema):
+                    hydrate(item)
+
+def deep_size(objects):
+    '''
+    Sums the size of the objects and everything they reference except for
+    classes, modules and fields which are shared by all documents
+    '''
+    seen = set()
+    size = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, BaseField)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+CASES = [
+    ('primitive', lambda data: json.loads(data)),
+    ('loaded', lambda data: Person.to_python(json.loads(data))),
+    ('hydrated', lambda data: hydrate_and_return(Person.to_python(json.loads(data)))),
+    ('hydrated, compact', lambda data: hydrate_and_return(CompactPerson.to_python(json.loads(data)))),
+]
+
+def hydrate_and_return(person):
+    hydrate(person)
+    return person
+
+def run(number=1000):
+    datas = [make_data(index) for index in range(number)]
+    for label, func in CASES:
+        objects = [func(data) for data in datas]
+        print '%-18s %7.0f bytes' % (label, float(deep_size(objects)) / number)
+
+if __name__ == '__main__':
+    run()
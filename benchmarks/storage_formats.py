@@ -0,0 +1,24 @@
+"""
+Compares the size and decoding time of the storage formats.
+
+    python benchmarks/storage_formats.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+from dockit.backends.djangodocument.formats import get_storage_formats, decode_document
+from json_codecs import DOCUMENTS
+
+def run(number=2000):
+    for name, storage_format in sorted(get_storage_formats().items()):
+        for label, document in DOCUMENTS:
+            text = storage_format.encode(document)
+            loads = min(timeit.repeat(lambda: decode_document(text), number=number, repeat=3))
+            print '%-7s %-12s %6s chars  decode %8.1f us' % (name, label, len(text), loads / number * 1e6)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1 @@
+from dockit.backends.unitofwork import unit_of_work
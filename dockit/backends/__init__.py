@@ -42,11 +42,18 @@ class CompositeDocumentRouter(object):
             backend2.register_document(document)
 
 class CompositeIndexRouter(object):
+    range_selectivity = 1.0 / 3 #assumed fraction of rows matched by a non exact lookup
+    
     def __init__(self, routers):
         self.routers = routers
         self.registered_querysets = dict() #TODO this is redundant of the loading.appcache object
     
-    def get_effective_queryset(self, queryset):
+    def get_candidates(self, queryset):
+        """
+        Scores every index registered for the collection of the queryset.
+        Returns a list of candidates, disqualified candidates have a score of
+        None and a reason.
+        """
         self.make_app_ready()
         collection = queryset.document._meta.collection
         
@@ -56,7 +63,7 @@ class CompositeIndexRouter(object):
             from dockit.schema.loading import cache
             cache.post_app_ready()
         
-        best_match = None
+        candidates = list()
         query_inclusions = set(queryset.inclusions)
         query_exclusions = set(queryset.exclusions)
         query_indexes = set(queryset.indexes)
@@ -66,12 +73,26 @@ class CompositeIndexRouter(object):
             val_inclusions = set(val.inclusions)
             val_exclusions = set(val.exclusions)
             
+            candidate = {'queryset':val,
+                         'score':None,
+                         'reason':None,}
+            candidates.append(candidate)
+            
+            if not val_inclusions.issubset(query_inclusions) or not val_exclusions.issubset(query_exclusions):
+                candidate['reason'] = 'sparse index does not cover the query' #a sparse index cannot answer a broader query
+                continue
+            
+            missing = set([index.key for index in query_indexes]) - set([index.key for index in val_indexes])
+            if missing:
+                candidate['reason'] = 'no index on %s' % sorted(missing)[0]
+                continue
+            
             score = 0
             
             inclusions = query_inclusions - val_inclusions #inclusions queryset has but val does not
             exclusions = query_exclusions - val_exclusions #exclusions queryset has but val does not
             
-            disqualified = False
+            disqualified = None
             
             for inclusion in inclusions:
                 match = False
@@ -84,35 +105,89 @@ class CompositeIndexRouter(object):
                 if match:
                     score += 1
                 else:
-                    disqualified = True
+                    disqualified = inclusion
                     break
-            if disqualified:
-                continue
             
-            for exclusion in exclusions:
-                match = False
-                if exclusion.key == 'pk' and exclusion.operation == 'exact':
-                    continue
-                for index in val_indexes:
-                    if exclusion.key == index.key and exclusion.operation == index.operation:
-                        match = True
+            if disqualified is None:
+                for exclusion in exclusions:
+                    match = False
+                    if exclusion.key == 'pk' and exclusion.operation == 'exact':
+                        continue
+                    for index in val_indexes:
+                        if exclusion.key == index.key and exclusion.operation == index.operation:
+                            match = True
+                            break
+                    if match:
+                        score += 1
+                    else:
+                        disqualified = exclusion
                         break
-                if match:
-                    score += 1
-                else:
-                    disqualified = True
-                    break
-            if disqualified:
+            
+            if disqualified is not None:
+                candidate['reason'] = 'no index on %s__%s' % (disqualified.key, disqualified.operation)
                 continue
             
-            if not best_match or score > best_match['score']:
-                best_match = {'queryset':val,
-                              'score':score,
+            candidate.update({'score':score,
                               'inclusions':list(inclusions),
-                              'exclusions':list(exclusions),}
-        assert best_match, 'Queryset not registered'
+                              'exclusions':list(exclusions),})
+        return candidates
+    
+    def estimate_cost(self, queryset, candidate):
+        """
+        Estimates the number of index rows read when answering the queryset
+        with the candidate. Returns None if the index has no statistics.
+        """
+        index_queryset = candidate['queryset']
+        backend = self.get_index_for_read(queryset.document, index_queryset)
+        statistics = backend.get_index_statistics(index_queryset)
+        if statistics is None:
+            return None
+        distinct_values = statistics['distinct_values']
+        rows = float(statistics['documents'])
+        for inclusion in candidate['inclusions']:
+            if inclusion.key == 'pk' and inclusion.operation == 'exact':
+                rows = min(rows, 1)
+            elif inclusion.operation == 'exact' and distinct_values.get(inclusion.key):
+                rows /= distinct_values[inclusion.key]
+            else:
+                rows *= self.range_selectivity
+        for exclusion in candidate['exclusions']:
+            if exclusion.operation == 'exact' and distinct_values.get(exclusion.key):
+                rows *= 1 - 1.0 / distinct_values[exclusion.key]
+        return rows
+    
+    def get_effective_queryset(self, queryset):
+        """
+        Picks the cheapest qualified index when every candidate has been analyzed,
+        otherwise the candidate that indexes the most lookups of the queryset.
+        """
+        candidates = [candidate for candidate in self.get_candidates(queryset) if candidate['score'] is not None]
+        assert candidates, 'Queryset not registered'
+        for candidate in candidates:
+            candidate['cost'] = self.estimate_cost(queryset, candidate)
+        if len(candidates) > 1 and None not in [candidate['cost'] for candidate in candidates]:
+            return min(candidates, key=lambda candidate: (candidate['cost'], -candidate['score']))
+        best_match = None
+        for candidate in candidates:
+            if not best_match or candidate['score'] > best_match['score']:
+                best_match = candidate
         return best_match
     
+    def get_counter_index(self, document, inclusions, exclusions, key):
+        """
+        Returns the registered index counting the key over exactly the given
+        filters or None.
+        """
+        self.make_app_ready()
+        inclusions = set(inclusions)
+        exclusions = set(exclusions)
+        for val in self.registered_querysets.get(document._meta.collection, {}).itervalues():
+            if not val.counters or key not in val.counters:
+                continue
+            if set(val.inclusions) == inclusions and set(val.exclusions) == exclusions:
+                return val
+        return None
+    
     def get_index_for_read(self, document, queryset):
         name = self.get_index_name_for_read(document, queryset)
         return get_index_backends()[name]()
@@ -139,12 +214,19 @@ class CompositeIndexRouter(object):
         from dockit.schema.loading import cache
         cache.make_app_ready()
     
-    def on_save(self, document, collection, object_id, data):
+    def on_save(self, document, collection, object_id, data, changed_paths=None):
+        """
+        Notifies the indexes of a saved document. When the changed dot paths
+        are known, indexes that do not depend on them are skipped.
+        """
         self.make_app_ready()
         querysets = self.registered_querysets.get(collection, {})
         for query in querysets.itervalues():
             backend = self.get_index_for_write(document, query)
-            backend.on_save(document, collection, object_id, data)
+            if changed_paths is None:
+                backend.on_save(document, collection, object_id, data)
+            elif query._depends_on(changed_paths):
+                backend.on_update(document, collection, object_id, data, query)
     
     def on_delete(self, document, collection, object_id):
         self.make_app_ready()
@@ -153,6 +235,41 @@ class CompositeIndexRouter(object):
             backend = self.get_index_for_write(document, query)
             backend.on_delete(document, collection, object_id)
     
+    def on_save_many(self, document, collection, entries):
+        self.make_app_ready()
+        querysets = self.registered_querysets.get(collection, {})
+        for query in querysets.itervalues():
+            backend = self.get_index_for_write(document, query)
+            backend.on_save_many(document, collection, entries)
+    
+    def on_delete_many(self, document, collection, doc_ids):
+        self.make_app_ready()
+        querysets = self.registered_querysets.get(collection, {})
+        for query in querysets.itervalues():
+            backend = self.get_index_for_write(document, query)
+            backend.on_delete_many(document, collection, doc_ids)
+    
+    def on_update(self, document, collection, doc_ids, operations):
+        """
+        Maintains the indexes after a partial update. Only indexes depending on
+        the updated dot paths are evaluated again, the others are patched.
+        """
+        self.make_app_ready()
+        querysets = self.registered_querysets.get(collection, {})
+        dotpaths = [dotpath for dotpath, operation, value in operations]
+        documents = None
+        for query in querysets.itervalues():
+            backend = self.get_index_for_write(document, query)
+            if not query._references(dotpaths):
+                backend.on_patch(document, collection, doc_ids, operations, query)
+                continue
+            if documents is None:
+                storage = document._meta.get_document_backend_for_read()
+                documents = zip(doc_ids, storage.get_many(document, collection, doc_ids))
+            for doc_id, data in documents:
+                if data is not None:
+                    backend.on_update(document, collection, doc_id, data, query)
+    
     def register_queryset(self, queryset):
         document = queryset.document
         collection = queryset.document._meta.collection
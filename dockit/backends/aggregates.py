@@ -0,0 +1,75 @@
+class Aggregate(object):
+    """
+    Describes a reduction over the values indexed for a dot path.
+    Backends compute the partial results named by partials, for instance one
+    per index table, which are then merged with combine.
+    """
+    name = None
+    partials = ()
+    
+    def __init__(self, dotpath=None):
+        self.dotpath = dotpath
+    
+    @property
+    def key(self):
+        if self.dotpath is None:
+            return None
+        return self.dotpath.replace('.', '__')
+    
+    def combine(self, partials):
+        raise NotImplementedError
+    
+    def __repr__(self):
+        return '<%s: %s>' % (self.name, self.dotpath)
+
+class Count(Aggregate):
+    name = 'count'
+    partials = ('count',)
+    
+    def combine(self, partials):
+        return sum([partial['count'] or 0 for partial in partials])
+
+class Sum(Aggregate):
+    name = 'sum'
+    partials = ('sum',)
+    
+    def combine(self, partials):
+        values = [partial['sum'] for partial in partials if partial['sum'] is not None]
+        if not values:
+            return None
+        return sum(values)
+
+class Avg(Aggregate):
+    name = 'avg'
+    partials = ('sum', 'count')
+    
+    def combine(self, partials):
+        total = 0
+        count = 0
+        for partial in partials:
+            if partial['count']:
+                total += partial['sum']
+                count += partial['count']
+        if not count:
+            return None
+        return float(total) / count
+
+class Min(Aggregate):
+    name = 'min'
+    partials = ('min',)
+    
+    def combine(self, partials):
+        values = [partial['min'] for partial in partials if partial['min'] is not None]
+        if not values:
+            return None
+        return min(values)
+
+class Max(Aggregate):
+    name = 'max'
+    partials = ('max',)
+    
+    def combine(self, partials):
+        values = [partial['max'] for partial in partials if partial['max'] is not None]
+        if not values:
+            return None
+        return max(values)
@@ -51,6 +51,33 @@ class BaseIndexStorage(BaseStorage):
     def get_query(self, query_index):
         raise NotImplementedError
     
+    def analyze(self, query_index):
+        '''
+        Collects the statistics used to estimate the cost of reading from the index
+        '''
+        pass
+    
+    def get_index_statistics(self, query_index):
+        '''
+        Returns a dictionary with the number of indexed documents and the number
+        of distinct values per indexed param, or None if the index was never analyzed
+        '''
+        return None
+    
+    def get_counts(self, query_index, key):
+        '''
+        Returns a dictionary of value to document count maintained by a counter
+        index, or None if the backend does not maintain counters
+        '''
+        return None
+    
+    def get_count(self, query_index, key, value):
+        '''
+        Returns the number of documents of a counter index having the value, or
+        None if the backend does not maintain counters
+        '''
+        return None
+    
     def register_document(self, document):
         pass
         #for key, field in document._meta.fields.iteritems():
@@ -62,6 +89,31 @@ class BaseIndexStorage(BaseStorage):
     
     def on_delete(self, doc_class, collection, doc_id):
         raise NotImplementedError
+    
+    def on_save_many(self, doc_class, collection, entries):
+        '''
+        Is called with a list of (doc_id, data) when a unit of work is flushed
+        '''
+        for doc_id, data in entries:
+            self.on_save(doc_class, collection, doc_id, data)
+    
+    def on_delete_many(self, doc_class, collection, doc_ids):
+        for doc_id in doc_ids:
+            self.on_delete(doc_class, collection, doc_id)
+    
+    def on_update(self, doc_class, collection, doc_id, data, query_index):
+        '''
+        Is called for every document of a partial update that changed dot paths
+        the query index depends on
+        '''
+        self.on_save(doc_class, collection, doc_id, data)
+    
+    def on_patch(self, doc_class, collection, doc_ids, operations, query_index):
+        '''
+        Is called with the (dotpath, operation, value) updates applied to the
+        documents when the query index does not depend on the updated dot paths
+        '''
+        pass
 
 class BaseDocumentStorage(BaseStorage):
     _connections = DOCUMENT_BACKEND_CONNECTIONS
@@ -85,9 +137,64 @@ class BaseDocumentStorage(BaseStorage):
         '''
         raise NotImplementedError
     
+    def get_many(self, doc_class, collection, doc_ids):
+        '''
+        Returns a list of primitive data in the order of doc_ids, None for missing documents
+        '''
+        results = list()
+        for doc_id in doc_ids:
+            try:
+                results.append(self.get(doc_class, collection, doc_id))
+            except doc_class.DoesNotExist:
+                results.append(None)
+        return results
+    
+    def update(self, doc_class, collection, doc_ids, operations):
+        '''
+        Applies the (dotpath, operation, value) updates, operation being 'set'
+        or 'inc', to the given documents. Returns the number of documents.
+        Backends should override this to update the documents in place
+        '''
+        from dockit.schema.common import apply_primitive_update
+        count = 0
+        for data in self.get_many(doc_class, collection, doc_ids):
+            if data is None:
+                continue
+            for dotpath, operation, value in operations:
+                apply_primitive_update(data, dotpath, operation, value)
+            self.save(doc_class, collection, data)
+            count += 1
+        return count
+    
+    def iter_ids(self, doc_class, collection):
+        '''
+        Yields the id of every document in the collection as unicode, shortest ids
+        first and ids of equal length in ascending order
+        '''
+        raise NotImplementedError
+    
     def delete(self, doc_class, collection, doc_id):
         raise NotImplementedError
     
+    def save_many(self, doc_class, collection, datas):
+        '''
+        Saves a list of primitive data, used when a unit of work is flushed
+        '''
+        for data in datas:
+            self.save(doc_class, collection, data)
+    
+    def delete_many(self, doc_class, collection, doc_ids):
+        for doc_id in doc_ids:
+            self.delete(doc_class, collection, doc_id)
+    
+    def changes(self, doc_class, collection, since=0):
+        '''
+        Yields a dictionary with the sequence number (seq), the document id (id)
+        and whether it was deleted for the latest change of every document
+        changed after the sequence number since, in sequence order
+        '''
+        raise NotImplementedError
+    
     def get_id(self, data):
         return data.get(self.get_id_field_name())
     
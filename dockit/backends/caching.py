@@ -0,0 +1,229 @@
+import copy
+import threading
+import time
+
+from django.core.cache import get_cache
+
+from dockit.backends.base import BaseDocumentStorage
+from dockit.backends import get_document_backends
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+MISSING = '<dockit:missing>'
+
+class LRUCache(object):
+    '''
+    A thread safe in process cache evicting the least recently used entries
+    '''
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        '''
+        Returns the value or None if it is not cached or expired
+        '''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                return None
+            self.entries[key] = entry #most recently used entries are last
+            return entry[0]
+    
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + timeout)
+            while len(self.entries) > self.max_entries:
+                del self.entries[iter(self.entries).next()]
+    
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class CachingDocumentQuery(object):
+    '''
+    Wraps a query of the wrapped storage so deleting through it drops the
+    cached entries of the deleted documents
+    '''
+    def __init__(self, storage, collection, query):
+        self.storage = storage
+        self.collection = collection
+        self.query = query
+    
+    def __getattr__(self, name):
+        return getattr(self.query, name)
+    
+    def __len__(self):
+        return self.query.__len__()
+    
+    def __iter__(self):
+        return self.query.__iter__()
+    
+    def __getitem__(self, val):
+        return self.query.__getitem__(val)
+    
+    def __nonzero__(self):
+        return self.query.__nonzero__()
+    
+    def delete(self):
+        for doc_id in self.query.doc_ids():
+            self.storage.cache_delete(self.storage.get_key(self.collection, doc_id))
+        return self.query.delete()
+
+class CachingDocumentStorage(BaseDocumentStorage):
+    '''
+    Wraps another document storage and serves get() from an in process LRU
+    cache backed by a django cache. Writes go through to the wrapped storage.
+    Other processes only see a change through the django cache, their in
+    process entries expire after LOCAL_TIMEOUT.
+    
+    DOCKIT_BACKENDS = {
+        'default': {
+            'ENGINE': 'dockit.backends.caching.CachingDocumentStorage',
+            'STORAGE': 'store',
+        },
+        'store': {
+            'ENGINE': 'dockit.backends.djangodocument.backend.ModelDocumentStorage',
+        },
+    }
+    '''
+    thread_safe = True
+    name = "caching"
+    
+    def __init__(self, STORAGE, CACHE='default', KEY_PREFIX='dockit', MAX_ENTRIES=1000,
+                 TIMEOUT=300, LOCAL_TIMEOUT=30, NEGATIVE_TIMEOUT=5):
+        self.storage_name = STORAGE
+        self.cache = CACHE and get_cache(CACHE) or None
+        self.key_prefix = KEY_PREFIX
+        self.local_cache = LRUCache(MAX_ENTRIES)
+        self.timeout = TIMEOUT
+        self.local_timeout = LOCAL_TIMEOUT
+        self.negative_timeout = NEGATIVE_TIMEOUT
+        self.stats = {'hits':0, 'shared_hits':0, 'negative_hits':0, 'misses':0}
+    
+    @property
+    def storage(self):
+        return get_document_backends()[self.storage_name]()
+    
+    def get_key(self, collection, doc_id):
+        return '%s:%s:%s' % (self.key_prefix, collection, doc_id)
+    
+    def cache_get(self, key):
+        value = self.local_cache.get(key)
+        if value is not None:
+            if value == MISSING:
+                self.stats['negative_hits'] += 1
+            else:
+                self.stats['hits'] += 1
+            return value
+        if self.cache is not None:
+            value = self.cache.get(key)
+            if value is not None:
+                self.stats['shared_hits'] += 1
+                self.local_cache.set(key, value, self.local_timeout)
+                return value
+        self.stats['misses'] += 1
+        return None
+    
+    def cache_set(self, key, value):
+        timeout = value == MISSING and self.negative_timeout or self.timeout
+        self.local_cache.set(key, value, min(timeout, self.local_timeout))
+        if self.cache is not None:
+            self.cache.set(key, value, timeout)
+    
+    def cache_delete(self, key):
+        self.local_cache.delete(key)
+        if self.cache is not None:
+            self.cache.delete(key)
+    
+    def get_stats(self):
+        '''
+        Returns the lookup counters and the ratio of lookups answered by the cache
+        '''
+        stats = dict(self.stats)
+        total = sum(stats.values())
+        answered = stats['hits'] + stats['shared_hits'] + stats['negative_hits']
+        stats['hit_ratio'] = total and float(answered) / total or 0.0
+        return stats
+    
+    def get(self, doc_class, collection, doc_id):
+        key = self.get_key(collection, doc_id)
+        data = self.cache_get(key)
+        if data is None:
+            try:
+                data = self.storage.get(doc_class, collection, doc_id)
+            except doc_class.DoesNotExist:
+                self.cache_set(key, MISSING)
+                raise
+            self.cache_set(key, copy.deepcopy(data))
+            return data
+        if data == MISSING:
+            raise doc_class.DoesNotExist
+        return copy.deepcopy(data) #documents modify their primitive data
+    
+    def get_many(self, doc_class, collection, doc_ids):
+        results = dict()
+        to_fetch = list()
+        for doc_id in doc_ids:
+            data = self.cache_get(self.get_key(collection, doc_id))
+            if data is None:
+                to_fetch.append(doc_id)
+            elif data == MISSING:
+                results[doc_id] = None
+            else:
+                results[doc_id] = copy.deepcopy(data)
+        if to_fetch:
+            for doc_id, data in zip(to_fetch, self.storage.get_many(doc_class, collection, to_fetch)):
+                results[doc_id] = data
+                self.cache_set(self.get_key(collection, doc_id), data is None and MISSING or copy.deepcopy(data))
+        return [results[doc_id] for doc_id in doc_ids]
+    
+    def save(self, doc_class, collection, data):
+        self.storage.save(doc_class, collection, data)
+        self.cache_set(self.get_key(collection, self.get_id(data)), copy.deepcopy(data))
+    
+    def save_many(self, doc_class, collection, datas):
+        self.storage.save_many(doc_class, collection, datas)
+        for data in datas:
+            self.cache_set(self.get_key(collection, self.get_id(data)), copy.deepcopy(data))
+    
+    def update(self, doc_class, collection, doc_ids, operations):
+        count = self.storage.update(doc_class, collection, doc_ids, operations)
+        for doc_id in doc_ids:
+            self.cache_delete(self.get_key(collection, doc_id))
+        return count
+    
+    def delete(self, doc_class, collection, doc_id):
+        self.cache_delete(self.get_key(collection, doc_id))
+        return self.storage.delete(doc_class, collection, doc_id)
+    
+    def delete_many(self, doc_class, collection, doc_ids):
+        for doc_id in doc_ids:
+            self.cache_delete(self.get_key(collection, doc_id))
+        return self.storage.delete_many(doc_class, collection, doc_ids)
+    
+    def get_query(self, query_index):
+        return CachingDocumentQuery(self, query_index.collection, self.storage.get_query(query_index))
+    
+    def register_document(self, document):
+        return self.storage.register_document(document)
+    
+    def iter_ids(self, doc_class, collection):
+        return self.storage.iter_ids(doc_class, collection)
+    
+    def changes(self, doc_class, collection, since=0):
+        return self.storage.changes(doc_class, collection, since)
+    
+    def get_id_field_name(self):
+        return self.storage.get_id_field_name()
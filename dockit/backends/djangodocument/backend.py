@@ -1,24 +1,73 @@
-import json
-from django.core.serializers.json import DjangoJSONEncoder
+import time
+from django.db import models
 
 from dockit.backends.base import BaseDocumentStorage, BaseIndexStorage
 from dockit.backends.queryset import BaseDocumentQuery
 from dockit.backends import get_index_router, dynamic_import
+from dockit.backends.djangodocument.formats import encode_document, decode_document, load_document
 
-from dockit.backends.djangodocument.models import DocumentStore, RegisteredIndex, RegisteredIndexDocument
-from dockit.backends.djangodocument.utils import db_table_exists
+from dockit.backends.djangodocument.models import DocumentStore, DocumentChange, RegisteredIndex, RegisteredIndexDocument
+from dockit.backends.djangodocument.utils import db_table_exists, explain_sql, patch_json_rows
+from dockit.schema.common import resolve_primitive_dot_path
+from dockit.schema.exceptions import DotPathNotFound
+
+SQL_AGGREGATES = {'count': models.Count,
+                  'sum': models.Sum,
+                  'min': models.Min,
+                  'max': models.Max,}
 
 class DocumentQuery(BaseDocumentQuery):
+    chunk_size = 100
+    
     def __init__(self, query_index, queryset):
         super(DocumentQuery, self).__init__(query_index)
         self.queryset = queryset
     
     def wrap(self, entry):
-        data = json.loads(entry.data)
+        data = load_document(entry.data)
         data['_pk'] = entry.pk
-        return self.document.to_python(data)
+        return self.build_document(data)
+    
+    def wrap_many(self, entries):
+        return [self.wrap(entry) for entry in entries]
+    
+    def __iter__(self):
+        #the rows are read with one query and wrapped a chunk at a time
+        entries = list()
+        for entry in self.queryset.iterator():
+            entries.append(entry)
+            if len(entries) >= self.chunk_size:
+                for document in self.wrap_many(entries):
+                    yield document
+                entries = list()
+        for document in self.wrap_many(entries):
+            yield document
+    
+    def project(self, entries, limit_to, flat=False):
+        """
+        Projects (doc_id, primitive data) pairs onto the requested dot paths
+        """
+        if flat and len(limit_to) != 1:
+            raise TypeError("'flat' is only valid when values_list is called with a single dot path")
+        results = list()
+        for doc_id, data in entries:
+            row = list()
+            for key in limit_to:
+                if key == 'pk':
+                    row.append(doc_id)
+                elif key in data:
+                    row.append(data[key])
+                else:
+                    row.append(resolve_primitive_dot_path(data, key))
+            if flat:
+                results.append(row[0])
+            else:
+                results.append(tuple(row))
+        return results
     
     def delete(self):
+        doc_ids = list(self.queryset.values_list('pk', flat=True))
+        DocumentChange.objects.record(self.document._meta.collection, doc_ids, deleted=True)
         return self.queryset.delete()
     
     def get_from_filter_operations(self, filter_operations):
@@ -40,6 +89,21 @@ class DocumentQuery(BaseDocumentQuery):
             values_args.append('pk')
         return queryset.values(*values_args)
     
+    def doc_ids(self):
+        return [unicode(pk) for pk in self.queryset.values_list('pk', flat=True)]
+    
+    def values_list(self, *limit_to, **kwargs):
+        entries = ((doc_id, decode_document(data)) for doc_id, data in self.queryset.values_list('pk', 'data').iterator())
+        return self.project(entries, limit_to, flat=kwargs.get('flat', False))
+    
+    def explain(self, database=False):
+        sql, params = self.queryset.query.get_compiler(self.queryset.db).as_sql()
+        plan = {'sql': sql,
+                'params': params,}
+        if database:
+            plan['database'] = explain_sql(sql, params, self.queryset.db)
+        return plan
+    
     def __len__(self):
         return self.queryset.count()
     
@@ -48,20 +112,60 @@ class DocumentQuery(BaseDocumentQuery):
     
     def __getitem__(self, val):
         if isinstance(val, slice):
-            results = list()
-            for entry in self.queryset[val]:
-                results.append(self.wrap(entry))
-            return results
+            return self.wrap_many(self.queryset[val])
         else:
             return self.wrap(self.queryset[val])
 
 class IndexedDocumentQuery(DocumentQuery):
+    def delete(self):
+        return self.queryset.delete()
+    
+    def doc_ids(self):
+        return list(self.queryset.values_list('doc_id', flat=True))
+    
+    @property
+    def stores_documents(self):
+        return self.query_index.covered is None
+    
+    def covers(self, limit_to):
+        if self.stores_documents:
+            return True
+        covered = set(self.query_index.covered)
+        covered.add('pk')
+        return covered.issuperset(limit_to)
+    
+    def load_documents(self, doc_ids):
+        """
+        Loads the documents of a covering index from the document store with a single lookup.
+        """
+        backend = self.document._meta.get_document_backend_for_read()
+        results = list()
+        for data in backend.get_many(self.document, self.document._meta.collection, doc_ids):
+            if data is not None:
+                results.append(self.build_document(data))
+        return results
+    
     def wrap(self, entry):
-        data = json.loads(entry.data)
+        if not self.stores_documents:
+            results = self.load_documents([entry.doc_id])
+            if not results:
+                raise self.document.DoesNotExist(entry.doc_id)
+            return results[0]
+        data = load_document(entry.data)
         data['_pk'] = entry.doc_id
-        return self.document.to_python(data)
+        return self.build_document(data)
+    
+    def wrap_many(self, entries):
+        if not self.stores_documents:
+            return self.load_documents([entry.doc_id for entry in entries])
+        return super(IndexedDocumentQuery, self).wrap_many(entries)
     
     def values(self, *limit_to, **kwargs):
+        if limit_to and self.covers(limit_to):
+            results = list()
+            for row in self.values_list(*limit_to):
+                results.append(dict(zip(limit_to, row)))
+            return results
         queryset = self.queryset
         limit_to = set(limit_to)
         values_args = list()
@@ -84,17 +188,106 @@ class IndexedDocumentQuery(DocumentQuery):
             queryset = queryset.extra(select={'pk':'doc_id'})
             values_args.append('pk')
         return queryset.values(*values_args)
+    
+    def values_list(self, *limit_to, **kwargs):
+        flat = kwargs.get('flat', False)
+        if self.covers(limit_to):
+            #serve the values from the index rows
+            entries = ((doc_id, data and decode_document(data) or {}) for doc_id, data in self.queryset.values_list('doc_id', 'data').iterator())
+            return self.project(entries, limit_to, flat=flat)
+        #join on the document store
+        doc_ids = list(self.queryset.values_list('doc_id', flat=True))
+        backend = self.document._meta.get_document_backend_for_read()
+        documents = backend.get_many(self.document, self.document._meta.collection, doc_ids)
+        entries = [(doc_id, data) for doc_id, data in zip(doc_ids, documents) if data is not None]
+        return self.project(entries, limit_to, flat=flat)
+
+    def _check_indexed(self, key):
+        if key not in [op.key for op in self.query_index.indexes]:
+            raise ValueError('%s is not indexed by the selected index' % key)
+    
+    def _index_models_for(self, key):
+        """
+        Returns the index tables that may hold values for the key
+        """
+        try:
+            field = self.document._meta.dot_notation_to_field(key.replace('__', '.'))
+            return [RegisteredIndex.objects.lookup_index(field=field)]
+        except (DotPathNotFound, AssertionError):
+            return [index['model'] for index in RegisteredIndex.objects.index_models.itervalues()]
+    
+    def _index_rows(self, model, key):
+        return model.objects.filter(document__in=self.queryset, param_name=key, value__isnull=False)
+    
+    def _sql_partials(self, aggregate, lookup):
+        return dict([(partial, SQL_AGGREGATES[partial](lookup)) for partial in aggregate.partials])
+    
+    def aggregate(self, **aggregates):
+        results = dict()
+        for name, aggregate in aggregates.iteritems():
+            if aggregate.key is None:
+                #counts the documents of the index
+                if aggregate.partials != ('count',):
+                    raise ValueError('%s needs a dot path' % aggregate.name)
+                results[name] = aggregate.combine([{'count': self.queryset.count()}])
+                continue
+            self._check_indexed(aggregate.key)
+            partials = list()
+            for model in self._index_models_for(aggregate.key):
+                rows = self._index_rows(model, aggregate.key)
+                partials.append(rows.aggregate(**self._sql_partials(aggregate, 'value')))
+            results[name] = aggregate.combine(partials)
+        return results
+    
+    def annotate_group_by(self, dotpath, **aggregates):
+        key = dotpath.replace('.', '__')
+        groups = dict([(value, dict()) for value in self.distinct_values(dotpath)])
+        for name, aggregate in aggregates.iteritems():
+            for group_model in self._index_models_for(key):
+                if aggregate.key is None:
+                    rows = self._index_rows(group_model, key)
+                    rows = rows.values('value').annotate(count=models.Count('document', distinct=True))
+                    for row in rows:
+                        groups[row['value']].setdefault(name, list()).append(row)
+                    continue
+                self._check_indexed(aggregate.key)
+                for model in self._index_models_for(aggregate.key):
+                    prefix = model._meta.get_field('document').related.var_name
+                    rows = self._index_rows(group_model, key)
+                    rows = rows.filter(**{'document__%s__param_name' % prefix: aggregate.key,
+                                          'document__%s__value__isnull' % prefix: False})
+                    rows = rows.values('value').annotate(**self._sql_partials(aggregate, 'document__%s__value' % prefix))
+                    for row in rows:
+                        groups[row['value']].setdefault(name, list()).append(row)
+        results = list()
+        for value in sorted(groups.keys()):
+            entry = {dotpath: value}
+            for name, aggregate in aggregates.iteritems():
+                entry[name] = aggregate.combine(groups[value].get(name, []))
+            results.append(entry)
+        return results
+    
+    def distinct_values(self, dotpath):
+        key = dotpath.replace('.', '__')
+        self._check_indexed(key)
+        values = set()
+        for model in self._index_models_for(key):
+            values.update(self._index_rows(model, key).values_list('value', flat=True).distinct())
+        return sorted(values)
 
 class ModelIndexStorage(BaseIndexStorage):
     thread_safe = True #we use the django orm which takes care of thread safety for us
     name = "djangomodel"
     _indexers = dict() #TODO this should be automatic
     
-    def __init__(self, INDEX_TASKS='dockit.backends.djangodocument.tasks.IndexTasks'):
+    def __init__(self, INDEX_TASKS='dockit.backends.djangodocument.tasks.IndexTasks', STATISTICS_TIMEOUT=60, FULLTEXT_ADAPTER=None):
         self._tables_exist = False
         self.indexes = dict()
         self.pending_indexes = set()
         self.index_tasks = dynamic_import(INDEX_TASKS)()
+        self.statistics_timeout = STATISTICS_TIMEOUT
+        self._statistics = dict()
+        self._fulltext_adapter = FULLTEXT_ADAPTER
         from dockit.backends.djangodocument import indexers
     
     def _register_pending_indexes(self):
@@ -117,6 +310,47 @@ class ModelIndexStorage(BaseIndexStorage):
     def reindex(self, query_index):
         self.index_tasks.reindex(query_index)
     
+    @property
+    def fulltext_adapter(self):
+        if self._fulltext_adapter is None:
+            from dockit.backends.djangodocument.fulltext import get_default_adapter
+            self._fulltext_adapter = get_default_adapter()
+        elif isinstance(self._fulltext_adapter, str):
+            self._fulltext_adapter = dynamic_import(self._fulltext_adapter)()
+        return self._fulltext_adapter
+    
+    def _get_indexer_for_operation(self, document, op):
+        indexer = super(ModelIndexStorage, self)._get_indexer_for_operation(document, op)
+        indexer.storage = self
+        return indexer
+    
+    def analyze(self, query_index):
+        self._register_pending_indexes()
+        self.index_tasks.analyze(query_index)
+        self._statistics.pop((query_index.collection, query_index._index_hash()), None)
+    
+    def get_index_statistics(self, query_index):
+        #statistics are consulted for every query so we hold on to them for a little while
+        key = (query_index.collection, query_index._index_hash())
+        now = time.time()
+        if key in self._statistics:
+            fetched, statistics = self._statistics[key]
+            if now - fetched < self.statistics_timeout:
+                return statistics
+        if not (self._tables_exist or db_table_exists(RegisteredIndex._meta.db_table)):
+            return None
+        statistics = RegisteredIndex.objects.get_statistics(query_index.collection, key[1])
+        self._statistics[key] = (now, statistics)
+        return statistics
+    
+    def get_counts(self, query_index, key):
+        self._register_pending_indexes()
+        return RegisteredIndex.objects.get_counts(query_index.collection, query_index._index_hash(), key)
+    
+    def get_count(self, query_index, key, value):
+        self._register_pending_indexes()
+        return RegisteredIndex.objects.get_count(query_index.collection, query_index._index_hash(), key, value)
+    
     def get_query(self, query_index):
         #lookup the appropriate query index
         self._register_pending_indexes()
@@ -127,7 +361,12 @@ class ModelIndexStorage(BaseIndexStorage):
         for op in match['inclusions']:
             indexer = self._get_indexer_for_operation(document, op)
             queryset = queryset.filter(indexer.filter())
+            extra = indexer.extra()
+            if extra:
+                queryset = queryset.extra(**extra)
         for op in match['exclusions']:
+            if op.operation == 'search':
+                raise ValueError('Full text lookups cannot be excluded')
             indexer = self._get_indexer_for_operation(document, op)
             queryset = queryset.exclude(indexer.filter())
         return IndexedDocumentQuery(query_index, queryset)
@@ -140,7 +379,24 @@ class ModelIndexStorage(BaseIndexStorage):
     def on_delete(self, doc_class, collection, doc_id):
         self._register_pending_indexes()
         self.index_tasks.on_delete(collection, doc_id)
-        #RegisteredIndex.objects.on_delete(collection, doc_id)
+    
+    def on_save_many(self, doc_class, collection, entries):
+        self._register_pending_indexes()
+        self.index_tasks.on_save_many(collection, entries)
+    
+    def on_delete_many(self, doc_class, collection, doc_ids):
+        self._register_pending_indexes()
+        self.index_tasks.on_delete_many(collection, doc_ids)
+    
+    def on_update(self, doc_class, collection, doc_id, data, query_index):
+        self._register_pending_indexes()
+        self.index_tasks.on_update(query_index, doc_id, data)
+    
+    def on_patch(self, doc_class, collection, doc_ids, operations, query_index):
+        if query_index.covered is not None:
+            return #the index keeps no copy of the updated dot paths
+        self._register_pending_indexes()
+        self.index_tasks.on_patch(query_index, doc_ids, operations)
 
 class ModelDocumentStorage(BaseDocumentStorage):
     thread_safe = True #we use the django orm which takes care of thread safety for us
@@ -151,26 +407,67 @@ class ModelDocumentStorage(BaseDocumentStorage):
     
     def save(self, doc_class, collection, data):
         doc_id = self.get_id(data)
-        encoded_data = json.dumps(data, cls=DjangoJSONEncoder)
+        encoded_data = encode_document(collection, data)
         document = DocumentStore(collection=collection, data=encoded_data)
         if doc_id is not None:
             document.pk = doc_id
         #CONSIDER this does not look before we save
         document.save()
         data[self.get_id_field_name()] = document.pk
+        DocumentChange.objects.record(collection, [document.pk])
     
     def get(self, doc_class, collection, doc_id):
         try:
             document = DocumentStore.objects.get(collection=collection, pk=doc_id)
         except DocumentStore.DoesNotExist:
             raise doc_class.DoesNotExist
-        data = json.loads(document.data)
+        data = load_document(document.data)
         data[self.get_id_field_name()] = document.pk
         return data
     
+    def get_many(self, doc_class, collection, doc_ids):
+        found = dict()
+        for document in DocumentStore.objects.filter(collection=collection, pk__in=doc_ids):
+            data = load_document(document.data)
+            data[self.get_id_field_name()] = document.pk
+            found[unicode(document.pk)] = data
+        return [found.get(unicode(doc_id)) for doc_id in doc_ids]
+    
+    def update(self, doc_class, collection, doc_ids, operations):
+        queryset = DocumentStore.objects.filter(collection=collection, pk__in=doc_ids)
+        count = patch_json_rows(queryset, operations)
+        DocumentChange.objects.record(collection, doc_ids)
+        return count
+    
+    def iter_ids(self, doc_class, collection):
+        #positive integers sort numerically the same way
+        queryset = DocumentStore.objects.filter(collection=collection).order_by('pk').values_list('pk', flat=True)
+        for pk in queryset.iterator():
+            yield unicode(pk)
+    
     def delete(self, doc_class, collection, doc_id):
+        DocumentChange.objects.record(collection, [doc_id], deleted=True)
         return DocumentStore.objects.filter(collection=collection, pk=doc_id).delete()
     
+    def save_many(self, doc_class, collection, datas):
+        saved = list()
+        for data in datas:
+            document = DocumentStore(collection=collection, data=encode_document(collection, data))
+            doc_id = self.get_id(data)
+            if doc_id is not None:
+                document.pk = doc_id
+            document.save()
+            data[self.get_id_field_name()] = document.pk
+            saved.append(document.pk)
+        DocumentChange.objects.record(collection, saved)
+    
+    def delete_many(self, doc_class, collection, doc_ids):
+        DocumentChange.objects.record(collection, doc_ids, deleted=True)
+        return DocumentStore.objects.filter(collection=collection, pk__in=doc_ids).delete()
+    
+    def changes(self, doc_class, collection, since=0):
+        return DocumentChange.objects.changes(collection, since)
+    
     def get_query(self, query_index):
         document = query_index.document
         queryset = DocumentStore.objects.filter(collection=query_index.document._meta.collection)
@@ -0,0 +1,182 @@
+"""
+Storage formats of the document and index copy columns. Plain json is
+stored as is, the other formats start with a versioned header naming them:
+    
+    ~1:zlib:<base64 of the zlib compressed json>
+
+Rows of any format can be read whichever format the collection writes,
+recompressdocuments converts the existing rows. The format is picked per
+collection by the DOCKIT_STORAGE_FORMATS setting:
+    
+    DOCKIT_STORAGE_FORMATS = {
+        'default': 'json',
+        'myapp.bigdocument': 'zlib',
+    }
+    DOCKIT_COMPRESSION_LEVEL = 6
+"""
+import base64
+import zlib
+
+from django.conf import settings
+
+try:
+    import bson
+except ImportError:
+    bson = None
+
+from dockit.backends.jsoncodec import get_json_codec
+from dockit.schema.serializer import UntypedData
+
+HEADER_PREFIX = '~'
+VERSION = 1
+
+def mark_untyped(data, payload):
+    #typed values are encoded as objects with a __type__ key
+    if '__type__' in payload:
+        return data
+    return UntypedData(data)
+
+class StorageFormat(object):
+    name = None
+    
+    def __init__(self, level=6):
+        self.level = level
+    
+    @classmethod
+    def is_available(cls):
+        return True
+    
+    @property
+    def header(self):
+        return '%s%s:%s:' % (HEADER_PREFIX, VERSION, self.name)
+    
+    def encode(self, data):
+        raise NotImplementedError
+    
+    def decode(self, text):
+        raise NotImplementedError
+    
+    def load(self, text):
+        '''
+        Decodes a stored document, as UntypedData if it holds no typed values
+        '''
+        return self.decode(text)
+
+class JSONFormat(StorageFormat):
+    '''
+    Plain json without a header, the format rows were always written in
+    '''
+    name = 'json'
+    
+    @property
+    def header(self):
+        return ''
+    
+    def encode(self, data):
+        return get_json_codec().dumps(data)
+    
+    def decode(self, text):
+        return get_json_codec().loads(text)
+    
+    def load(self, text):
+        return mark_untyped(self.decode(text), text)
+
+class ZlibFormat(StorageFormat):
+    '''
+    Compressed json
+    '''
+    name = 'zlib'
+    
+    def compress(self, payload):
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        return self.header + base64.b64encode(zlib.compress(payload, self.level))
+    
+    def decompress(self, text):
+        return zlib.decompress(base64.b64decode(text[len(self.header):]))
+    
+    def encode(self, data):
+        return self.compress(get_json_codec().dumps(data))
+    
+    def decode(self, text):
+        return get_json_codec().loads(self.decompress(text))
+    
+    def load(self, text):
+        payload = self.decompress(text)
+        return mark_untyped(get_json_codec().loads(payload), payload)
+
+class BSONFormat(ZlibFormat):
+    '''
+    Compressed BSON, available when the bson package of pymongo is installed.
+    The data is passed through json first so it reads back with the same
+    types as the other formats.
+    '''
+    name = 'bson'
+    
+    @classmethod
+    def is_available(cls):
+        return bson is not None
+    
+    def encode(self, data):
+        codec = get_json_codec()
+        return self.compress(bson.BSON.encode(codec.loads(codec.dumps(data))))
+    
+    def decode(self, text):
+        return bson.BSON(self.decompress(text)).decode()
+    
+    def load(self, text):
+        payload = self.decompress(text)
+        return mark_untyped(bson.BSON(payload).decode(), payload)
+
+FORMATS = dict([(storage_format.name, storage_format) for storage_format in [JSONFormat, ZlibFormat, BSONFormat]
+                if storage_format.is_available()])
+
+STORAGE_FORMATS = None
+
+def get_storage_formats():
+    '''
+    Returns the format instances by name
+    '''
+    global STORAGE_FORMATS
+    if STORAGE_FORMATS is None:
+        level = getattr(settings, 'DOCKIT_COMPRESSION_LEVEL', 6)
+        STORAGE_FORMATS = dict([(name, storage_format(level)) for name, storage_format in FORMATS.iteritems()])
+    return STORAGE_FORMATS
+
+def get_storage_format(collection=None, name=None):
+    '''
+    Returns the format the collection is written in
+    '''
+    if name is None:
+        config = getattr(settings, 'DOCKIT_STORAGE_FORMATS', {})
+        name = config.get(collection, config.get('default', 'json'))
+    try:
+        return get_storage_formats()[name]
+    except KeyError:
+        raise ValueError('Unknown storage format: %s' % name)
+
+def get_format_of(text):
+    '''
+    Returns the format the text was written in
+    '''
+    if not text.startswith(HEADER_PREFIX):
+        return get_storage_format(name='json')
+    version, name = text[len(HEADER_PREFIX):].split(':', 2)[:2]
+    if version != str(VERSION):
+        raise ValueError('Unsupported storage format version: %s' % version)
+    return get_storage_format(name=name)
+
+def encode_document(collection, data):
+    return get_storage_format(collection).encode(data)
+
+def decode_document(text):
+    '''
+    Decodes a row of any format
+    '''
+    return get_format_of(text).decode(text)
+
+def load_document(text):
+    '''
+    Decodes a stored document of any format for loading
+    '''
+    return get_format_of(text).load(text)
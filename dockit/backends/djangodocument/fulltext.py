@@ -0,0 +1,110 @@
+from django.db import connections, DatabaseError
+from django.db.models import Q
+
+from dockit.backends.djangodocument.models import RegisteredIndexDocument, FullTextEntry
+
+class BaseFullTextAdapter(object):
+    """
+    Answers full text lookups against the FullTextEntry rows maintained by
+    the index pipeline. Adapters return the filter and extra arguments applied
+    to the RegisteredIndexDocument queryset.
+    """
+    def __init__(self, using='default'):
+        self.using = using
+    
+    @property
+    def connection(self):
+        return connections[self.using]
+    
+    def get_terms(self, query):
+        return [term for term in query.split() if term]
+    
+    def filter(self, param_name, query):
+        return Q()
+    
+    def extra(self, param_name, query):
+        return None
+
+class ContainsFullTextAdapter(BaseFullTextAdapter):
+    """
+    Portable adapter matching every term as a case insensitive substring.
+    Results are not ranked.
+    """
+    def filter(self, param_name, query):
+        entries = FullTextEntry.objects.filter(param_name=param_name)
+        for term in self.get_terms(query):
+            entries = entries.filter(content__icontains=term)
+        return Q(pk__in=entries.values('document'))
+
+class SQLiteFTS5Adapter(BaseFullTextAdapter):
+    """
+    Maintains an external content FTS5 table over the FullTextEntry rows,
+    kept in sync by triggers, and ranks matches with bm25.
+    """
+    table = 'dockit_fulltext'
+    
+    def table_exists(self):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [self.table])
+        return cursor.fetchone() is not None
+    
+    def create_table(self):
+        entries = FullTextEntry._meta.db_table
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(content, content='%s', content_rowid='id')" % (self.table, entries))
+        cursor.execute("CREATE TRIGGER %(fts)s_insert AFTER INSERT ON %(entries)s BEGIN "
+                       "INSERT INTO %(fts)s(rowid, content) VALUES (new.id, new.content); END" % {'fts': self.table, 'entries': entries})
+        cursor.execute("CREATE TRIGGER %(fts)s_delete AFTER DELETE ON %(entries)s BEGIN "
+                       "INSERT INTO %(fts)s(%(fts)s, rowid, content) VALUES ('delete', old.id, old.content); END" % {'fts': self.table, 'entries': entries})
+        cursor.execute("CREATE TRIGGER %(fts)s_update AFTER UPDATE ON %(entries)s BEGIN "
+                       "INSERT INTO %(fts)s(%(fts)s, rowid, content) VALUES ('delete', old.id, old.content); "
+                       "INSERT INTO %(fts)s(rowid, content) VALUES (new.id, new.content); END" % {'fts': self.table, 'entries': entries})
+        #entries written before the table existed
+        cursor.execute("INSERT INTO %(fts)s(%(fts)s) VALUES ('rebuild')" % {'fts': self.table})
+    
+    def prepare(self):
+        if not self.table_exists():
+            self.create_table()
+    
+    def get_match_query(self, query):
+        #quote every term so user input is never parsed as fts syntax
+        return ' '.join(['"%s"' % term.replace('"', '""') for term in self.get_terms(query)])
+    
+    def extra(self, param_name, query):
+        self.prepare()
+        qn = self.connection.ops.quote_name
+        match = self.get_match_query(query)
+        params = {'fts': qn(self.table),
+                  'entries': qn(FullTextEntry._meta.db_table),
+                  'documents': qn(RegisteredIndexDocument._meta.db_table),}
+        where = ('%(documents)s.id IN (SELECT entries.document_id FROM %(fts)s '
+                 'JOIN %(entries)s entries ON entries.id = %(fts)s.rowid '
+                 'WHERE %(fts)s MATCH %%s AND entries.param_name = %%s)' % params)
+        rank = ('(SELECT MIN(%(fts)s.rank) FROM %(fts)s '
+                'JOIN %(entries)s entries ON entries.id = %(fts)s.rowid '
+                'WHERE %(fts)s MATCH %%s AND entries.param_name = %%s '
+                'AND entries.document_id = %(documents)s.id)' % params)
+        rank_name = 'fulltext_rank_%s' % param_name
+        return {'where': [where],
+                'params': [match, param_name],
+                'select': {rank_name: rank},
+                'select_params': [match, param_name],
+                'order_by': [rank_name],}
+    
+    @classmethod
+    def is_available(cls, using='default'):
+        connection = connections[using]
+        if connection.vendor != 'sqlite':
+            return False
+        cursor = connection.cursor()
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.dockit_fts5_probe USING fts5(content)")
+        except DatabaseError:
+            return False
+        cursor.execute("DROP TABLE temp.dockit_fts5_probe")
+        return True
+
+def get_default_adapter(using='default'):
+    if SQLiteFTS5Adapter.is_available(using):
+        return SQLiteFTS5Adapter(using)
+    return ContainsFullTextAdapter(using)
@@ -90,3 +90,19 @@ class ExactIndexer(BaseIndexer):
 
 ModelIndexStorage.register_indexer(ExactIndexer, 'exact', 'iexact', 'startswith', 'endswith', 'istartswith', 'iendswith', 'year', 'month', 'day', 'lt', 'gt', 'lte', 'gte')
 
+
+class FullTextIndexer(ExactIndexer):
+    """
+    Matches documents whose indexed text contains every term of the query,
+    ranked when the full text adapter supports it.
+    """
+    def get_adapter(self):
+        return self.storage.fulltext_adapter
+    
+    def filter(self):
+        return self.get_adapter().filter(self.filter_operation.key, self.filter_operation.value)
+    
+    def extra(self):
+        return self.get_adapter().extra(self.filter_operation.key, self.filter_operation.value)
+
+ModelIndexStorage.register_indexer(FullTextIndexer, 'search')
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from dockit.backends import get_index_router
+from dockit.backends.djangodocument.models import RegisteredIndex
+
+from optparse import make_option
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--repair', action='store_true', dest='repair', default=False,
+                    help='Adds missing documents to the indexes, removes orphaned entries and evaluates '
+                         'excluded and stale entries again. Implies --verify.'),
+        make_option('--verify', action='store_true', dest='verify', default=False,
+                    help='Evaluates the indexed documents again to find entries that no longer pass '
+                         'the filters or whose values are out of date.'),
+        make_option('--purge', action='store_true', dest='purge', default=False,
+                    help='Deletes the rows of indexes that are no longer registered.'),
+        make_option('--batch-size', default=500, dest='batch_size', type='int',
+                    help='Number of documents loaded or repaired at a time.'),
+    )
+    help = ("Compares the django model indexes with the stored documents and "
+            "reports documents missing from an index and orphaned index entries.")
+    args = '[collection ...]'
+
+    def handle(self, *collections, **options):
+        repair = options.get('repair', False)
+        verify = options.get('verify', False)
+        purge = options.get('purge', False)
+        batch_size = options.get('batch_size', 500)
+        router = get_index_router()
+        router.make_app_ready()
+        
+        for registered_index in RegisteredIndex.objects.get_stale_indexes():
+            if collections and registered_index.collection not in collections:
+                continue
+            if purge:
+                registered_index.delete()
+                self.stdout.write('Purged stale index %s of %s\n' % (registered_index.name, registered_index.collection))
+            else:
+                self.stdout.write('Stale index %s of %s\n' % (registered_index.name, registered_index.collection))
+        
+        for collection, querysets in router.registered_querysets.iteritems():
+            if collections and collection not in collections:
+                continue
+            for query_hash, query_index in querysets.iteritems():
+                try:
+                    registered_index = RegisteredIndex.objects.get(collection=collection, query_hash=query_hash)
+                except RegisteredIndex.DoesNotExist:
+                    continue #indexed by another backend or not yet registered
+                report = RegisteredIndex.objects.check_index(registered_index, query_index, repair=repair,
+                                                             batch_size=batch_size, verify=verify)
+                self.stdout.write('%s index %s: %s missing, %s orphaned, %s excluded, %s stale%s\n' % (
+                    collection, registered_index.name, len(report['missing']), len(report['orphaned']),
+                    len(report['excluded']), len(report['stale']), repair and ' (repaired)' or ''))
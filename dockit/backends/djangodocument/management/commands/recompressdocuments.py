@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dockit.backends.djangodocument.models import DocumentStore, RegisteredIndexDocument
+from dockit.backends.djangodocument.formats import get_storage_format, get_format_of
+
+from optparse import make_option
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--format', default=None, dest='format',
+                    help='Storage format to write, defaults to the format configured for each collection.'),
+        make_option('--force', action='store_true', dest='force', default=False,
+                    help='Rewrites rows already in the format, for instance after changing the compression level.'),
+        make_option('--batch-size', default=500, dest='batch_size', type='int',
+                    help='Number of rows converted at a time.'),
+    )
+    help = ("Converts the stored documents and index copies to the storage "
+            "format of their collection.")
+    args = '[collection ...]'
+    
+    def handle(self, *collections, **options):
+        target = options.get('format', None)
+        if target:
+            target = get_storage_format(name=target)
+        force = options.get('force', False)
+        batch_size = options.get('batch_size', 500)
+        
+        converted = self.convert(DocumentStore.objects.all(), 'collection', collections, target, force, batch_size)
+        self.stdout.write('Converted %s documents\n' % converted)
+        converted = self.convert(RegisteredIndexDocument.objects.all(), 'index__collection', collections, target, force, batch_size)
+        self.stdout.write('Converted %s index documents\n' % converted)
+    
+    def convert(self, queryset, collection_field, collections, target, force, batch_size):
+        if collections:
+            queryset = queryset.filter(**{'%s__in' % collection_field: collections})
+        queryset = queryset.order_by('pk')
+        converted = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list('pk', collection_field, 'data')[:batch_size])
+            if not rows:
+                break
+            for pk, collection, text in rows:
+                last_pk = pk
+                if not text:
+                    continue
+                storage_format = target or get_storage_format(collection)
+                current_format = get_format_of(text)
+                if current_format is storage_format and not force:
+                    continue
+                data = current_format.decode(text)
+                #rows saved in the meantime are left alone
+                if queryset.model.objects.filter(pk=pk, data=text).update(data=storage_format.encode(data)):
+                    converted += 1
+            transaction.commit_unless_managed()
+        return converted
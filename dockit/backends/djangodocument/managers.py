@@ -1,13 +1,57 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Count
 import json
+import datetime
+import hashlib
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.exceptions import ObjectDoesNotExist
 
-from dockit.schema.common import DotPathTraverser, DotPathNotFound
+from dockit.backends.djangodocument.formats import encode_document, decode_document
+from dockit.schema.common import DotPathTraverser, DotPathNotFound, resolve_primitive_dot_path
 
 class DocumentManager(models.Manager):
     pass
 
+class DocumentChangeManager(models.Manager):
+    def record(self, collection, doc_ids, deleted=False):
+        """
+        Records a change with a new sequence number for each document and
+        drops their previous changes.
+        """
+        for doc_id in doc_ids:
+            #insert before deleting so a reused rowid can never lower the sequence
+            change = self.create(collection=collection, doc_id=unicode(doc_id), deleted=deleted)
+            self.filter(collection=collection, doc_id=change.doc_id, pk__lt=change.pk).delete()
+    
+    def changes(self, collection, since=0):
+        queryset = self.filter(collection=collection, pk__gt=since).order_by('pk')
+        for change in queryset.iterator():
+            yield {'seq': change.pk,
+                   'id': change.doc_id,
+                   'deleted': change.deleted,}
+
+def merge_sorted_ids(left, right):
+    """
+    Walks two iterators of ids sorted by length and value, yielding
+    (id, in left, in right) for every id found in either.
+    """
+    key = lambda value: (len(value), value)
+    left = iter(left)
+    right = iter(right)
+    left_id = next(left, None)
+    right_id = next(right, None)
+    while left_id is not None or right_id is not None:
+        if right_id is None or (left_id is not None and key(left_id) < key(right_id)):
+            yield left_id, True, False
+            left_id = next(left, None)
+        elif left_id is None or key(right_id) < key(left_id):
+            yield right_id, False, True
+            right_id = next(right, None)
+        else:
+            yield left_id, True, True
+            left_id = next(left, None)
+            right_id = next(right, None)
+
 class NotGiven(object):
     def __nonzero__(self):
         return False
@@ -56,6 +100,8 @@ class RegisteredIndexManager(models.Manager):
             if obj.query_hash == query_hash:
                 return
             obj.query_hash = query_hash
+            obj.analyzed = None #collected statistics describe the old query
+            obj.counters.all().delete()
             for index in self.index_models.itervalues():
                 index['model'].objects.filter(document__index=obj).delete()
             obj.save()
@@ -71,6 +117,154 @@ class RegisteredIndexManager(models.Manager):
         for doc in documents:
             self.evaluate_query_index(obj, query_index, doc.pk, doc.to_primitive(doc))
     
+    def iter_indexed_ids(self, registered_index):
+        """
+        Yields the doc ids of the registered index in the order of iter_ids
+        """
+        from dockit.backends.djangodocument.models import RegisteredIndexDocument
+        queryset = RegisteredIndexDocument.objects.filter(index=registered_index)
+        queryset = queryset.extra(select={'doc_id_length': 'LENGTH(doc_id)'}, order_by=['doc_id_length', 'doc_id'])
+        for doc_id, length in queryset.values_list('doc_id', 'doc_id_length').iterator():
+            yield doc_id
+    
+    def check_index(self, registered_index, query_index, repair=False, batch_size=500, verify=False):
+        """
+        Merges the sorted ids of the documents with the sorted ids of the index
+        and returns the ids of the documents missing from the index and of the
+        index entries whose document no longer exists. With verify, implied by
+        repair, the documents found on both sides are evaluated again to find
+        entries that no longer pass the filters (excluded) or whose values are
+        out of date (stale). With repair the differences are fixed in batches.
+        """
+        document = query_index.document
+        backend = document._meta.get_document_backend_for_read()
+        missing = list()
+        orphaned = list()
+        excluded = list()
+        stale = list()
+        unindexed = list()
+        indexed = list()
+        verify = verify or repair
+        
+        def check_unindexed():
+            #documents outside of the index are fine if they do not pass the filters
+            for doc_id, data in zip(unindexed, backend.get_many(document, registered_index.collection, unindexed)):
+                if data is None:
+                    continue
+                if self.passes_filters(query_index, data):
+                    missing.append(doc_id)
+            del unindexed[:]
+        
+        def check_indexed():
+            documents = backend.get_many(document, registered_index.collection, indexed)
+            entries = self.get_index_entries(registered_index, query_index, indexed)
+            for doc_id, data in zip(indexed, documents):
+                if data is None or doc_id not in entries:
+                    continue
+                if not self.passes_filters(query_index, data):
+                    excluded.append(doc_id)
+                elif entries[doc_id] != self.get_index_entry(query_index, data):
+                    stale.append(doc_id)
+            del indexed[:]
+        
+        doc_ids = backend.iter_ids(document, registered_index.collection)
+        indexed_ids = self.iter_indexed_ids(registered_index)
+        for doc_id, in_documents, in_index in merge_sorted_ids(doc_ids, indexed_ids):
+            if in_documents and not in_index:
+                unindexed.append(doc_id)
+                if len(unindexed) >= batch_size:
+                    check_unindexed()
+            elif in_index and not in_documents:
+                orphaned.append(doc_id)
+            elif verify:
+                indexed.append(doc_id)
+                if len(indexed) >= batch_size:
+                    check_indexed()
+        check_unindexed()
+        if indexed:
+            check_indexed()
+        
+        if repair:
+            self.repair_index(registered_index, query_index, missing + stale, orphaned + excluded, batch_size)
+        return {'missing': missing,
+                'orphaned': orphaned,
+                'excluded': excluded,
+                'stale': stale,}
+    
+    def get_index_entry(self, query_index, data):
+        """
+        Returns the stored copy and the sorted values the index keeps for the document
+        """
+        values = dict()
+        for param in query_index.indexes:
+            value = self.resolve_index_value(query_index, param, data)[0]
+            if not isinstance(value, (list, set)):
+                value = [value]
+            values[param.key] = sorted([self.normalize_index_value(entry) for entry in value])
+        return self.decode_index_document(self.encode_index_document(query_index, data)), values
+    
+    def get_index_entries(self, registered_index, query_index, doc_ids):
+        """
+        Returns the stored copy and the sorted indexed values by document id
+        """
+        from dockit.backends.djangodocument.models import RegisteredIndexDocument
+        index_docs = dict()
+        entries = dict()
+        for pk, doc_id, data in RegisteredIndexDocument.objects.filter(index=registered_index, doc_id__in=doc_ids).values_list('pk', 'doc_id', 'data'):
+            index_docs[pk] = doc_id
+            entries[doc_id] = (self.decode_index_document(data), dict([(param.key, list()) for param in query_index.indexes]))
+        for index in self.index_models.itervalues():
+            rows = index['model'].objects.filter(document__in=index_docs.keys()).values_list('document', 'param_name', 'value')
+            for pk, param_name, value in rows:
+                values = entries[index_docs[pk]][1]
+                if param_name in values:
+                    values[param_name].append(self.normalize_index_value(value))
+        for data, values in entries.itervalues():
+            for entry in values.itervalues():
+                entry.sort()
+        return entries
+    
+    def decode_index_document(self, text):
+        if not text:
+            return None
+        return decode_document(text)
+    
+    def normalize_index_value(self, value):
+        from dockit.schema import Document
+        if isinstance(value, (models.Model, Document)):
+            return value.pk
+        return value
+    
+    def repair_index(self, registered_index, query_index, missing, orphaned, batch_size=500):
+        """
+        Removes the entries of the orphaned ids and evaluates the documents of the missing ids
+        """
+        from dockit.backends.djangodocument.models import RegisteredIndexDocument
+        document = query_index.document
+        backend = document._meta.get_document_backend_for_read()
+        for start in range(0, len(orphaned), batch_size):
+            batch = orphaned[start:start+batch_size]
+            for index_doc in RegisteredIndexDocument.objects.filter(index=registered_index, doc_id__in=batch).select_related('index'):
+                self.remove_index_document(index_doc, query_index)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start+batch_size]
+            for doc_id, data in zip(batch, backend.get_many(document, registered_index.collection, batch)):
+                if data is not None:
+                    self.evaluate_query_index(registered_index, query_index, doc_id, data)
+    
+    def get_stale_indexes(self):
+        """
+        Returns the registered indexes whose query is no longer registered
+        """
+        from dockit.backends import get_index_router
+        router = get_index_router()
+        router.make_app_ready()
+        stale = list()
+        for registered_index in self.all():
+            if registered_index.query_hash not in router.registered_querysets.get(registered_index.collection, {}):
+                stale.append(registered_index)
+        return stale
+    
     def on_save(self, collection, doc_id, data):
         from dockit.backends import INDEX_ROUTER
         if collection not in INDEX_ROUTER.registered_querysets:
@@ -78,20 +272,134 @@ class RegisteredIndexManager(models.Manager):
         registered_queries = self.filter(collection=collection)
         for query in registered_queries:
             if query.query_hash not in INDEX_ROUTER.registered_querysets[collection]:
-                continue #TODO stale index, perhaps we should remove
+                continue #stale index, purged by the checkindexes command
             query_index = INDEX_ROUTER.registered_querysets[collection][query.query_hash]
             self.evaluate_query_index(query, query_index, doc_id, data)
     
     def on_delete(self, collection, doc_id):
+        from dockit.backends import get_index_router
         from dockit.backends.djangodocument.models import RegisteredIndexDocument
-        RegisteredIndexDocument.objects.filter(index__collection=collection, doc_id=doc_id).delete()
+        querysets = get_index_router().registered_querysets.get(collection, {})
+        for index_doc in RegisteredIndexDocument.objects.filter(index__collection=collection, doc_id=doc_id).select_related('index'):
+            self.remove_index_document(index_doc, querysets.get(index_doc.index.query_hash))
     
-    def evaluate_query_index(self, registered_index, query_index, doc_id, data):
+    def on_save_many(self, collection, entries):
+        """
+        Indexes a list of (doc_id, data) with a few queries per index instead
+        of a few per document
+        """
+        from dockit.backends import INDEX_ROUTER
+        if collection not in INDEX_ROUTER.registered_querysets:
+            return #no querysets have been registered
+        registered_queries = self.filter(collection=collection)
+        for query in registered_queries:
+            if query.query_hash not in INDEX_ROUTER.registered_querysets[collection]:
+                continue #stale index, purged by the checkindexes command
+            query_index = INDEX_ROUTER.registered_querysets[collection][query.query_hash]
+            self.evaluate_query_index_many(query, query_index, entries)
+    
+    def on_delete_many(self, collection, doc_ids):
+        from dockit.backends import get_index_router
         from dockit.backends.djangodocument.models import RegisteredIndexDocument
+        querysets = get_index_router().registered_querysets.get(collection, {})
+        index_docs = RegisteredIndexDocument.objects.filter(index__collection=collection,
+                                                            doc_id__in=[unicode(doc_id) for doc_id in doc_ids])
+        grouped = dict()
+        for index_doc in index_docs.select_related('index'):
+            grouped.setdefault(index_doc.index_id, list()).append(index_doc)
+        for batch in grouped.itervalues():
+            registered_index = batch[0].index
+            self.remove_index_documents(registered_index, batch, querysets.get(registered_index.query_hash))
+    
+    def get_registered_query(self, name, collection, query_hash):
+        """
+        Returns the registered index and its query index or (None, None) if either is gone
+        """
+        from dockit.backends import get_index_router
+        try:
+            registered_index = self.get(name=name, collection=collection, query_hash=query_hash)
+        except self.model.DoesNotExist:
+            return None, None
+        query_index = get_index_router().registered_querysets.get(collection, {}).get(query_hash)
+        if query_index is None:
+            return None, None
+        return registered_index, query_index
+    
+    def on_update(self, name, collection, query_hash, doc_id, data):
+        registered_index, query_index = self.get_registered_query(name, collection, query_hash)
+        if registered_index is not None:
+            self.evaluate_query_index(registered_index, query_index, doc_id, data)
+    
+    def on_patch(self, name, collection, query_hash, doc_ids, operations):
+        from dockit.backends.djangodocument.models import RegisteredIndexDocument
+        from dockit.backends.djangodocument.utils import patch_json_rows
+        registered_index, query_index = self.get_registered_query(name, collection, query_hash)
+        if registered_index is None:
+            return
+        doc_ids = [unicode(doc_id) for doc_id in doc_ids]
+        for start in range(0, len(doc_ids), 500):
+            queryset = RegisteredIndexDocument.objects.filter(index=registered_index, doc_id__in=doc_ids[start:start+500])
+            patch_json_rows(queryset, operations)
+    
+    def analyze(self, name, collection, query_hash):
+        """
+        Recounts the documents of the registered index and estimates the
+        number of distinct values stored for each indexed param.
+        """
+        from dockit.backends.djangodocument.models import RegisteredIndexStatistic
+        try:
+            obj = self.get(name=name, collection=collection)
+        except self.model.DoesNotExist:
+            return None
+        if obj.query_hash != query_hash:
+            return None
         
-        schema = query_index.document
+        param_names = set()
+        for index in self.index_models.itervalues():
+            param_names.update(index['model'].objects.filter(document__index=obj).values_list('param_name', flat=True).distinct())
         
-        #evaluate if document passes filters
+        obj.statistics.all().delete()
+        for param_name in param_names:
+            distinct_values = 0
+            for index in self.index_models.itervalues():
+                queryset = index['model'].objects.filter(document__index=obj, param_name=param_name)
+                distinct_values += queryset.aggregate(distinct_values=Count('value', distinct=True))['distinct_values']
+            RegisteredIndexStatistic.objects.create(index=obj, param_name=param_name, distinct_values=distinct_values)
+        
+        obj.document_count = obj.documents.count()
+        obj.analyzed = datetime.datetime.now()
+        obj.save()
+        return obj
+    
+    def get_statistics(self, collection, query_hash):
+        """
+        Returns the collected statistics of an analyzed index or None.
+        """
+        try:
+            obj = self.get(collection=collection, query_hash=query_hash, analyzed__isnull=False)
+        except (self.model.DoesNotExist, self.model.MultipleObjectsReturned):
+            return None
+        distinct_values = dict(obj.statistics.values_list('param_name', 'distinct_values'))
+        return {'documents': obj.document_count,
+                'distinct_values': distinct_values,
+                'analyzed': obj.analyzed,}
+    
+    def encode_index_document(self, query_index, data):
+        """
+        Returns the copy of the document stored with the index entry. Covering
+        indexes only store the projected dot paths, or nothing at all.
+        """
+        if query_index.covered is None:
+            return encode_document(query_index.collection, data)
+        if not query_index.covered:
+            return ''
+        projection = dict()
+        for dotpath in query_index.covered:
+            projection[dotpath] = resolve_primitive_dot_path(data, dotpath)
+        return encode_document(query_index.collection, projection)
+    
+    def passes_filters(self, query_index, data):
+        schema = query_index.document
         for inclusion in query_index.inclusions:
             dotpath = inclusion.dotpath()
             traverser = DotPathTraverser(dotpath)
@@ -115,33 +423,232 @@ class RegisteredIndexManager(models.Manager):
             else:
                 if traverser.current_value == exclusion.value:
                     return False
+        return True
+    
+    def resolve_index_value(self, query_index, param, data):
+        """
+        Returns the value and field the index parameter finds in the document
+        """
+        traverser = DotPathTraverser(param.dotpath())
+        try:
+            traverser.resolve_for_raw_data(data, schema=query_index.document)
+        except (DotPathNotFound, ObjectDoesNotExist):
+            return None, None
+        return traverser.current_value, traverser.current_field
+    
+    def evaluate_query_index(self, registered_index, query_index, doc_id, data):
+        from dockit.backends.djangodocument.models import RegisteredIndexDocument
+        
+        #evaluate if document passes filters
+        if not self.passes_filters(query_index, data):
+            #the document may have been indexed before it changed
+            for index_doc in RegisteredIndexDocument.objects.filter(index=registered_index, doc_id=doc_id):
+                self.remove_index_document(index_doc, query_index)
+            return False
         
         #index params
-        encoded_data = json.dumps(data, cls=DjangoJSONEncoder)
+        encoded_data = self.encode_index_document(query_index, data)
         index_doc, created = RegisteredIndexDocument.objects.get_or_create(index=registered_index, doc_id=doc_id, defaults={'data':encoded_data})
-        if not created:
+        if created:
+            self.filter(pk=registered_index.pk).update(document_count=F('document_count') + 1)
+        else:
             index_doc.data = encoded_data
             index_doc.save()
+        counters = query_index.counters or ()
         for param in query_index.indexes:
-            dotpath = param.dotpath()
-            traverser = DotPathTraverser(dotpath)
-            try:
-                traverser.resolve_for_raw_data(data, schema=schema)
-            except DotPathNotFound:
-                value = None
-                field = None
-            except ObjectDoesNotExist:
-                value = None
-                field = None
-            else:
-                value = traverser.current_value
-                field = traverser.current_field
+            value, field = self.resolve_index_value(query_index, param, data)
             index_model = self.lookup_index(value=value, field=field)
+            if param.key in counters:
+                old_values = list()
+                if not created:
+                    old_values = self.get_indexed_values(index_doc, param.key)
+                new_values = value
+                if not isinstance(value, (list, set)):
+                    new_values = [value]
+                self.update_counters(registered_index, param.key, old_values, new_values)
             #now create a BaseIndex entry associated to a registered index document
             #if param.key == '@natural_key_hash':
             #    assert value
             #    assert False, str(value) +':'+ str(index_model)
             index_model.objects.db_index(index_doc, param.key, value)
+            if param.operation == 'search':
+                self.fulltext_index(index_doc, param.key, value)
+    
+    def evaluate_query_index_many(self, registered_index, query_index, entries):
+        from dockit.backends.djangodocument.models import RegisteredIndexDocument, FullTextEntry
+        passing = list()
+        failing = list()
+        for doc_id, data in entries:
+            if self.passes_filters(query_index, data):
+                passing.append((unicode(doc_id), data))
+            else:
+                failing.append(unicode(doc_id))
+        
+        if failing:
+            #the documents may have been indexed before they changed
+            index_docs = list(RegisteredIndexDocument.objects.filter(index=registered_index, doc_id__in=failing))
+            self.remove_index_documents(registered_index, index_docs, query_index)
+        if not passing:
+            return
+        
+        existing = dict()
+        for index_doc in RegisteredIndexDocument.objects.filter(index=registered_index, doc_id__in=[doc_id for doc_id, data in passing]):
+            existing[index_doc.doc_id] = index_doc
+        counters = query_index.counters or ()
+        old_values = self.get_indexed_values_many(existing.values(), counters)
+        
+        index_docs = list()
+        created = 0
+        for doc_id, data in passing:
+            encoded_data = self.encode_index_document(query_index, data)
+            index_doc = existing.get(doc_id)
+            if index_doc is None:
+                index_doc = RegisteredIndexDocument.objects.create(index=registered_index, doc_id=doc_id, data=encoded_data)
+                created += 1
+            else:
+                index_doc.data = encoded_data
+                index_doc.save()
+            index_docs.append((index_doc, data))
+        if created:
+            self.filter(pk=registered_index.pk).update(document_count=F('document_count') + created)
+        
+        #the previous values are dropped with one delete per index table and
+        #the new ones are inserted with one insert per index table
+        if existing:
+            for index in self.index_models.itervalues():
+                index['model'].objects.filter(document__in=existing.values()).delete()
+            FullTextEntry.objects.filter(document__in=existing.values()).delete()
+        rows = dict()
+        fulltext = list()
+        new_values = dict()
+        for index_doc, data in index_docs:
+            for param in query_index.indexes:
+                value, field = self.resolve_index_value(query_index, param, data)
+                index_model = self.lookup_index(value=value, field=field)
+                if param.key in counters:
+                    if isinstance(value, (list, set)):
+                        new_values.setdefault(param.key, list()).extend(value)
+                    else:
+                        new_values.setdefault(param.key, list()).append(value)
+                rows.setdefault(index_model, list()).append((index_doc, param.key, value))
+                if param.operation == 'search':
+                    if isinstance(value, (list, set)):
+                        value = u'\n'.join([unicode(entry) for entry in value if entry is not None])
+                    if value:
+                        fulltext.append(FullTextEntry(document=index_doc, param_name=param.key, content=unicode(value)))
+        for key in counters:
+            self.update_counters(registered_index, key, old_values.get(key, []), new_values.get(key, []))
+        for index_model, index_rows in rows.iteritems():
+            index_model.objects.bulk_index(index_rows)
+        if hasattr(FullTextEntry.objects, 'bulk_create'): #django 1.4 and later
+            FullTextEntry.objects.bulk_create(fulltext)
+        else:
+            for entry in fulltext:
+                entry.save()
+    
+    def fulltext_index(self, index_doc, param_name, value):
+        from dockit.backends.djangodocument.models import FullTextEntry
+        FullTextEntry.objects.filter(document=index_doc, param_name=param_name).delete()
+        if isinstance(value, (list, set)):
+            value = u'\n'.join([unicode(entry) for entry in value if entry is not None])
+        if value:
+            FullTextEntry.objects.create(document=index_doc, param_name=param_name, content=unicode(value))
+    
+    def remove_index_document(self, index_doc, query_index=None):
+        if query_index is not None:
+            for key in query_index.counters or ():
+                self.update_counters(index_doc.index, key, self.get_indexed_values(index_doc, key), [])
+        index_doc.delete()
+        self.filter(pk=index_doc.index_id).update(document_count=F('document_count') - 1)
+    
+    def remove_index_documents(self, registered_index, index_docs, query_index=None):
+        """
+        Removes the index entries of several documents of one registered index
+        """
+        from dockit.backends.djangodocument.models import RegisteredIndexDocument
+        if not index_docs:
+            return
+        if query_index is not None and query_index.counters:
+            old_values = self.get_indexed_values_many(index_docs, query_index.counters)
+            for key in query_index.counters:
+                self.update_counters(registered_index, key, old_values.get(key, []), [])
+        RegisteredIndexDocument.objects.filter(pk__in=[index_doc.pk for index_doc in index_docs]).delete()
+        self.filter(pk=registered_index.pk).update(document_count=F('document_count') - len(index_docs))
+    
+    def get_indexed_values_many(self, index_docs, param_names):
+        """
+        Returns the indexed values of several documents grouped by parameter
+        """
+        values = dict()
+        if not index_docs or not param_names:
+            return values
+        for index in self.index_models.itervalues():
+            rows = index['model'].objects.filter(document__in=index_docs, param_name__in=list(param_names))
+            for param_name, value in rows.values_list('param_name', 'value'):
+                values.setdefault(param_name, list()).append(value)
+        return values
+    
+    def get_indexed_values(self, index_doc, param_name):
+        values = list()
+        for index in self.index_models.itervalues():
+            values.extend(index['model'].objects.filter(document=index_doc, param_name=param_name).values_list('value', flat=True))
+        return values
+    
+    def encode_counter_value(self, value):
+        from dockit.schema import Document
+        if isinstance(value, (models.Model, Document)):
+            value = value.pk
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    
+    def update_counters(self, registered_index, param_name, old_values, new_values):
+        from dockit.backends.djangodocument.models import RegisteredIndexCounter
+        changes = dict()
+        for value in new_values:
+            value = self.encode_counter_value(value)
+            changes[value] = changes.get(value, 0) + 1
+        for value in old_values:
+            value = self.encode_counter_value(value)
+            changes[value] = changes.get(value, 0) - 1
+        for value, change in changes.iteritems():
+            if not change:
+                continue
+            value_hash = hashlib.sha1(value).hexdigest()
+            counters = RegisteredIndexCounter.objects.filter(index=registered_index, param_name=param_name, value_hash=value_hash)
+            if counters.update(count=F('count') + change):
+                continue
+            sid = transaction.savepoint()
+            try:
+                RegisteredIndexCounter.objects.create(index=registered_index, param_name=param_name,
+                                                      value=value, value_hash=value_hash, count=change)
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                #another process created the counter first
+                transaction.savepoint_rollback(sid)
+                counters.update(count=F('count') + change)
+    
+    def get_counts(self, collection, query_hash, param_name):
+        """
+        Returns the maintained value counts of a counter index or None if the
+        index has not been registered.
+        """
+        try:
+            obj = self.get(collection=collection, query_hash=query_hash)
+        except (self.model.DoesNotExist, self.model.MultipleObjectsReturned):
+            return None
+        counts = dict()
+        for value, count in obj.counters.filter(param_name=param_name).values_list('value', 'count'):
+            value = json.loads(value)
+            counts[value] = counts.get(value, 0) + count
+        return dict([(value, count) for value, count in counts.iteritems() if count > 0])
+    
+    def get_count(self, collection, query_hash, param_name, value):
+        try:
+            obj = self.get(collection=collection, query_hash=query_hash)
+        except (self.model.DoesNotExist, self.model.MultipleObjectsReturned):
+            return None
+        value_hash = hashlib.sha1(self.encode_counter_value(value)).hexdigest()
+        counters = obj.counters.filter(param_name=param_name, value_hash=value_hash)
+        return sum(counters.values_list('count', flat=True))
 
 class BaseIndexManager(models.Manager):
     def filter_kwargs_for_operation(self, operation):
@@ -175,11 +682,32 @@ class BaseIndexManager(models.Manager):
         else:
             self._db_index(index_document, param_name, value)
     
-    def _db_index(self, index_document, param_name, value):
+    def bulk_index(self, entries):
+        """
+        Inserts a list of (index_document, param_name, value) with one query
+        where the database supports it
+        """
+        objs = list()
+        for index_document, param_name, value in entries:
+            if not isinstance(value, (list, set)):
+                value = [value]
+            for val in value:
+                objs.append(self.model(document=index_document, param_name=param_name, value=self.prepare_value(val)))
+        if hasattr(self, 'bulk_create'): #django 1.4 and later
+            self.bulk_create(objs)
+        else:
+            for obj in objs:
+                obj.save()
+    
+    def prepare_value(self, value):
         from dockit.schema import Document
         if isinstance(value, models.Model):
             value = value.pk
         if isinstance(value, Document):
             value = value.pk
+        return value
+    
+    def _db_index(self, index_document, param_name, value):
+        value = self.prepare_value(value)
         obj = self.create(document=index_document, param_name=param_name, value=value)
 
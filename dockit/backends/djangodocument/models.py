@@ -5,7 +5,7 @@ from dockit.schema.loading import get_base_document
 import datetime
 from decimal import Decimal
 
-from dockit.backends.djangodocument.managers import BaseIndexManager, DocumentManager, RegisteredIndexManager
+from dockit.backends.djangodocument.managers import BaseIndexManager, DocumentManager, RegisteredIndexManager, DocumentChangeManager
 
 class DocumentStore(models.Model):
     collection = models.CharField(max_length=128)
@@ -17,10 +17,21 @@ class DocumentStore(models.Model):
         for index in type(self).objects.index_models.itervalues():
             index['model'].objects.clear_db_index(self)
 
+class DocumentChange(models.Model):
+    #the primary key is the sequence number, only the latest change of a document is kept
+    collection = models.CharField(max_length=128, db_index=True)
+    doc_id = models.CharField(max_length=128, db_index=True)
+    deleted = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(auto_now=True)
+    
+    objects = DocumentChangeManager()
+
 class RegisteredIndex(models.Model):
     name = models.CharField(max_length=128, db_index=True)
     collection = models.CharField(max_length=128, db_index=True)
     query_hash = models.BigIntegerField()
+    document_count = models.BigIntegerField(default=0)
+    analyzed = models.DateTimeField(null=True, blank=True)
     
     objects = RegisteredIndexManager()
     
@@ -30,12 +41,35 @@ class RegisteredIndex(models.Model):
     class Meta:
         unique_together = [('name', 'collection')]
 
+class RegisteredIndexStatistic(models.Model):
+    index = models.ForeignKey(RegisteredIndex, related_name='statistics')
+    param_name = models.CharField(max_length=128)
+    distinct_values = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = [('index', 'param_name')]
+
+class RegisteredIndexCounter(models.Model):
+    index = models.ForeignKey(RegisteredIndex, related_name='counters')
+    param_name = models.CharField(max_length=128)
+    value = models.TextField() #json encoded
+    value_hash = models.CharField(max_length=40) #sha1 of value, text columns can not be unique on every database
+    count = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = [('index', 'param_name', 'value_hash')]
+
 class RegisteredIndexDocument(models.Model):
     index = models.ForeignKey(RegisteredIndex, related_name='documents')
     doc_id = models.CharField(max_length=128, db_index=True)
     data = models.TextField(blank=True) #optionally store a copy of the document for retrieval
     timestamp = models.DateTimeField(auto_now=True)
 
+class FullTextEntry(models.Model):
+    document = models.ForeignKey(RegisteredIndexDocument)
+    param_name = models.CharField(max_length=128, db_index=True)
+    content = models.TextField()
+
 class BaseIndex(models.Model):
     document = models.ForeignKey(RegisteredIndexDocument)
     param_name = models.CharField(max_length=128, db_index=True)
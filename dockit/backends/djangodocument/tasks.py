@@ -10,6 +10,10 @@ def reindex(name, collection, query_hash):
     from dockit.backends.djangodocument.models import RegisteredIndex
     RegisteredIndex.objects.reindex(name, collection, query_hash)
 
+def analyze(name, collection, query_hash):
+    from dockit.backends.djangodocument.models import RegisteredIndex
+    RegisteredIndex.objects.analyze(name, collection, query_hash)
+
 def on_save(collection, doc_id, data):
     from dockit.backends.djangodocument.models import RegisteredIndex
     RegisteredIndex.objects.on_save(collection, doc_id, data)
@@ -18,6 +22,22 @@ def on_delete(collection, doc_id):
     from dockit.backends.djangodocument.models import RegisteredIndex
     RegisteredIndex.objects.on_delete(collection, doc_id)
 
+def on_save_many(collection, entries):
+    from dockit.backends.djangodocument.models import RegisteredIndex
+    RegisteredIndex.objects.on_save_many(collection, entries)
+
+def on_delete_many(collection, doc_ids):
+    from dockit.backends.djangodocument.models import RegisteredIndex
+    RegisteredIndex.objects.on_delete_many(collection, doc_ids)
+
+def on_update(name, collection, query_hash, doc_id, data):
+    from dockit.backends.djangodocument.models import RegisteredIndex
+    RegisteredIndex.objects.on_update(name, collection, query_hash, doc_id, data)
+
+def on_patch(name, collection, query_hash, doc_ids, operations):
+    from dockit.backends.djangodocument.models import RegisteredIndex
+    RegisteredIndex.objects.on_patch(name, collection, query_hash, doc_ids, operations)
+
 class IndexTasks(object):
     def __init__(self):
         from dockit.backends.djangodocument.models import RegisteredIndex
@@ -42,6 +62,13 @@ class IndexTasks(object):
     def schedule_reindex(self, **params):
         reindex(**params)
     
+    def analyze(self, query_index):
+        params = self.get_query_index_params(query_index)
+        self.schedule_analyze(**params)
+    
+    def schedule_analyze(self, **params):
+        analyze(**params)
+    
     def on_save(self, collection, doc_id, data):
         self.schedule_on_save(collection, doc_id, data)
     
@@ -53,6 +80,32 @@ class IndexTasks(object):
     
     def schedule_on_delete(self, collection, doc_id):
         on_delete(collection, doc_id)
+    
+    def on_save_many(self, collection, entries):
+        self.schedule_on_save_many(collection, entries)
+    
+    def schedule_on_save_many(self, collection, entries):
+        on_save_many(collection, entries)
+    
+    def on_delete_many(self, collection, doc_ids):
+        self.schedule_on_delete_many(collection, doc_ids)
+    
+    def schedule_on_delete_many(self, collection, doc_ids):
+        on_delete_many(collection, doc_ids)
+    
+    def on_update(self, query_index, doc_id, data):
+        params = self.get_query_index_params(query_index)
+        self.schedule_on_update(doc_id=doc_id, data=data, **params)
+    
+    def schedule_on_update(self, **params):
+        on_update(**params)
+    
+    def on_patch(self, query_index, doc_ids, operations):
+        params = self.get_query_index_params(query_index)
+        self.schedule_on_patch(doc_ids=doc_ids, operations=operations, **params)
+    
+    def schedule_on_patch(self, **params):
+        on_patch(**params)
 
 class ZTaskIndexTasks(IndexTasks):
     def __init__(self):
@@ -60,8 +113,13 @@ class ZTaskIndexTasks(IndexTasks):
         from django_ztask.decorators import task
         self._register_index = task()(register_index)
         self._reindex = task()(reindex)
+        self._analyze = task()(analyze)
         self._on_save = task()(on_save)
         self._on_delete = task()(on_delete)
+        self._on_save_many = task()(on_save_many)
+        self._on_delete_many = task()(on_delete_many)
+        self._on_update = task()(on_update)
+        self._on_patch = task()(on_patch)
         
     def schedule_register_index(self, **params):
         self._register_index.async(**params)
@@ -69,11 +127,26 @@ class ZTaskIndexTasks(IndexTasks):
     def schedule_reindex(self, **params):
         self._reindex.async(**params)
     
+    def schedule_analyze(self, **params):
+        self._analyze.async(**params)
+    
     def schedule_on_save(self, collection, doc_id, data):
         self._on_save.async(collection, doc_id, data)
     
     def schedule_on_delete(self, collection, doc_id):
         self._on_delete.async(collection, doc_id)
+    
+    def schedule_on_save_many(self, collection, entries):
+        self._on_save_many.async(collection, entries)
+    
+    def schedule_on_delete_many(self, collection, doc_ids):
+        self._on_delete_many.async(collection, doc_ids)
+    
+    def schedule_on_update(self, **params):
+        self._on_update.async(**params)
+    
+    def schedule_on_patch(self, **params):
+        self._on_patch.async(**params)
 
 class CeleryIndexTasks(IndexTasks):
     def __init__(self):
@@ -81,8 +154,13 @@ class CeleryIndexTasks(IndexTasks):
         from celery.task import task
         self._register_index = task(register_index, ignore_result=True)
         self._reindex = task(reindex, ignore_result=True)
+        self._analyze = task(analyze, ignore_result=True)
         self._on_save = task(on_save, ignore_result=True)
         self._on_delete = task(on_delete, ignore_result=True)
+        self._on_save_many = task(on_save_many, ignore_result=True)
+        self._on_delete_many = task(on_delete_many, ignore_result=True)
+        self._on_update = task(on_update, ignore_result=True)
+        self._on_patch = task(on_patch, ignore_result=True)
         
     def schedule_register_index(self, **params):
         self._register_index.delay(**params)
@@ -90,8 +168,23 @@ class CeleryIndexTasks(IndexTasks):
     def schedule_reindex(self, **params):
         self._reindex.delay(**params)
     
+    def schedule_analyze(self, **params):
+        self._analyze.delay(**params)
+    
     def schedule_on_save(self, collection, doc_id, data):
         self._on_save.delay(collection, doc_id, data)
     
     def schedule_on_delete(self, collection, doc_id):
         self._on_delete.delay(collection, doc_id)
+    
+    def schedule_on_save_many(self, collection, entries):
+        self._on_save_many.delay(collection, entries)
+    
+    def schedule_on_delete_many(self, collection, doc_ids):
+        self._on_delete_many.delay(collection, doc_ids)
+    
+    def schedule_on_update(self, **params):
+        self._on_update.delay(**params)
+    
+    def schedule_on_patch(self, **params):
+        self._on_patch.delay(**params)
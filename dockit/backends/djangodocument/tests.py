@@ -1,11 +1,25 @@
+import json
+from StringIO import StringIO
+
 from django.utils import unittest
+from django.core.management import call_command
 from django.contrib.sites.models import Site
 
+import dockit
 from dockit import backends
 from dockit import schema
 from dockit.tests.backends.common import BackendTestCase
+from dockit.backends.aggregates import Count, Sum, Avg, Min, Max
+from dockit.backends.expressions import F
+from dockit.backends.caching import CachingDocumentStorage
+from dockit.backends.identitymap import identity_map, get_identity_map
+from dockit.backends import jsoncodec
+from dockit.backends.jsoncodec import StandardJSONCodec, get_available_codecs
+from dockit.middleware import IdentityMapMiddleware
 
-from dockit.backends.djangodocument.models import RegisteredIndex, RegisteredIndexDocument, StringIndex
+from dockit.backends.djangodocument.backend import ModelDocumentStorage
+from dockit.backends.djangodocument.models import RegisteredIndex, RegisteredIndexDocument, StringIndex, DocumentStore
+from dockit.backends.djangodocument.fulltext import ContainsFullTextAdapter
 
 class Book(schema.Document):
     title = schema.CharField()
@@ -16,6 +30,38 @@ class Book(schema.Document):
     number_list = schema.ListField(schema.IntegerField())
     sites = schema.ModelSetField(Site)
 
+class Publisher(schema.Document):
+    name = schema.CharField()
+
+class Author(schema.Document):
+    name = schema.CharField()
+    publisher = schema.ReferenceField(Publisher, null=True)
+
+class Article(schema.Document):
+    title = schema.CharField()
+    author = schema.ReferenceField(Author, lazy=True)
+    coauthors = schema.DocumentSetField(Author)
+    sites = schema.ModelSetField(Site)
+
+class Listing(schema.Document):
+    title = schema.CharField()
+    attributes = schema.DictField()
+
+class Chapter(schema.Schema):
+    name = schema.CharField()
+
+class Volume(schema.Document):
+    chapters = schema.ListField(schema.SchemaField(Chapter))
+    chapter_map = schema.DictField(value_subfield=schema.SchemaField(Chapter))
+    prices = schema.ListField(schema.DecimalField())
+
+class CountingJSONCodec(StandardJSONCodec):
+    loaded = 0
+    
+    def loads(self, text):
+        CountingJSONCodec.loaded += 1
+        return super(CountingJSONCodec, self).loads(text)
+
 class DjangoDocumentTestCase(BackendTestCase):
     backend_name = 'djangodocument'
     
@@ -28,6 +74,11 @@ class DjangoDocumentTestCase(BackendTestCase):
     def clear_books(self):
         Book.objects.all().delete()
     
+    def preserve_registered_indexes(self):
+        registered_querysets = backends.INDEX_ROUTER.registered_querysets
+        collection = Book._meta.collection
+        self.addCleanup(registered_querysets.__setitem__, collection, dict(registered_querysets[collection]))
+    
     def test_document_store(self):
         self.assertEqual(Book.objects.all().count(), 0)
         Book(title='test title', slug='test').save()
@@ -142,3 +193,767 @@ class DjangoDocumentTestCase(BackendTestCase):
         
         self.assertEqual(ibook, ibook2)
 
+    
+    def test_covering_index(self):
+        queryset = Book.objects.filter(published=True).index('slug').covering('title', 'slug')
+        queryset.commit()
+        query_hash = queryset._index_hash()
+        
+        book = Book(title='test title', slug='test', published=True, countries=['US'])
+        book.save()
+        
+        index_doc = RegisteredIndexDocument.objects.get(doc_id=book.pk, index__query_hash=query_hash)
+        self.assertEqual(json.loads(index_doc.data), {'title':'test title', 'slug':'test'})
+        
+        query = Book.objects.filter(published=True)
+        self.assertEqual(query.values_list('title', flat=True), ['test title'])
+        self.assertEqual(query.values_list('pk', 'slug'), [(book.pk, 'test')])
+        self.assertEqual(list(query.values('title')), [{'title':'test title'}])
+        
+        #uncovered fields are joined from the document store
+        self.assertEqual(query.values_list('countries', flat=True), [['US']])
+        self.assertEqual(query[0].countries, ['US'])
+        self.assertEqual(query.get(slug='test').title, 'test title')
+    
+    def test_covering_index_without_document_copy(self):
+        queryset = Book.objects.filter(featured=True).index('slug').covering()
+        queryset.commit()
+        query_hash = queryset._index_hash()
+        
+        book = Book(title='test title', slug='test', featured=True)
+        book.save()
+        
+        index_doc = RegisteredIndexDocument.objects.get(doc_id=book.pk, index__query_hash=query_hash)
+        self.assertEqual(index_doc.data, '')
+        
+        query = Book.objects.filter(featured=True)
+        self.assertEqual(query.values_list('pk', flat=True), [book.pk])
+        self.assertEqual(query.values_list('title', flat=True), ['test title'])
+        self.assertEqual([entry.title for entry in query[:5]], ['test title'])
+        
+        #iterating loads the documents with one lookup per chunk
+        Book(title='second title', slug='second', featured=True).save()
+        lookups = list()
+        get_many = ModelDocumentStorage.get_many
+        def counting_get_many(storage, doc_class, collection, doc_ids):
+            lookups.append(doc_ids)
+            return get_many(storage, doc_class, collection, doc_ids)
+        ModelDocumentStorage.get_many = counting_get_many
+        self.addCleanup(setattr, ModelDocumentStorage, 'get_many', get_many)
+        self.assertEqual(sorted([entry.title for entry in query]), ['second title', 'test title'])
+        self.assertEqual(len(lookups), 1)
+    
+    def test_only_and_defer(self):
+        book = Book(title='test title', slug='test', countries=['US', 'GB'])
+        book.save()
+        
+        partial = Book.objects.all().only('title')[0]
+        self.assertEqual(partial.title, 'test title')
+        self.assertFalse('countries' in partial._primitive_data)
+        self.assertTrue('@natural_key_hash' in partial._primitive_data)
+        #deferred fields load on first access
+        self.assertEqual(partial.countries, ['US', 'GB'])
+        self.assertEqual(partial.slug, 'test')
+        
+        partial = Book.objects.all().defer('countries')[0]
+        self.assertFalse('countries' in partial._primitive_data)
+        self.assertEqual(partial.slug, 'test')
+        partial.title = 'new title'
+        partial.save()
+        
+        book = Book.objects.get(pk=book.pk)
+        self.assertEqual(book.title, 'new title')
+        self.assertEqual(book.countries, ['US', 'GB'])
+    
+    def test_explain(self):
+        queryset = Book.objects.index('slug')
+        queryset.commit()
+        Book.objects.filter(featured=True).index('title').commit()
+        
+        plan = Book.objects.filter(slug='test').explain(database=True)
+        self.assertEqual(plan['index']['hash'], queryset._index_hash())
+        self.assertEqual(plan['index']['score'], 1)
+        self.assertTrue(len(plan['candidates']) > 1)
+        for candidate in plan['candidates']:
+            if candidate['hash'] != queryset._index_hash():
+                self.assertTrue(candidate['reason'] or candidate['score'] <= 1)
+        self.assertTrue('stringindex' in plan['query']['sql'])
+        self.assertTrue('test' in plan['query']['params'])
+        self.assertTrue(plan['query']['database'])
+        
+        plan = Book.objects.all().explain()
+        self.assertEqual(plan['index'], None)
+        self.assertTrue('documentstore' in plan['query']['sql'])
+    
+    def test_cost_based_index_selection(self):
+        self.preserve_registered_indexes()
+        backends.INDEX_ROUTER.registered_querysets[Book._meta.collection] = {}
+        for i in range(10):
+            Book(title='book %s' % i, slug='same', featured=(i == 0), published=True).save()
+        wide_index = Book.objects.index('featured').index('slug')
+        wide_index.commit()
+        sparse_index = Book.objects.filter(featured=True).index('slug')
+        sparse_index.commit()
+        
+        query = Book.objects.filter(featured=True).filter(slug='same')
+        #without statistics the index covering the most lookups wins
+        self.assertEqual(query.explain()['index']['hash'], wide_index._index_hash())
+        
+        registered = RegisteredIndex.objects.get(query_hash=wide_index._index_hash())
+        self.assertEqual(registered.document_count, 10)
+        
+        backend = Book._meta.get_index_backend_for_write(wide_index)
+        backend.analyze(wide_index)
+        backend.analyze(sparse_index)
+        statistics = backend.get_index_statistics(wide_index)
+        self.assertEqual(statistics['documents'], 10)
+        self.assertEqual(statistics['distinct_values'], {'featured': 2, 'slug': 1})
+        
+        plan = query.explain()
+        self.assertEqual(plan['index']['hash'], sparse_index._index_hash())
+        self.assertEqual(plan['index']['cost'], 1)
+        self.assertEqual(len(query), 1)
+        
+        Book.objects.filter(featured=False)[0].delete()
+        registered = RegisteredIndex.objects.get(query_hash=wide_index._index_hash())
+        self.assertEqual(registered.document_count, 9)
+    
+    def test_aggregates(self):
+        self.preserve_registered_indexes()
+        Book.objects.filter(published=True).index('countries').index('number_list').commit()
+        Book(title='a', published=True, countries=['US', 'GB'], number_list=[1, 2]).save()
+        Book(title='b', published=True, countries=['US'], number_list=[5]).save()
+        Book(title='c', published=False, countries=['US'], number_list=[100]).save()
+        
+        query = Book.objects.filter(published=True)
+        result = query.aggregate(total=Sum('number_list'), low=Min('number_list'), high=Max('number_list'),
+                                 average=Avg('number_list'), values=Count('number_list'), documents=Count())
+        self.assertEqual(result, {'total': 8, 'low': 1, 'high': 5, 'average': 8.0 / 3,
+                                  'values': 3, 'documents': 2})
+        
+        self.assertEqual(query.annotate_group_by('countries', total=Sum('number_list'), documents=Count()),
+                         [{'countries': 'GB', 'total': 3, 'documents': 1},
+                          {'countries': 'US', 'total': 8, 'documents': 2}])
+        self.assertEqual(query.distinct_values('countries'), ['GB', 'US'])
+        
+        self.assertRaises(ValueError, query.aggregate, total=Sum('title'))
+        
+        #the backend query counts documents without a dot path as well
+        backend_query = query._aggregate_query(['countries']).queryset
+        self.assertEqual(backend_query.aggregate(documents=Count(), values=Count('countries')),
+                         {'documents': 2, 'values': 3})
+        self.assertRaises(ValueError, backend_query.aggregate, total=Sum())
+        self.assertRaises(ValueError, Book.objects.filter(featured=False).distinct_values, 'countries')
+    
+    def test_fulltext_search(self):
+        self.preserve_registered_indexes()
+        Book.objects.index('title__search').commit()
+        Book(title='The quick brown fox', slug='fox').save()
+        Book(title='quick quick fox jumps', slug='jumps').save()
+        book = Book(title='lazy dog', slug='dog')
+        book.save()
+        
+        self.assertEqual([entry.slug for entry in Book.objects.search('quick')], ['jumps', 'fox'])
+        self.assertEqual([entry.slug for entry in Book.objects.search('brown QUICK', 'title')], ['fox'])
+        self.assertEqual(Book.objects.filter(title__search='dog').count(), 1)
+        self.assertEqual(len(Book.objects.search('"unbalanced')), 0)
+        
+        book.title = 'lazy cat'
+        book.save()
+        self.assertEqual(len(Book.objects.search('dog')), 0)
+        self.assertEqual(len(Book.objects.search('cat')), 1)
+        book.delete()
+        self.assertEqual(len(Book.objects.search('cat')), 0)
+        
+        adapter = ContainsFullTextAdapter()
+        queryset = RegisteredIndexDocument.objects.filter(adapter.filter('title', 'FOX quick'))
+        self.assertEqual(queryset.count(), 2)
+    
+    def test_check_indexes(self):
+        self.preserve_registered_indexes()
+        query_index = Book.objects.filter(published=True).index('slug')
+        query_index.commit()
+        registered = RegisteredIndex.objects.get(query_hash=query_index._index_hash())
+        books = list()
+        for i in range(12):
+            book = Book(title='book %s' % i, slug='book-%s' % i, published=True)
+            book.save()
+            books.append(book)
+        Book(title='unpublished', slug='unpublished', published=False).save()
+        
+        #let the index drift from the documents
+        RegisteredIndexDocument.objects.filter(index=registered, doc_id=books[10].pk).delete()
+        DocumentStore.objects.filter(pk=books[3].pk).delete()
+        
+        #documents changed without updating the index
+        def change_stored(book, **changes):
+            entry = DocumentStore.objects.get(pk=book.pk)
+            data = json.loads(entry.data)
+            data.update(changes)
+            DocumentStore.objects.filter(pk=book.pk).update(data=json.dumps(data))
+        change_stored(books[5], published=False)
+        change_stored(books[6], slug='moved')
+        
+        report = RegisteredIndex.objects.check_index(registered, query_index, batch_size=2)
+        self.assertEqual(report, {'missing': [unicode(books[10].pk)], 'orphaned': [unicode(books[3].pk)],
+                                  'excluded': [], 'stale': []})
+        report = RegisteredIndex.objects.check_index(registered, query_index, batch_size=2, verify=True)
+        self.assertEqual((report['excluded'], report['stale']), ([unicode(books[5].pk)], [unicode(books[6].pk)]))
+        RegisteredIndex.objects.check_index(registered, query_index, repair=True, batch_size=2)
+        self.assertEqual(RegisteredIndex.objects.check_index(registered, query_index, verify=True),
+                         {'missing': [], 'orphaned': [], 'excluded': [], 'stale': []})
+        self.assertEqual(query_index.filter(slug='book-10').count(), 1)
+        self.assertEqual(query_index.filter(slug='book-3').count(), 0)
+        self.assertEqual(query_index.filter(slug='book-5').count(), 0)
+        self.assertEqual(query_index.filter(slug='moved').count(), 1)
+        
+        RegisteredIndex.objects.create(name='stale', collection=Book._meta.collection, query_hash=0)
+        output = StringIO()
+        call_command('checkindexes', Book._meta.collection, purge=True, stdout=output)
+        self.assertFalse(RegisteredIndex.objects.filter(name='stale').exists())
+        self.assertTrue('0 missing, 0 orphaned, 0 excluded, 0 stale' in output.getvalue())
+    
+    def test_changes(self):
+        book_a = Book(title='a', slug='a')
+        book_a.save()
+        book_b = Book(title='b', slug='b')
+        book_b.save()
+        changes = list(Book.objects.changes())
+        self.assertEqual([(change['id'], change['deleted']) for change in changes[-2:]],
+                         [(unicode(book_a.pk), False), (unicode(book_b.pk), False)])
+        checkpoint = changes[-1]['seq']
+        self.assertEqual(list(Book.objects.changes(since=checkpoint)), [])
+        
+        book_a.title = 'changed'
+        book_a.save()
+        book_b.delete()
+        changes = list(Book.objects.changes(since=checkpoint))
+        self.assertEqual([(change['id'], change['deleted']) for change in changes],
+                         [(unicode(book_a.pk), False), (unicode(book_b.pk), True)])
+        self.assertTrue(changes[0]['seq'] > checkpoint)
+        self.assertTrue(changes[1]['seq'] > changes[0]['seq'])
+        
+        #only the latest change of a document is kept
+        book_ids = [change['id'] for change in Book.objects.changes()]
+        self.assertEqual(len(book_ids), len(set(book_ids)))
+        
+        checkpoint = changes[-1]['seq']
+        Book.objects.all().delete()
+        changes = list(Book.objects.changes(since=checkpoint))
+        self.assertEqual([(change['id'], change['deleted']) for change in changes], [(unicode(book_a.pk), True)])
+    
+    def test_update(self):
+        self.preserve_registered_indexes()
+        queryset = Book.objects.filter(published=True).index('slug')
+        queryset.commit()
+        query_hash = queryset._index_hash()
+        
+        book = Book(title='a', slug='a', published=True, number_list=[1, 2])
+        book.save()
+        Book(title='b', slug='b', published=False).save()
+        checkpoint = list(Book.objects.changes())[-1]['seq']
+        
+        query = Book.objects.filter(published=True)
+        self.assertEqual(query.update(title='changed', number_list__0=F('number_list.0') + 5), 1)
+        book = Book.objects.get(pk=book.pk)
+        self.assertEqual(book.title, 'changed')
+        self.assertEqual(book.number_list, [6, 2])
+        self.assertEqual([change['id'] for change in Book.objects.changes(since=checkpoint)], [unicode(book.pk)])
+        
+        #indexes keeping a copy of the document are patched
+        index_doc = RegisteredIndexDocument.objects.get(doc_id=book.pk, index__query_hash=query_hash)
+        self.assertEqual(json.loads(index_doc.data)['title'], 'changed')
+        
+        #updating an indexed dot path evaluates the document again
+        query.update(slug='b')
+        self.assertEqual(query.filter(slug='b').count(), 1)
+        self.assertEqual(query.filter(slug='a').count(), 0)
+        self.assertEqual(Book.objects.filter(published=True).update(published=False), 1)
+        self.assertEqual(query.count(), 0)
+        
+        book.update_fields(title='local', number_list__1=F('number_list.1') + 1)
+        self.assertEqual((book.title, book.number_list), ('local', [6, 3]))
+        book = Book.objects.get(pk=book.pk)
+        self.assertEqual((book.title, book.number_list), ('local', [6, 3]))
+        self.assertRaises(ValueError, Book.objects.all().update, title=F('slug') + 1)
+    
+    def test_update_without_json_patch(self):
+        from dockit.backends.djangodocument import utils
+        self.addCleanup(utils.JSON_PATCH_SUPPORT.clear)
+        utils.JSON_PATCH_SUPPORT['default'] = False
+        book = Book(title='a', slug='a', number_list=[1, 2])
+        book.save()
+        
+        #another process increments the value after the row was read
+        apply_primitive_update = utils.apply_primitive_update
+        raced = list()
+        def racing_update(data, dotpath, operation, value):
+            if not raced:
+                raced.append(True)
+                entry = DocumentStore.objects.get(pk=book.pk)
+                stored = json.loads(entry.data)
+                stored['number_list'][0] += 10
+                DocumentStore.objects.filter(pk=book.pk).update(data=json.dumps(stored))
+            return apply_primitive_update(data, dotpath, operation, value)
+        utils.apply_primitive_update = racing_update
+        self.addCleanup(setattr, utils, 'apply_primitive_update', apply_primitive_update)
+        
+        Book.objects.filter(pk=book.pk).update(number_list__0=F('number_list.0') + 5)
+        self.assertEqual(Book.objects.get(pk=book.pk).number_list, [16, 2])
+    
+    def test_unit_of_work(self):
+        from dockit.schema.signals import post_save, post_delete
+        sent = list()
+        def on_post_save(sender, instance, created, **kwargs):
+            sent.append(('save', instance.title, created))
+        def on_post_delete(sender, instance, **kwargs):
+            sent.append(('delete', instance.title))
+        post_save.connect(on_post_save, sender=Book)
+        self.addCleanup(post_save.disconnect, on_post_save, sender=Book)
+        post_delete.connect(on_post_delete, sender=Book)
+        self.addCleanup(post_delete.disconnect, on_post_delete, sender=Book)
+        
+        old_book = Book(title='old', slug='old')
+        old_book.save()
+        del sent[:]
+        
+        with dockit.unit_of_work():
+            book = Book(title='a', slug='a')
+            book.save()
+            self.assertTrue(book.pk)
+            book.title = 'b'
+            book.save()
+            old_book.title = 'changed'
+            old_book.save()
+            self.assertEqual(Book.objects.get(pk=old_book.pk).title, 'old')
+            old_book.delete()
+            with dockit.unit_of_work():
+                book.save()
+            self.assertEqual(sent, [])
+        
+        self.assertEqual(sent, [('save', 'b', True), ('delete', 'changed')])
+        self.assertEqual(Book.objects.get(pk=book.pk).title, 'b')
+        self.assertRaises(Book.DoesNotExist, Book.objects.get, pk=old_book.pk)
+        
+        #pending writes are discarded when the block raises
+        def change_and_fail():
+            with dockit.unit_of_work():
+                book.title = 'c'
+                book.save()
+                raise KeyError
+        self.assertRaises(KeyError, change_and_fail)
+        self.assertEqual(Book.objects.get(pk=book.pk).title, 'b')
+        self.assertEqual(len(sent), 2)
+    
+    def test_unit_of_work_writes(self):
+        self.preserve_registered_indexes()
+        Book.objects.filter(published=True).index('title').counter('countries').commit()
+        for title in ('a', 'b', 'c'):
+            Book(title=title, slug=title, published=True, countries=['US']).save()
+        
+        writes = list()
+        save_many = ModelDocumentStorage.save_many
+        def counting_save_many(storage, doc_class, collection, datas):
+            writes.extend(datas)
+            return save_many(storage, doc_class, collection, datas)
+        ModelDocumentStorage.save_many = counting_save_many
+        self.addCleanup(setattr, ModelDocumentStorage, 'save_many', save_many)
+        
+        #loaded documents saved without changes are not written
+        with dockit.unit_of_work():
+            for book in Book.objects.all():
+                book.save()
+        self.assertEqual(writes, [])
+        
+        #the index entries of the changed documents are replaced in one batch
+        with dockit.unit_of_work():
+            for book in Book.objects.all():
+                if book.title == 'a':
+                    book.published = False
+                else:
+                    book.title = book.title * 2
+                    book.countries = ['GB']
+                book.save()
+        self.assertEqual(len(writes), 3)
+        query = Book.objects.filter(published=True)
+        self.assertEqual(sorted(query.values_list('title', flat=True)), ['bb', 'cc'])
+        self.assertEqual(query.filter(title='bb').count(), 1)
+        self.assertEqual(query.filter(title='b').count(), 0)
+        self.assertEqual(query.facet_counts('countries'), {'GB': 2})
+        
+        with dockit.unit_of_work():
+            for book in query:
+                book.delete()
+        self.assertEqual(query.count(), 0)
+        self.assertEqual(query.facet_counts('countries'), {})
+        self.assertEqual(RegisteredIndexDocument.objects.filter(index__collection=Book._meta.collection).count(), 0)
+        self.assertEqual(RegisteredIndex.objects.get(collection=Book._meta.collection).document_count, 0)
+    
+    def test_caching_storage(self):
+        storage = CachingDocumentStorage(STORAGE='djangodocument', CACHE='locmem://', KEY_PREFIX='test')
+        collection = Book._meta.collection
+        book = Book(title='a', slug='a')
+        book.save()
+        
+        self.assertEqual(storage.get(Book, collection, book.pk)['title'], 'a')
+        data = storage.get(Book, collection, book.pk)
+        data['title'] = 'modified'
+        self.assertEqual(storage.get(Book, collection, book.pk)['title'], 'a')
+        self.assertEqual(storage.get_stats()['hits'], 2)
+        
+        #entries from the shared cache are served after the local entry is gone
+        storage.local_cache.clear()
+        self.assertEqual(storage.get(Book, collection, book.pk)['title'], 'a')
+        self.assertEqual(storage.get_stats()['shared_hits'], 1)
+        
+        #writes go through
+        data = storage.get(Book, collection, book.pk)
+        data['title'] = 'b'
+        storage.save(Book, collection, data)
+        self.assertEqual(Book.objects.get(pk=book.pk).title, 'b')
+        self.assertEqual(storage.get(Book, collection, book.pk)['title'], 'b')
+        
+        storage.delete(Book, collection, book.pk)
+        self.assertRaises(Book.DoesNotExist, storage.get, Book, collection, book.pk)
+        self.assertRaises(Book.DoesNotExist, storage.get, Book, collection, book.pk)
+        self.assertEqual(storage.get_many(Book, collection, [book.pk]), [None])
+        stats = storage.get_stats()
+        self.assertEqual((stats['misses'], stats['negative_hits']), (2, 2))
+        self.assertEqual(stats['hit_ratio'], 7.0 / 9)
+        
+        #deleting through a query drops the cached documents
+        book = Book(title='a', slug='a')
+        book.save()
+        storage.cache_delete(storage.get_key(collection, book.pk))
+        self.assertEqual(storage.get(Book, collection, book.pk)['title'], 'a')
+        query = storage.get_query(Book.objects.filter(pk=book.pk))
+        self.assertEqual(len(query), 1)
+        query.delete()
+        self.assertRaises(Book.DoesNotExist, storage.get, Book, collection, book.pk)
+    
+    def test_identity_map(self):
+        book = Book(title='a', slug='a', published=True)
+        book.save()
+        self.assertFalse(Book.objects.get(pk=book.pk) is Book.objects.get(pk=book.pk))
+        
+        with identity_map() as documents:
+            loaded = Book.objects.get(pk=book.pk)
+            self.assertTrue(Book.objects.get(pk=book.pk) is loaded)
+            self.assertTrue(Book.objects.all().get(pk__exact=book.pk) is loaded)
+            self.assertEqual(documents.hits, 2)
+            
+            #saved instances replace the loaded ones
+            book.title = 'b'
+            book.save()
+            self.assertTrue(Book.objects.get(pk=book.pk) is book)
+            
+            Book.objects.filter(pk=book.pk).update(title='c')
+            self.assertEqual(Book.objects.get(pk=book.pk).title, 'c')
+            
+            Book.objects.get(pk=book.pk).delete()
+            self.assertRaises(Book.DoesNotExist, Book.objects.get, pk=book.pk)
+        self.assertEqual(get_identity_map(), None)
+        
+        middleware = IdentityMapMiddleware()
+        middleware.process_request(None)
+        self.assertNotEqual(get_identity_map(), None)
+        middleware.process_response(None, None)
+        self.assertEqual(get_identity_map(), None)
+    
+    def count_get_many(self):
+        calls = list()
+        get_many = ModelDocumentStorage.get_many
+        def counting_get_many(storage, doc_class, collection, doc_ids):
+            calls.append((collection, sorted(doc_ids)))
+            return get_many(storage, doc_class, collection, doc_ids)
+        ModelDocumentStorage.get_many = counting_get_many
+        self.addCleanup(setattr, ModelDocumentStorage, 'get_many', get_many)
+        return calls
+    
+    def test_dirty_tracking(self):
+        self.preserve_registered_indexes()
+        Book.objects.filter(published=False).index('title').covering('title').commit()
+        Book.objects.filter(featured=True).index('title').covering().commit()
+        Book.objects.all().delete()
+        book = Book(title='a', published=False, featured=False, countries=['US'])
+        book.save()
+        
+        saves = list()
+        on_save = backends.CompositeIndexRouter.on_save
+        def counting_on_save(router, document, collection, object_id, data, changed_paths=None):
+            saves.append(changed_paths)
+            return on_save(router, document, collection, object_id, data, changed_paths)
+        backends.CompositeIndexRouter.on_save = counting_on_save
+        self.addCleanup(setattr, backends.CompositeIndexRouter, 'on_save', on_save)
+        
+        #saving an unchanged document writes nothing
+        book = Book.objects.get(pk=book.pk)
+        book.save()
+        self.assertEqual(saves, [])
+        
+        book.countries.append('GB')
+        book.save()
+        self.assertEqual(saves, [set(['countries'])])
+        self.assertEqual(Book.objects.get(pk=book.pk).countries, ['US', 'GB'])
+        
+        #indexes are only evaluated again when they depend on a changed dot path
+        book.title = 'b'
+        book.save()
+        self.assertEqual(Book.objects.filter(published=False).index('title').covering('title').values_list('title', flat=True), ['b'])
+        featured = Book.objects.filter(featured=True).index('title').covering()
+        self.assertEqual(featured.count(), 0)
+        book.featured = True
+        book.save()
+        self.assertEqual(featured.count(), 1)
+    
+    def test_assign_containers(self):
+        from decimal import Decimal
+        volume = Volume(chapters=[Chapter(name='a')], prices=[Decimal('1.5')])
+        volume.save()
+        volume.chapter_map = {'b':Chapter(name='b')}
+        volume.save()
+        
+        stored = json.loads(DocumentStore.objects.get(pk=volume.pk).data)
+        self.assertEqual(stored['chapters'], [{'name':'a'}])
+        self.assertEqual(stored['chapter_map'], {'b':{'name':'b'}})
+        self.assertEqual(stored['prices'], ['1.5'])
+        
+        volume = Volume.objects.get(pk=volume.pk)
+        self.assertEqual(volume.chapters[0].name, 'a')
+        self.assertEqual(volume.chapter_map['b'].name, 'b')
+        self.assertEqual(volume.prices, [Decimal('1.5')])
+    
+    def test_untyped_data(self):
+        from decimal import Decimal
+        from dockit.schema.common import DotPathDict
+        from dockit.schema.serializer import UntypedData
+        plain = Listing(title='plain', attributes={'size':{'width':1}})
+        plain.save()
+        typed = Listing(title='typed', attributes={'price':Decimal('1.50')})
+        typed.save()
+        #nothing is stored to tell them apart
+        self.assertEqual(sorted(json.loads(DocumentStore.objects.get(pk=plain.pk).data)),
+                         ['@natural_key', '@natural_key_hash', 'attributes', 'title'])
+        
+        #plain documents are wrapped without looking for typed values
+        plain = Listing.objects.get(pk=plain.pk)
+        self.assertTrue(type(plain._primitive_data) is UntypedData)
+        self.assertFalse(type(Listing.objects.get(pk=typed.pk)._primitive_data) is UntypedData)
+        self.assertTrue(isinstance(plain.attributes['size'], DotPathDict))
+        self.assertEqual(plain.attributes['size']['width'], 1)
+        self.assertEqual(Listing.objects.get(pk=typed.pk).attributes['price'], Decimal('1.50'))
+        
+        #saved typed values are decoded
+        plain.attributes['price'] = Decimal('3')
+        plain.save()
+        self.assertFalse(type(plain._primitive_data) is UntypedData)
+        
+        #as are typed values stored by updates
+        plain.update_fields(attributes={'price':Decimal('2')})
+        self.assertEqual(Listing.objects.get(pk=plain.pk).attributes['price'], Decimal('2'))
+    
+    def test_json_codec(self):
+        import datetime
+        from decimal import Decimal
+        from django.conf import settings
+        from django.core.serializers.json import DjangoJSONEncoder
+        data = {'when':datetime.datetime(2012, 1, 2, 3, 4, 5, 6000), 'day':datetime.date(2012, 1, 2),
+                'price':Decimal('1.50'), 'title':u'caf\xe9'}
+        expected = json.dumps(data, cls=DjangoJSONEncoder)
+        for codec in get_available_codecs():
+            self.assertEqual(json.loads(codec().dumps(data)), json.loads(expected))
+            self.assertEqual(codec().loads(expected), json.loads(expected))
+        self.assertEqual(StandardJSONCodec().dumps(data), expected)
+        
+        #the setting picks the codec used by the storage
+        self.addCleanup(setattr, jsoncodec, 'JSON_CODEC', None)
+        settings.DOCKIT_JSON_CODEC = 'dockit.backends.djangodocument.tests.CountingJSONCodec'
+        self.addCleanup(delattr, settings, 'DOCKIT_JSON_CODEC')
+        jsoncodec.JSON_CODEC = None
+        book = Book(title='a')
+        book.save()
+        loaded = CountingJSONCodec.loaded
+        self.assertEqual(Book.objects.get(pk=book.pk).title, 'a')
+        self.assertEqual(CountingJSONCodec.loaded, loaded + 1)
+    
+    def test_storage_formats(self):
+        from django.conf import settings
+        from dockit.backends.djangodocument.formats import decode_document
+        self.preserve_registered_indexes()
+        queryset = Book.objects.filter(published=True).index('slug')
+        queryset.commit()
+        collection = Book._meta.collection
+        settings.DOCKIT_STORAGE_FORMATS = {collection:'zlib'}
+        self.addCleanup(delattr, settings, 'DOCKIT_STORAGE_FORMATS')
+        book = Book(title='a'*500, slug='a', published=True)
+        book.save()
+        
+        #documents and index copies are written in the format of the collection
+        text = DocumentStore.objects.get(pk=book.pk).data
+        self.assertTrue(text.startswith('~1:zlib:'))
+        self.assertTrue(len(text) < 500)
+        self.assertEqual(decode_document(text)['title'], 'a'*500)
+        index_doc = RegisteredIndexDocument.objects.get(doc_id=book.pk, index__query_hash=queryset._index_hash())
+        self.assertTrue(index_doc.data.startswith('~1:zlib:'))
+        self.assertEqual(queryset.filter(slug='a').get().title, 'a'*500)
+        
+        #rows of other formats are still read
+        Book.objects.filter(published=True).update(title='b')
+        self.assertEqual(Book.objects.get(pk=book.pk).title, 'b')
+        settings.DOCKIT_STORAGE_FORMATS = {}
+        self.assertEqual(Book.objects.get(pk=book.pk).title, 'b')
+        
+        call_command('recompressdocuments', collection, format='zlib', stdout=StringIO())
+        self.assertTrue(DocumentStore.objects.get(pk=book.pk).data.startswith('~1:zlib:'))
+        self.assertEqual(queryset.filter(slug='a').get().title, 'b')
+        call_command('recompressdocuments', collection, stdout=StringIO())
+        self.assertEqual(json.loads(DocumentStore.objects.get(pk=book.pk).data)['title'], 'b')
+    
+    def test_bson_storage_format(self):
+        import datetime
+        from dockit.backends.djangodocument import formats
+        if not formats.BSONFormat.is_available():
+            self.skipTest('bson is not installed')
+        storage_format = formats.get_storage_format(name='bson')
+        data = {'title':u'a', 'count':2**40, 'ratio':0.1, 'tags':[u'x', None],
+                'price':{'__type__':'Decimal', 'value':'1.50'}, 'created':datetime.datetime(2012, 1, 2, 3, 4, 5)}
+        text = storage_format.encode(data)
+        self.assertTrue(text.startswith('~1:bson:'))
+        self.assertEqual(formats.decode_document(text), formats.decode_document(formats.get_storage_format(name='json').encode(data)))
+        self.assertFalse(type(formats.load_document(text)) is formats.UntypedData)
+        self.assertTrue(type(formats.load_document(storage_format.encode({'title':u'a'}))) is formats.UntypedData)
+    
+    def test_prefetch_references(self):
+        Article.objects.all().delete()
+        Author.objects.all().delete()
+        publisher = Publisher(name='press')
+        publisher.save()
+        authors = list()
+        for name in ('a', 'b', 'c'):
+            author = Author(name=name, publisher=publisher)
+            author.save()
+            authors.append(author)
+        site = Site.objects.get_current()
+        for index in range(5):
+            article = Article(title=str(index), author=authors[index % 3], coauthors=set(authors[:2]), sites=set([site]))
+            article.save()
+        
+        calls = self.count_get_many()
+        articles = list(Article.objects.prefetch_references('author.publisher', 'coauthors', 'sites'))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0], (Author._meta.collection, sorted([author.pk for author in authors])))
+        self.assertEqual([article.author.name for article in articles], ['a', 'b', 'c', 'a', 'b'])
+        self.assertEqual(articles[0].author.publisher.name, 'press')
+        self.assertEqual(sorted([author.name for author in articles[0].coauthors]), ['a', 'b'])
+        self.assertEqual(list(articles[0].sites), [site])
+        self.assertEqual(len(calls), 2)
+        
+        article = Article.objects.prefetch_references('author').get(pk=articles[0].pk)
+        self.assertTrue('author' in article._python_data)
+        self.assertEqual(len(Article.objects.prefetch_references('author')[1:3]), 2)
+    
+    def test_lazy_references(self):
+        Article.objects.all().delete()
+        Author.objects.all().delete()
+        authors = list()
+        for name in ('a', 'b', 'c'):
+            author = Author(name=name)
+            author.save()
+            authors.append(author)
+        for index in range(3):
+            Article(title=str(index), author=authors[index]).save()
+        
+        calls = self.count_get_many()
+        articles = list(Article.objects.all())
+        self.assertEqual([article.author.pk for article in articles], [author.pk for author in authors])
+        self.assertTrue(isinstance(articles[0].author, Author))
+        self.assertEqual(calls, [])
+        
+        self.assertEqual(articles[2].author.name, 'c')
+        self.assertEqual([article.author.name for article in articles], ['a', 'b', 'c'])
+        self.assertEqual(len(calls), 1)
+        
+        #saving keeps the reference
+        articles[0].title = 'changed'
+        articles[0].save()
+        self.assertEqual(Article.objects.get(pk=articles[0].pk).author.name, 'a')
+        
+        authors[1].delete()
+        article = Article.objects.get(pk=articles[1].pk)
+        self.assertEqual(article.author.pk, authors[1].pk)
+        self.assertRaises(Author.DoesNotExist, getattr, article.author, 'name')
+    
+    def test_dangling_references(self):
+        publisher = Publisher(name='a')
+        publisher.save()
+        author = Author(name='a', publisher=publisher)
+        author.save()
+        publisher.delete()
+        self.assertEqual(Author.objects.get(pk=author.pk).publisher, None)
+        
+        authors = list()
+        for name in ('a', 'b'):
+            author = Author(name=name)
+            author.save()
+            authors.append(author)
+        article = Article(title='a', author=authors[0], coauthors=set(authors))
+        article.save()
+        authors[1].delete()
+        self.assertEqual([author.name for author in Article.objects.get(pk=article.pk).coauthors], ['a'])
+    
+    def test_counter_index(self):
+        self.preserve_registered_indexes()
+        Book.objects.filter(published=True).counter('featured', 'countries').commit()
+        
+        book_a = Book(title='a', published=True, featured=True, countries=['US', 'GB'])
+        book_a.save()
+        book_b = Book(title='b', published=True, featured=False, countries=['US'])
+        book_b.save()
+        Book(title='c', published=False, featured=True, countries=['US']).save()
+        
+        query = Book.objects.filter(published=True)
+        self.assertEqual(query.facet_counts('countries'), {'US': 2, 'GB': 1})
+        self.assertEqual(query.facet_counts('featured'), {True: 1, False: 1})
+        self.assertEqual(query.filter(featured=True).count(), 1)
+        self.assertEqual(query.filter(featured=True)._count_from_counter(), 1)
+        
+        book_b.featured = True
+        book_b.countries = ['GB']
+        book_b.save()
+        self.assertEqual(query.facet_counts('countries'), {'US': 1, 'GB': 2})
+        self.assertEqual(query.filter(featured=True).count(), 2)
+        
+        #documents leaving the filtered set are no longer counted
+        book_b.published = False
+        book_b.save()
+        self.assertEqual(query.facet_counts('countries'), {'US': 1, 'GB': 1})
+        self.assertEqual(query.filter(featured=True).count(), 1)
+        
+        #uncounted dot paths are computed from the matching documents
+        self.assertEqual(query.facet_counts('title'), {'a': 1})
+        self.assertEqual(query.filter(title='a')._count_from_counter(), None)
+        
+        book_a.delete()
+        self.assertEqual(query.facet_counts('countries'), {})
+        self.assertEqual(query.filter(featured=True).count(), 0)
+    
+    def test_concurrent_counter_creation(self):
+        from dockit.backends.djangodocument.models import RegisteredIndexCounter
+        self.preserve_registered_indexes()
+        queryset = Book.objects.filter(published=True).counter('countries')
+        queryset.commit()
+        Book(title='a', published=True, countries=['US']).save()
+        registered_index = RegisteredIndex.objects.get(collection=Book._meta.collection, query_hash=queryset._index_hash())
+        
+        #another process creates the counter between our update and create
+        create = RegisteredIndexCounter.objects.create
+        def racing_create(**kwargs):
+            create(**dict(kwargs, count=2))
+            return create(**kwargs)
+        RegisteredIndexCounter.objects.create = racing_create
+        try:
+            RegisteredIndex.objects.update_counters(registered_index, 'countries', [], ['GB'])
+        finally:
+            RegisteredIndexCounter.objects.create = create
+        self.assertEqual(registered_index.counters.filter(value='"GB"').count(), 1)
+        self.assertEqual(Book.objects.filter(published=True).facet_counts('countries'), {'US': 1, 'GB': 3})
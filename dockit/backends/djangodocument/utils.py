@@ -1,4 +1,12 @@
-from django.db import connection
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, transaction, DatabaseError
+
+from dockit.backends.djangodocument.formats import get_format_of
+from dockit.schema.common import apply_primitive_update
+
+JSON_PATCH_SUPPORT = dict()
 
 def db_table_exists(table, cursor=None):
     if hasattr(connection.introspection, 'table_names'):
@@ -10,3 +18,113 @@ def db_table_exists(table, cursor=None):
             raise Exception
         table_names = connection.introspection.get_table_list(cursor)
         return table in table_names
+
+def explain_sql(sql, params, using='default'):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    cursor = connection.cursor()
+    cursor.execute(prefix + sql, params)
+    return list(cursor.fetchall())
+
+def supports_json_patch(using='default'):
+    """
+    Returns True if the database can patch json columns in place (SQLite's json1)
+    """
+    if using not in JSON_PATCH_SUPPORT:
+        connection = connections[using]
+        supported = False
+        if connection.vendor == 'sqlite':
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT json_set('{}', '$.a', 1)")
+            except DatabaseError:
+                pass
+            else:
+                supported = True
+        JSON_PATCH_SUPPORT[using] = supported
+    return JSON_PATCH_SUPPORT[using]
+
+def json_path(dotpath):
+    path = ['$']
+    for part in dotpath.split('.'):
+        if part.isdigit():
+            path.append('[%s]' % part)
+        else:
+            path.append('."%s"' % part.replace('"', '\\"'))
+    return ''.join(path)
+
+def json_patch_sql(column, operations):
+    """
+    Returns the sql expression and params applying the (dotpath, operation, value)
+    updates to a json column
+    """
+    expression = column
+    params = list()
+    for dotpath, operation, value in operations:
+        parts = dotpath.split('.')
+        for index in range(1, len(parts)):
+            #json_set does not create missing containers
+            expression = 'json_insert(%s, %%s, json(%%s))' % expression
+            params.append(json_path('.'.join(parts[:index])))
+            params.append(parts[index].isdigit() and '[]' or '{}')
+        path = json_path(dotpath)
+        if operation == 'inc':
+            expression = 'json_set(%s, %%s, COALESCE(json_extract(%s, %%s), 0) + %%s)' % (expression, column)
+            params.extend([path, path, value])
+        else:
+            expression = 'json_set(%s, %%s, json(%%s))' % expression
+            params.extend([path, json.dumps(value, cls=DjangoJSONEncoder)])
+    return expression, params
+
+def patch_json_rows(queryset, operations, column='data', batch_size=500):
+    """
+    Applies the (dotpath, operation, value) updates to the json column of the
+    rows in the queryset. Uses a single UPDATE per batch where the database
+    supports it, otherwise each row is patched in python.
+    """
+    model = queryset.model
+    using = queryset.db
+    pks = list(queryset.values_list('pk', flat=True))
+    fallback = pks
+    if supports_json_patch(using):
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        expression, params = json_patch_sql(qn(column), operations)
+        cursor = connection.cursor()
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start+batch_size]
+            sql = "UPDATE %s SET %s = %s WHERE %s IN (%s) AND %s LIKE '{%%%%'" % (
+                qn(model._meta.db_table), qn(column), expression, qn(model._meta.pk.column),
+                ', '.join(['%s'] * len(batch)), qn(column))
+            cursor.execute(sql, params + batch)
+        transaction.commit_unless_managed(using=using)
+        #rows that are not stored as json objects
+        fallback = list()
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start+batch_size]
+            rows = model.objects.using(using).filter(pk__in=batch).exclude(**{'%s__startswith' % column: '{'})
+            fallback.extend(rows.values_list('pk', flat=True))
+    for start in range(0, len(fallback), batch_size):
+        batch = fallback[start:start+batch_size]
+        rows = model.objects.using(using).filter(pk__in=batch)
+        if hasattr(rows, 'select_for_update'): #django 1.4 and later
+            #the rows stay locked until the batch is committed where the database supports it
+            rows = rows.select_for_update()
+        rows = rows.values_list('pk', column)
+        for pk, data in list(rows):
+            while data:
+                #compressed rows are written back in the format they were read in
+                storage_format = get_format_of(data)
+                patched = storage_format.decode(data)
+                for dotpath, operation, value in operations:
+                    apply_primitive_update(patched, dotpath, operation, value)
+                #without row locks the row may have changed since it was read, patch it again
+                if model.objects.using(using).filter(**{'pk': pk, column: data}).update(**{column: storage_format.encode(patched)}):
+                    break
+                current = list(model.objects.using(using).filter(pk=pk).values_list(column, flat=True))
+                data = current and current[0] or None
+        transaction.commit_unless_managed(using=using)
+    return len(pks)
@@ -0,0 +1,25 @@
+class F(object):
+    """
+    Refers to the stored value of a dot path in an update, adding or
+    subtracting a number produces an atomic increment:
+    MyDocument.objects.filter(slug='home').update(**{'stats.views': F('stats.views') + 1})
+    """
+    def __init__(self, dotpath):
+        self.dotpath = dotpath.replace('__', '.')
+    
+    def __add__(self, other):
+        return Increment(self.dotpath, other)
+    
+    def __sub__(self, other):
+        return Increment(self.dotpath, -other)
+    
+    def __repr__(self):
+        return '<F: %s>' % self.dotpath
+
+class Increment(object):
+    def __init__(self, dotpath, amount):
+        self.dotpath = dotpath
+        self.amount = amount
+    
+    def __repr__(self):
+        return '<Increment: %s by %s>' % (self.dotpath, self.amount)
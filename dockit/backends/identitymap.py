@@ -0,0 +1,62 @@
+import threading
+
+IDENTITY_MAP = threading.local()
+
+def get_identity_map():
+    '''
+    Returns the identity map active in this thread or None
+    '''
+    return getattr(IDENTITY_MAP, 'current', None)
+
+class IdentityMap(object):
+    '''
+    Keeps one instance per (collection, pk) so repeated lookups of a
+    document return the instance that was already loaded
+    '''
+    def __init__(self):
+        self.documents = dict()
+        self.hits = 0
+    
+    def get(self, collection, doc_id):
+        instance = self.documents.get((collection, unicode(doc_id)))
+        if instance is not None:
+            self.hits += 1
+        return instance
+    
+    def add(self, instance):
+        doc_id = instance.get_id()
+        if doc_id is not None:
+            self.documents[(instance._meta.collection, unicode(doc_id))] = instance
+    
+    def remove(self, collection, doc_id):
+        self.documents.pop((collection, unicode(doc_id)), None)
+    
+    def clear(self, collection=None):
+        if collection is None:
+            self.documents.clear()
+            return
+        for key in self.documents.keys():
+            if key[0] == collection:
+                del self.documents[key]
+
+def activate_identity_map():
+    if get_identity_map() is None:
+        IDENTITY_MAP.current = IdentityMap()
+    return IDENTITY_MAP.current
+
+def deactivate_identity_map():
+    IDENTITY_MAP.current = None
+
+class identity_map(object):
+    '''
+    Context manager activating an identity map for the block, see
+    dockit.middleware.IdentityMapMiddleware for requests
+    '''
+    def __enter__(self):
+        self.outer = get_identity_map() is not None
+        return activate_identity_map()
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.outer:
+            deactivate_identity_map()
+        return False
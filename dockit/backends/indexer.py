@@ -19,4 +19,10 @@ class BaseIndexer(object):
     
     def values(self):
         raise NotImplementedError
+    
+    def extra(self):
+        '''
+        Returns keyword arguments for queryset.extra or None
+        '''
+        return None
 
@@ -0,0 +1,111 @@
+"""
+Encodes and decodes the json stored by the backends. The codec is picked by
+the DOCKIT_JSON_CODEC setting, a dotted path to a codec class. By default the
+first codec whose library is installed is used:
+    
+    DOCKIT_JSON_CODEC = 'dockit.backends.jsoncodec.SimpleJSONCodec'
+
+Every codec encodes dates, times and decimals with DjangoJSONEncoder so the
+stored text of these values does not depend on the codec.
+"""
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+    UJSON_LOADS_OPTIONS = {}
+else:
+    #newer releases always decode floats precisely and reject the keyword
+    try:
+        ujson.loads('0.1', precise_float=True)
+    except TypeError:
+        UJSON_LOADS_OPTIONS = {}
+    else:
+        UJSON_LOADS_OPTIONS = {'precise_float': True}
+
+class BaseJSONCodec(object):
+    name = None
+    
+    @classmethod
+    def is_available(cls):
+        return True
+    
+    def dumps(self, data):
+        raise NotImplementedError
+    
+    def loads(self, text):
+        raise NotImplementedError
+
+class StandardJSONCodec(BaseJSONCodec):
+    '''
+    Uses the json module of the standard library
+    '''
+    name = 'json'
+    
+    def dumps(self, data):
+        return json.dumps(data, cls=DjangoJSONEncoder)
+    
+    def loads(self, text):
+        return json.loads(text)
+
+class SimpleJSONCodec(BaseJSONCodec):
+    '''
+    Uses simplejson and its C speedups. Decimals are not written as numbers,
+    they are passed to DjangoJSONEncoder like the standard library does.
+    '''
+    name = 'simplejson'
+    
+    def __init__(self):
+        self.default = DjangoJSONEncoder().default
+    
+    @classmethod
+    def is_available(cls):
+        return simplejson is not None
+    
+    def dumps(self, data):
+        return simplejson.dumps(data, default=self.default, use_decimal=False)
+    
+    def loads(self, text):
+        return simplejson.loads(text)
+
+class UltraJSONCodec(StandardJSONCodec):
+    '''
+    Decodes with ujson. ujson can not be told how to encode dates and
+    decimals, encoding is left to the standard library.
+    '''
+    name = 'ujson'
+    
+    @classmethod
+    def is_available(cls):
+        return ujson is not None
+    
+    def loads(self, text):
+        return ujson.loads(text, **UJSON_LOADS_OPTIONS)
+
+CODECS = [UltraJSONCodec, SimpleJSONCodec, StandardJSONCodec]
+
+JSON_CODEC = None
+
+def get_available_codecs():
+    return [codec for codec in CODECS if codec.is_available()]
+
+def get_json_codec():
+    global JSON_CODEC
+    if JSON_CODEC is None:
+        from dockit.backends import dynamic_import
+        path = getattr(settings, 'DOCKIT_JSON_CODEC', None)
+        if path:
+            codec = dynamic_import(path)
+        else:
+            codec = get_available_codecs()[0]
+        JSON_CODEC = codec()
+    return JSON_CODEC
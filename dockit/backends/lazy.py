@@ -0,0 +1,67 @@
+import threading
+import weakref
+
+PENDING_REFERENCES = threading.local()
+
+def get_pending(document):
+    '''
+    Returns the unresolved lazy references to the document class by id()
+    '''
+    if not hasattr(PENDING_REFERENCES, 'documents'):
+        PENDING_REFERENCES.documents = dict()
+    return PENDING_REFERENCES.documents.setdefault(document, weakref.WeakValueDictionary())
+
+def lazy_reference(document, doc_id):
+    '''
+    Returns an instance of the document that only knows its id. The first
+    access to a field loads it together with every other pending reference
+    to the same document class.
+    '''
+    from dockit.backends.identitymap import get_identity_map
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        instance = identity_map.get(document._meta.collection, doc_id)
+        if instance is not None:
+            return instance
+    id_field = document._meta.get_document_backend_for_read().get_id_field_name()
+    instance = document.to_python({id_field: doc_id})
+    instance._deferred_fields = frozenset(document._meta.fields.keys())
+    instance._lazy_reference = True
+    get_pending(document)[id(instance)] = instance
+    return instance
+
+def resolve_lazy_references(instance, batch_size=500):
+    '''
+    Loads the lazy reference along with the other pending references to the
+    same document class using a single get_many
+    '''
+    document = type(instance)
+    pending = get_pending(document)
+    batch = [instance]
+    for other in pending.values():
+        if other is not instance and other._deferred_fields and len(batch) < batch_size:
+            batch.append(other)
+    for other in batch:
+        pending.pop(id(other), None)
+    
+    doc_ids = list(set([other.get_id() for other in batch]))
+    backend = document._meta.get_document_backend_for_read()
+    found = dict()
+    for data in backend.get_many(document, document._meta.collection, doc_ids):
+        if data is not None:
+            found[unicode(backend.get_id(data))] = data
+    
+    for other in batch:
+        data = found.get(unicode(other.get_id()))
+        if data is None:
+            if other is not instance:
+                pending[id(other)] = other #raises when it is accessed
+            continue
+        for key, value in data.iteritems():
+            if key not in other._primitive_data and key not in other._python_data:
+                other._primitive_data[key] = value
+        other._deferred_fields = frozenset()
+        other._lazy_reference = False
+        other._tracked = True
+    if instance._lazy_reference:
+        raise document.DoesNotExist('Referenced document %s does not exist' % instance.get_id())
@@ -36,23 +36,37 @@ class DocumentQuery(BaseDocumentQuery):
     def collection(self):
         return self.document._meta.get_backend().get_collection(self.document._meta.collection)
     
+    def _build_fields(self):
+        loaded_keys = self.get_loaded_keys()
+        if loaded_keys is None:
+            return None
+        keep, deferred, defer = loaded_keys
+        if defer:
+            return dict([(key, 0) for key in deferred])
+        return list(keep)
+    
     @property
     def queryset(self):
         params = self._build_params()
+        fields = self._build_fields()
         if params:
             try:
-                return self.collection.find(params)
+                return self.collection.find(params, fields=fields)
             except TypeError:
                 #why is it pymongo wants tuples for some and dictionaries for others?
-                return self.collection.find(params.items())
-        return self.collection.find()
+                return self.collection.find(params.items(), fields=fields)
+        return self.collection.find(fields=fields)
     
     def wrap(self, entry):
         entry['_id'] = unicode(entry['_id'])
-        return self.document.to_python(entry)
+        return self.build_document(entry)
     
     def delete(self):
         params = self._build_params()
+        backend = self.document._meta.get_document_backend_for_write()
+        doc_ids = [entry['_id'] for entry in self.collection.find(params, fields=['_id'])]
+        for doc_id in doc_ids:
+            backend.record_change(self.document._meta.collection, doc_id, deleted=True)
         if params:
             return self.collection.remove(params)
         return self.collection.remove()
@@ -62,15 +76,19 @@ class DocumentQuery(BaseDocumentQuery):
         for op in filter_operations:
             indexer = self._get_indexer_for_operation(self.document, op)
             params.update(indexer.filter())
+        fields = self._build_fields()
         try:
-            ret = self.collection.find_one(params)
+            ret = self.collection.find_one(params, fields=fields)
         except TypeError:
             #why is it pymongo wants tuples for some and dictionaries for others?
-            ret = self.collection.find_one(params.items())
+            ret = self.collection.find_one(params.items(), fields=fields)
         if ret is None:
             raise self.document.DoesNotExist
         return self.wrap(ret)
     
+    def doc_ids(self):
+        return [unicode(entry['_id']) for entry in self.collection.find(self._build_params(), fields=['_id'])]
+    
     def values(self, *limit_to, **kwargs):
         params = self._build_params(include_indexes=True)
         fields = limit_to or None
@@ -78,6 +96,81 @@ class DocumentQuery(BaseDocumentQuery):
             return self.collection.find(params, fields=fields, as_class=ValuesResultClass)
         return self.collection.find(fields=fields, as_class=ValuesResultClass)
     
+    def facet_counts(self, dotpath):
+        pipeline = [{'$group': {'_id': '$%s' % dotpath, 'count': {'$sum': 1}}}]
+        params = self._build_params()
+        if params:
+            pipeline.insert(0, {'$match': params})
+        counts = dict()
+        for row in self.collection.aggregate(pipeline)['result']:
+            #lists are grouped as a whole, count each of their entries
+            values = row['_id']
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                counts[value] = counts.get(value, 0) + row['count']
+        return counts
+    
+    def _group_partials(self, name, aggregate):
+        group = dict()
+        if aggregate.dotpath is None:
+            group['%s__count' % name] = {'$sum': 1}
+            return group
+        path = '$%s' % aggregate.dotpath
+        has_value = {'$cond': [{'$eq': [{'$ifNull': [path, None]}, None]}, 0, 1]}
+        operators = {'count': {'$sum': has_value},
+                     'sum': {'$sum': path},
+                     'min': {'$min': path},
+                     'max': {'$max': path},}
+        for partial in aggregate.partials:
+            group['%s__%s' % (name, partial)] = operators[partial]
+        return group
+    
+    def _run_group(self, group_id, aggregates):
+        group = {'_id': group_id}
+        for name, aggregate in aggregates.iteritems():
+            group.update(self._group_partials(name, aggregate))
+        pipeline = [{'$group': group}]
+        params = self._build_params()
+        if params:
+            pipeline.insert(0, {'$match': params})
+        results = list()
+        for row in self.collection.aggregate(pipeline)['result']:
+            entry = dict()
+            for name, aggregate in aggregates.iteritems():
+                partial = dict()
+                for key in aggregate.partials:
+                    partial[key] = row.get('%s__%s' % (name, key))
+                entry[name] = aggregate.combine([partial])
+            results.append((row['_id'], entry))
+        return results
+    
+    def aggregate(self, **aggregates):
+        results = self._run_group(None, aggregates)
+        if results:
+            return results[0][1]
+        return dict([(name, aggregate.combine([])) for name, aggregate in aggregates.iteritems()])
+    
+    def annotate_group_by(self, dotpath, **aggregates):
+        results = list()
+        for value, entry in sorted(self._run_group('$%s' % dotpath, aggregates)):
+            if value is None:
+                continue
+            entry[dotpath] = value
+            results.append(entry)
+        return results
+    
+    def distinct_values(self, dotpath):
+        return sorted([value for value in self.queryset.distinct(dotpath) if value is not None])
+    
+    def explain(self, database=False):
+        plan = {'spec': self._build_params(),
+                'fields': self._build_fields(),
+                'hint': None,} #we leave index selection to mongo
+        if database:
+            plan['database'] = self.queryset.explain()
+        return plan
+    
     def __len__(self):
         return self.queryset.count()
     
@@ -103,6 +196,26 @@ class MongoStorageMixin(object):
     
     def get_collection(self, collection):
         return self.db[collection]
+    
+    def get_changes_collection(self, collection):
+        return self.db['%s.changes' % collection]
+    
+    def next_sequence(self, collection):
+        result = self.db['dockit_sequences'].find_and_modify({'_id': collection}, {'$inc': {'seq': 1}}, upsert=True, new=True)
+        return result['seq']
+    
+    def record_change(self, collection, doc_id, deleted=False):
+        seq = self.next_sequence(collection)
+        doc_id = unicode(doc_id)
+        self.get_changes_collection(collection).update({'_id': doc_id}, {'_id': doc_id, 'seq': seq, 'deleted': deleted}, upsert=True, safe=True)
+    
+    def changes(self, doc_class, collection, since=0):
+        changes = self.get_changes_collection(collection)
+        changes.ensure_index('seq')
+        for change in changes.find({'seq': {'$gt': since}}).sort('seq', 1):
+            yield {'seq': change['seq'],
+                   'id': change['_id'],
+                   'deleted': change['deleted'],}
 
 class MongoIndexStorage(BaseIndexStorage, MongoStorageMixin):
     name = "mongodb"
@@ -141,6 +254,7 @@ class MongoDocumentStorage(BaseDocumentStorage, MongoStorageMixin):
             data[id_field] = ObjectId(data[id_field])
         self.get_collection(collection).save(data, safe=True)
         data[id_field] = unicode(data[id_field])
+        self.record_change(collection, data[id_field])
     
     def get(self, doc_class, collection, doc_id):
         data = self.get_collection(collection).find_one({'_id':ObjectId(doc_id)})
@@ -150,9 +264,40 @@ class MongoDocumentStorage(BaseDocumentStorage, MongoStorageMixin):
         data[id_field] = unicode(data[id_field])
         return data
     
+    def get_many(self, doc_class, collection, doc_ids):
+        id_field = self.get_id_field_name()
+        found = dict()
+        for data in self.get_collection(collection).find({'_id':{'$in':[ObjectId(doc_id) for doc_id in doc_ids]}}):
+            data[id_field] = unicode(data[id_field])
+            found[data[id_field]] = data
+        return [found.get(unicode(doc_id)) for doc_id in doc_ids]
+    
+    def update(self, doc_class, collection, doc_ids, operations):
+        spec = dict()
+        for dotpath, operation, value in operations:
+            if operation == 'inc':
+                spec.setdefault('$inc', dict())[dotpath] = value
+            else:
+                spec.setdefault('$set', dict())[dotpath] = value
+        self.get_collection(collection).update({'_id': {'$in': [ObjectId(doc_id) for doc_id in doc_ids]}}, spec, multi=True, safe=True)
+        for doc_id in doc_ids:
+            self.record_change(collection, doc_id)
+        return len(doc_ids)
+    
+    def iter_ids(self, doc_class, collection):
+        #object ids have a fixed length
+        for data in self.get_collection(collection).find(fields=['_id']).sort('_id', 1):
+            yield unicode(data['_id'])
+    
     def delete(self, doc_class, collection, doc_id):
+        self.record_change(collection, doc_id, deleted=True)
         return self.get_collection(collection).remove(ObjectId(doc_id), safe=True)
     
+    def delete_many(self, doc_class, collection, doc_ids):
+        for doc_id in doc_ids:
+            self.record_change(collection, doc_id, deleted=True)
+        return self.get_collection(collection).remove({'_id':{'$in':[ObjectId(doc_id) for doc_id in doc_ids]}}, safe=True)
+    
     def get_id_field_name(self):
         return '_id'
     
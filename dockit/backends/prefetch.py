@@ -0,0 +1,113 @@
+from dockit.schema.common import DotPathList, DotPathSet
+
+def get_reference_target(field, instance):
+    '''
+    Returns ('document', document class) or ('model', model class) for a
+    reference field or a list or set of references, otherwise None
+    '''
+    from dockit.schema.fields import ReferenceField, ModelReferenceField, ListField
+    if isinstance(field, ListField):
+        field = field.subfield
+    if isinstance(field, ReferenceField):
+        if field.self_reference:
+            return ('document', type(instance))
+        return ('document', field.document)
+    if isinstance(field, ModelReferenceField):
+        return ('model', field.model)
+    return None
+
+def load_documents(document, doc_ids):
+    '''
+    Returns a dictionary of the documents with the given ids loaded with a
+    single multi get, using the identity map when one is active
+    '''
+    from dockit.backends.identitymap import get_identity_map
+    identity_map = get_identity_map()
+    collection = document._meta.collection
+    found = dict()
+    to_fetch = list()
+    for doc_id in doc_ids:
+        instance = identity_map and identity_map.get(collection, doc_id) or None
+        if instance is not None:
+            found[unicode(doc_id)] = instance
+        else:
+            to_fetch.append(doc_id)
+    if to_fetch:
+        backend = document._meta.get_document_backend_for_read()
+        for data in backend.get_many(document, collection, to_fetch):
+            if data is None:
+                continue
+            instance = document.to_python(data)
+            instance._tracked = True
+            found[unicode(instance.get_id())] = instance
+            if identity_map is not None:
+                identity_map.add(instance)
+    return found
+
+def load_models(model, pks):
+    return dict([(unicode(pk), obj) for pk, obj in model._default_manager.in_bulk(pks).iteritems()])
+
+def iter_values(value):
+    if isinstance(value, (list, tuple, set, DotPathList, DotPathSet)):
+        for item in value:
+            if item is not None:
+                yield item
+    elif value is not None:
+        yield value
+
+def prefetch_references(instances, dotpath, cache=None):
+    '''
+    Loads the references found at the dot path of every instance with one
+    lookup per referenced collection or model and assigns them. Dot paths may
+    continue through loaded references and embedded schemas, for instance
+    'author.publisher' or 'chapters.author'. Pass the same cache dictionary
+    when prefetching several dot paths to load every reference once.
+    '''
+    if cache is None:
+        cache = dict()
+    parts = dotpath.split('.')
+    name, rest = parts[0], '.'.join(parts[1:])
+    
+    pending = dict() #target => [(instance, field, primitive value)]
+    for instance in instances:
+        fields = instance._meta.fields
+        if name not in fields.reference_fields or name in instance._python_data:
+            continue
+        field = fields[name]
+        target = get_reference_target(field, instance)
+        if target is None:
+            continue
+        pending.setdefault(target, list()).append((instance, field, instance._primitive_data.get(name)))
+    
+    for (kind, target), entries in pending.iteritems():
+        keys = set()
+        for instance, field, value in entries:
+            for item in iter_values(value):
+                if not isinstance(item, (dict, list, tuple)): #natural keys are resolved lazily
+                    keys.add(item)
+        loaded = cache.setdefault((kind, target), dict())
+        keys = [key for key in keys if unicode(key) not in loaded]
+        if keys and kind == 'document':
+            loaded.update(load_documents(target, keys))
+        elif keys:
+            loaded.update(load_models(target, keys))
+        for instance, field, value in entries:
+            if isinstance(value, (list, tuple)):
+                value = [loaded[unicode(item)] for item in value
+                         if not isinstance(item, (dict, list, tuple)) and unicode(item) in loaded]
+            elif value is None or isinstance(value, dict):
+                continue
+            elif unicode(value) in loaded:
+                value = loaded[unicode(value)]
+            else:
+                continue #missing references raise on access as before
+            instance._python_data[name] = field.to_python(value, parent=instance)
+    
+    if rest:
+        children = list()
+        for instance in instances:
+            if name in instance._meta.fields:
+                children.extend(iter_values(getattr(instance, name)))
+        children = [child for child in children if hasattr(child, '_meta') and hasattr(child, '_primitive_data')]
+        if children:
+            prefetch_references(children, rest, cache)
@@ -3,6 +3,8 @@ import copy
 from dockit.backends.queryset import QuerySet
 
 class QueryFilterOperation(object):
+    __slots__ = ('key', 'operation', 'value')
+    
     def __init__(self, key, operation, value):
         self.key = key
         self.operation = operation
@@ -33,6 +35,12 @@ class QueryFilterOperation(object):
         if not isinstance(other, type(self)):
             return False
         return hash(self) == hash(other)
+    
+    def __getstate__(self):
+        return (self.key, self.operation, self.value)
+    
+    def __setstate__(self, state):
+        self.key, self.operation, self.value = state
 
 class QueryIndex(object):
     """
@@ -45,6 +53,10 @@ class QueryIndex(object):
         self.inclusions = list()
         self.exclusions = list()
         self.indexes = list()
+        self.covered = None
+        self.counters = None
+        self.deferred_loading = (frozenset(), True)
+        self.prefetch = ()
         
         self._queryset = None
     
@@ -68,6 +80,10 @@ class QueryIndex(object):
         new_index.inclusions = self.inclusions + inclusions
         new_index.exclusions = self.exclusions + exclusions
         new_index.indexes = self.indexes + indexes
+        new_index.covered = self.covered
+        new_index.counters = self.counters
+        new_index.deferred_loading = self.deferred_loading
+        new_index.prefetch = self.prefetch
         return new_index
     
     def _clone(self):
@@ -82,13 +98,17 @@ class QueryIndex(object):
                 return False
         return True
     
+    def _uses_index(self):
+        return not self._pk_only() and bool(self.inclusions or self.exclusions or self.indexes)
+    
     def _build_queryset(self):
-        if (not self._pk_only() and (self.inclusions or self.exclusions or self.indexes)):
+        if self._uses_index():
             backend = self.document._meta.get_index_backend_for_read(self)
         else:
             backend = self.document._meta.get_document_backend_for_read()
         query = backend.get_query(self)
-        return QuerySet(query)
+        query.deferred_loading = self.deferred_loading
+        return QuerySet(query, prefetch=self.prefetch)
     
     @property
     def collection(self):
@@ -115,6 +135,35 @@ class QueryIndex(object):
         exclusions = self._parse_kwargs(kwargs)
         return self._add_filter_parts(exclusions=exclusions)
     
+    def search(self, query, dotpath=None):
+        """
+        Returns the documents matching the full text query, best matches first.
+        The dot path may be omitted when the collection has a single full text index.
+        """
+        if dotpath is None:
+            from dockit.backends import get_index_router
+            router = get_index_router()
+            router.make_app_ready()
+            registered = router.registered_querysets.get(self.collection, {})
+            keys = set()
+            for query_index in registered.itervalues():
+                keys.update([param.key for param in query_index.indexes if param.operation == 'search'])
+            if len(keys) != 1:
+                raise ValueError('Specify which full text index of %s to search' % self.collection)
+            key = keys.pop()
+        else:
+            key = dotpath.replace('.', '__')
+        return self.filter(**{'%s__search' % key: query})
+    
+    def prefetch_references(self, *dotpaths):
+        """
+        Loads the documents or models referenced at the dot paths for all the
+        returned documents at once, one lookup per referenced collection or model.
+        """
+        new_index = self._clone()
+        new_index.prefetch = self.prefetch + tuple([dotpath.replace('__', '.') for dotpath in dotpaths])
+        return new_index
+    
     def index(self, *args):
         items = list()
         for arg in args:
@@ -122,6 +171,57 @@ class QueryIndex(object):
             items.append(QueryFilterOperation(key=key, operation=operation, value=None))
         return self._add_filter_parts(indexes=items)
     
+    def covering(self, *dotpaths):
+        """
+        Returns an index that stores only a projection of the given dot paths
+        with each indexed document. Calling with no dot paths stores no copy
+        of the document at all; documents are then loaded from the document store.
+        """
+        new_index = self._clone()
+        new_index.covered = tuple(dotpaths)
+        return new_index
+    
+    def counter(self, *dotpaths):
+        """
+        Returns an index that also maintains the number of documents per value
+        of the given dot paths. The counts are updated as documents are saved
+        and deleted and are read by count() and facet_counts().
+        """
+        keys = [dotpath.replace('.', '__') for dotpath in dotpaths]
+        indexed = set([param.key for param in self.indexes if param.operation == 'exact'])
+        items = list()
+        for key in keys:
+            if key not in indexed:
+                items.append(QueryFilterOperation(key=key, operation='exact', value=None))
+        new_index = self._add_filter_parts(indexes=items)
+        new_index.counters = tuple(self.counters or ()) + tuple(keys)
+        return new_index
+    
+    def defer(self, *fields):
+        """
+        Returns an index whose documents load the given top level fields
+        on first access. Passing None clears any deferred fields.
+        """
+        new_index = self._clone()
+        if fields == (None,):
+            new_index.deferred_loading = (frozenset(), True)
+            return new_index
+        existing, defer = self.deferred_loading
+        if defer:
+            new_index.deferred_loading = (existing.union(fields), True)
+        else:
+            new_index.deferred_loading = (existing.difference(fields), False)
+        return new_index
+    
+    def only(self, *fields):
+        """
+        Returns an index whose documents load only the given top level fields,
+        the remaining fields are loaded on first access.
+        """
+        new_index = self._clone()
+        new_index.deferred_loading = (frozenset(fields), False)
+        return new_index
+    
     def commit(self):
         from dockit.schema.loading import register_indexes
         register_indexes(self.document._meta.app_label, self)
@@ -129,6 +229,29 @@ class QueryIndex(object):
     def setname(self, name):
         self.name = name
     
+    def _references(self, dotpaths):
+        """
+        Returns True if the index filters on, indexes or covers any of the dot paths
+        """
+        paths = [op.dotpath() for op in self.inclusions + self.exclusions + self.indexes]
+        paths.extend(self.covered or ())
+        paths.extend(self.counters or ())
+        for dotpath in dotpaths:
+            for path in paths:
+                if dotpath == path or dotpath.startswith(path + '.') or path.startswith(dotpath + '.'):
+                    return True
+        return False
+    
+    def _depends_on(self, dotpaths):
+        """
+        Returns True if changing the dot paths requires the index entry of a
+        document to be evaluated again. Indexes keeping a copy of the whole
+        document depend on every dot path.
+        """
+        if not dotpaths:
+            return False
+        return self.covered is None or self._references(dotpaths)
+    
     def _index_hash(self):
         parts = list()
         parts.append('inclusions:')
@@ -137,6 +260,12 @@ class QueryIndex(object):
         parts.append(hash(tuple(self.exclusions)))
         parts.append('indexes:')
         parts.append(hash(tuple(self.indexes)))
+        if self.covered is not None:
+            parts.append('covered:')
+            parts.append(hash(self.covered))
+        if self.counters is not None:
+            parts.append('counters:')
+            parts.append(hash(self.counters))
         return hash(tuple(parts))
     
     #proxy queryset methods
@@ -144,16 +273,147 @@ class QueryIndex(object):
         return self.queryset.__len__()
     
     def count(self):
+        count = self._count_from_counter()
+        if count is not None:
+            return count
         return self.__len__()
     
+    def _count_from_counter(self):
+        """
+        Reads the count from a counter index when the query filters a counted
+        dot path by value on top of the counter index's own filters.
+        """
+        from dockit.backends import get_index_router
+        router = get_index_router()
+        for inclusion in self.inclusions:
+            if inclusion.operation != 'exact' or inclusion.key in ('pk', '_pk'):
+                continue
+            inclusions = [op for op in self.inclusions if op is not inclusion]
+            counter_index = router.get_counter_index(self.document, inclusions, self.exclusions, inclusion.key)
+            if counter_index is None:
+                continue
+            backend = self.document._meta.get_index_backend_for_read(counter_index)
+            count = backend.get_count(counter_index, inclusion.key, inclusion.value)
+            if count is not None:
+                return count
+        return None
+    
+    def facet_counts(self, dotpath):
+        """
+        Returns a dictionary mapping each value of the dot path to the number
+        of matching documents. Served from a counter index when one is registered
+        for this query, otherwise computed from the matching documents.
+        """
+        from dockit.backends import get_index_router
+        key = dotpath.replace('.', '__')
+        counter_index = get_index_router().get_counter_index(self.document, self.inclusions, self.exclusions, key)
+        if counter_index is not None:
+            backend = self.document._meta.get_index_backend_for_read(counter_index)
+            counts = backend.get_counts(counter_index, key)
+            if counts is not None:
+                return counts
+        return self.queryset.facet_counts(key.replace('__', '.'))
+    
+    def _aggregate_query(self, dotpaths):
+        """
+        Returns the query index used to compute aggregates over the dot paths,
+        aggregates are only computed from registered indexes.
+        """
+        from dockit.backends import get_index_router
+        keys = [dotpath.replace('.', '__') for dotpath in dotpaths if dotpath is not None]
+        query = self.index(*keys)
+        if query._uses_index():
+            for candidate in get_index_router().get_candidates(query):
+                if candidate['score'] is not None:
+                    return query
+        raise ValueError('No registered index for %s covers %s' % (self.collection, ', '.join(keys)))
+    
+    def aggregate(self, **aggregates):
+        """
+        Computes aggregates over indexed dot paths, for example:
+        MyDocument.objects.filter(published=True).aggregate(total=Sum('price'))
+        """
+        results = dict()
+        for name, aggregate in aggregates.items():
+            if aggregate.dotpath is None and aggregate.name == 'count':
+                results[name] = self.count()
+                del aggregates[name]
+        if aggregates:
+            query = self._aggregate_query([aggregate.dotpath for aggregate in aggregates.itervalues()])
+            results.update(query.queryset.aggregate(**aggregates))
+        return results
+    
+    def annotate_group_by(self, dotpath, **aggregates):
+        """
+        Returns a list with a dictionary for each distinct value of the dot path,
+        holding the value and the aggregates computed for it.
+        """
+        query = self._aggregate_query([dotpath] + [aggregate.dotpath for aggregate in aggregates.itervalues()])
+        return query.queryset.annotate_group_by(dotpath, **aggregates)
+    
+    def distinct_values(self, dotpath):
+        query = self._aggregate_query([dotpath])
+        return query.queryset.distinct_values(dotpath)
+    
     def values(self, *limit_to, **kwargs):
         return self.queryset.values(*limit_to, **kwargs)
     
+    def values_list(self, *limit_to, **kwargs):
+        return self.queryset.values_list(*limit_to, **kwargs)
+    
+    def _parse_updates(self, kwargs):
+        from dockit.backends.expressions import F, Increment
+        from dockit.schema.exceptions import DotPathNotFound
+        operations = list()
+        for key, value in kwargs.iteritems():
+            dotpath = key.replace('__', '.')
+            if isinstance(value, Increment):
+                if value.dotpath != dotpath:
+                    raise ValueError('%s can only be incremented by its own value' % dotpath)
+                operations.append((dotpath, 'inc', value.amount))
+                continue
+            if isinstance(value, F):
+                raise ValueError('F(%s) must be combined with a number' % value.dotpath)
+            try:
+                field = self.document._meta.dot_notation_to_field(dotpath)
+            except DotPathNotFound:
+                field = None
+            if field is not None and value is not None:
+                value = field.to_primitive(value)
+            operations.append((dotpath, 'set', value))
+        return operations
+    
+    def update(self, **kwargs):
+        """
+        Updates the given dot paths of the matching documents in place without
+        loading them. Use F to increment a value atomically:
+        MyDocument.objects.filter(slug='home').update(**{'stats.views': F('stats.views') + 1})
+        Save signals are not sent. Returns the number of updated documents.
+        """
+        from dockit.backends import get_index_router
+        from dockit.backends.identitymap import get_identity_map
+        operations = self._parse_updates(kwargs)
+        doc_ids = self.queryset.doc_ids()
+        if not doc_ids:
+            return 0
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            for doc_id in doc_ids:
+                identity_map.remove(self.collection, doc_id)
+        backend = self.document._meta.get_document_backend_for_write()
+        backend.update(self.document, self.collection, doc_ids, operations)
+        get_index_router().on_update(self.document, self.collection, doc_ids, operations)
+        return len(doc_ids)
+    
     def delete(self):
         #CONSIDER we are taking from an index a list of doc ids
         from dockit.backends import get_index_router
         #TODO index_router should detect if there are any userspace indexes, if not skip notifying indexes
         #TODO if there are userspace indexes, they should be notified in a task
+        from dockit.backends.identitymap import get_identity_map
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            identity_map.clear(self.collection)
         index_router = get_index_router()
         for doc in self.values('pk'):
             index_router.on_delete(self.document, self.collection, doc['pk'])
@@ -164,14 +424,66 @@ class QueryIndex(object):
         ret._queryset = None
         return ret
     
+    def _get_identity_map(self, kwargs):
+        """
+        Returns the active identity map if the lookup is by pk alone
+        """
+        from dockit.backends.identitymap import get_identity_map
+        if self.inclusions or self.exclusions or self.deferred_loading[0]:
+            return None
+        if kwargs.keys() not in (['pk'], ['pk__exact']):
+            return None
+        return get_identity_map()
+    
     def get(self, **kwargs):
+        identity_map = self._get_identity_map(kwargs)
+        if identity_map is not None:
+            instance = identity_map.get(self.collection, kwargs.values()[0])
+            if instance is not None:
+                return instance
         inclusions = self._parse_kwargs(kwargs)
         queryset = self._add_filter_parts(inclusions=inclusions).queryset
-        return queryset.get()
+        instance = queryset.get()
+        if identity_map is not None:
+            identity_map.add(instance)
+        return instance
     
     def exists(self):
         return self.queryset.exists()
     
+    def _describe_index(self, query_index):
+        return {'name': query_index.name,
+                'hash': query_index._index_hash(),
+                'inclusions': query_index.inclusions,
+                'exclusions': query_index.exclusions,
+                'indexes': query_index.indexes,}
+    
+    def explain(self, database=False):
+        """
+        Describes how the query will be executed: the registered index that was
+        picked, the competing candidates with their scores and estimated costs
+        and the query the backend compiled to. If database is True the
+        database's own query plan is included as well.
+        """
+        from dockit.backends import get_index_router
+        router = get_index_router()
+        plan = {'index': None,
+                'candidates': list(),}
+        if self._uses_index():
+            best_match = router.get_effective_queryset(self)
+            for candidate in router.get_candidates(self):
+                entry = self._describe_index(candidate['queryset'])
+                entry['score'] = candidate['score']
+                entry['reason'] = candidate['reason']
+                entry['cost'] = None
+                if candidate['score'] is not None:
+                    entry['cost'] = router.estimate_cost(self, candidate)
+                plan['candidates'].append(entry)
+                if candidate['queryset'] is best_match['queryset']:
+                    plan['index'] = entry
+        plan['query'] = self.queryset.explain(database=database)
+        return plan
+    
     def __getitem__(self, val):
         return self.queryset.__getitem__(val)
     
@@ -2,6 +2,8 @@ class BaseDocumentQuery(object):
     """
     Implemented by the backend to execute a certain index
     """
+    deferred_loading = (frozenset(), True)
+    
     def __init__(self, query_index):
         self.query_index = query_index
     
@@ -16,6 +18,44 @@ class BaseDocumentQuery(object):
     def _get_indexer_for_operation(self, document, op):
         return self.backend._get_indexer_for_operation(document, op)
     
+    def get_loaded_keys(self):
+        """
+        Returns a tuple of (loaded keys, deferred keys, defer) where loaded keys
+        are the top level keys to fetch when only() was used and deferred keys
+        are the keys to skip when defer() was used. Returns None if the whole
+        document is to be loaded.
+        """
+        field_names, defer = self.deferred_loading
+        if not field_names and defer:
+            return None
+        meta = self.document._meta
+        top_level = set([name.split('.')[0] for name in field_names])
+        required = set(['@natural_key', '@natural_key_hash',
+                        meta.get_document_backend_for_read().get_id_field_name()])
+        if meta.typed_field:
+            required.add(meta.typed_field)
+        if defer:
+            return None, top_level - required, True
+        return top_level | required, set(meta.fields.keys()) - top_level - required, False
+    
+    def build_document(self, data):
+        """
+        Returns a document from the primitive data, dropping any deferred keys
+        """
+        loaded_keys = self.get_loaded_keys()
+        if loaded_keys is None:
+            instance = self.document.to_python(data)
+            instance._tracked = True
+            return instance
+        keep, deferred, defer = loaded_keys
+        for key in data.keys():
+            if (defer and key in deferred) or (not defer and key not in keep):
+                del data[key]
+        instance = self.document.to_python(data)
+        instance._deferred_fields = frozenset(deferred)
+        instance._tracked = True
+        return instance
+    
     def __len__(self):
         raise NotImplementedError
     
@@ -38,6 +78,67 @@ class BaseDocumentQuery(object):
     def values(self, *limit_to, **kwargs):
         raise NotImplementedError
     
+    def doc_ids(self):
+        """
+        Returns the ids of the matching documents
+        """
+        return self.values_list('pk', flat=True)
+    
+    def values_list(self, *limit_to, **kwargs):
+        flat = kwargs.pop('flat', False)
+        if flat and len(limit_to) != 1:
+            raise TypeError("'flat' is only valid when values_list is called with a single dot path")
+        results = list()
+        for row in self.values(*limit_to, **kwargs):
+            entry = tuple([self._get_row_value(row, key) for key in limit_to])
+            if flat:
+                results.append(entry[0])
+            else:
+                results.append(entry)
+        return results
+    
+    def _get_row_value(self, row, key):
+        try:
+            return row[key]
+        except KeyError:
+            from dockit.schema.common import resolve_primitive_dot_path
+            return resolve_primitive_dot_path(row, key)
+    
+    def facet_counts(self, dotpath):
+        """
+        Returns a dictionary mapping each value found at the dot path to the
+        number of documents having it. Every entry of a list counts once.
+        """
+        counts = dict()
+        for value in self.values_list(dotpath, flat=True):
+            if not isinstance(value, (list, tuple, set)):
+                value = [value]
+            for entry in value:
+                counts[entry] = counts.get(entry, 0) + 1
+        return counts
+    
+    def explain(self, database=False):
+        """
+        Returns a dictionary describing the compiled backend query
+        """
+        raise NotImplementedError
+    
+    def aggregate(self, **aggregates):
+        """
+        Returns a dictionary of the computed aggregates
+        """
+        raise NotImplementedError
+    
+    def annotate_group_by(self, dotpath, **aggregates):
+        """
+        Returns a list of dictionaries holding each distinct value of the dot path
+        and the aggregates computed over the documents having it
+        """
+        raise NotImplementedError
+    
+    def distinct_values(self, dotpath):
+        raise NotImplementedError
+    
     def __getitem__(self, val):
         raise NotImplementedError
     
@@ -48,8 +149,18 @@ class QuerySet(object):
     '''
     Acts as the queryset level caching layer
     '''
-    def __init__(self, query):
+    chunk_size = 100
+    
+    def __init__(self, query, prefetch=()):
         self.query = query
+        self.prefetch = prefetch
+    
+    def _prefetch_references(self, documents):
+        from dockit.backends.prefetch import prefetch_references
+        cache = dict()
+        for dotpath in self.prefetch:
+            prefetch_references(documents, dotpath, cache)
+        return documents
     
     @property
     def document(self):
@@ -69,21 +180,65 @@ class QuerySet(object):
         #TODO cache
         return self.query.values(*limit_to, **kwargs)
     
+    def values_list(self, *limit_to, **kwargs):
+        #TODO cache
+        return self.query.values_list(*limit_to, **kwargs)
+    
+    def doc_ids(self):
+        return self.query.doc_ids()
+    
     def get(self, **kwargs):
         #TODO cache
-        return self.query.get(**kwargs)
+        document = self.query.get(**kwargs)
+        if self.prefetch:
+            self._prefetch_references([document])
+        return document
     
     def exists(self):
         return self.query.exists()
     
+    def explain(self, database=False):
+        return self.query.explain(database=database)
+    
+    def facet_counts(self, dotpath):
+        return self.query.facet_counts(dotpath)
+    
+    def aggregate(self, **aggregates):
+        return self.query.aggregate(**aggregates)
+    
+    def annotate_group_by(self, dotpath, **aggregates):
+        return self.query.annotate_group_by(dotpath, **aggregates)
+    
+    def distinct_values(self, dotpath):
+        return self.query.distinct_values(dotpath)
+    
     def __getitem__(self, val):
         #TODO cache
-        return self.query.__getitem__(val)
+        result = self.query.__getitem__(val)
+        if self.prefetch:
+            if isinstance(val, slice):
+                self._prefetch_references(result)
+            else:
+                self._prefetch_references([result])
+        return result
     
     def __nonzero__(self):
         #TODO cache
         return self.query.__nonzero__()
     
     def __iter__(self):
-        return iter(self.query)
+        if not self.prefetch:
+            return iter(self.query)
+        return self._iter_chunks()
+    
+    def _iter_chunks(self):
+        #references are prefetched for a chunk of documents at a time
+        start = 0
+        while True:
+            chunk = self[start:start+self.chunk_size]
+            for document in chunk:
+                yield document
+            if len(chunk) < self.chunk_size:
+                break
+            start += self.chunk_size
 
@@ -0,0 +1,161 @@
+import copy
+import threading
+
+UNIT_OF_WORK = threading.local()
+
+def get_unit_of_work():
+    '''
+    Returns the unit of work active in this thread or None
+    '''
+    units = getattr(UNIT_OF_WORK, 'units', None)
+    if units:
+        return units[-1]
+    return None
+
+class UnitOfWork(object):
+    '''
+    Collects the saves and deletes of documents and writes them when flushed.
+    Repeated saves of a document are merged into a single write.
+    '''
+    def __init__(self):
+        self.entries = dict() #(collection, doc_id) => entry
+        self.order = list()
+    
+    def _get_entry(self, instance):
+        key = (instance._meta.collection, instance.get_id())
+        if key not in self.entries:
+            self.entries[key] = {'instance':instance,
+                                 'action':None,
+                                 'created':False,
+                                 'data':None,}
+            self.order.append(key)
+        return self.entries[key]
+    
+    def save(self, instance, created):
+        if created:
+            #new documents are written right away so they are given an id
+            backend = instance._meta.get_document_backend_for_write()
+            data = type(instance).to_primitive(instance)
+            backend.save(type(instance), instance._meta.collection, data)
+        entry = self._get_entry(instance)
+        if entry['action'] is None and not created and instance._tracked and not instance.get_changed_paths():
+            #snapshot of the stored document, it is only rewritten if it changes before the flush
+            entry['data'] = copy.deepcopy(type(instance).to_primitive(instance))
+        entry['instance'] = instance
+        entry['action'] = 'save'
+        if created:
+            entry['created'] = True
+            entry['data'] = copy.deepcopy(data) #to skip the write if nothing changes
+    
+    def delete(self, instance):
+        entry = self._get_entry(instance)
+        entry['instance'] = instance
+        entry['action'] = 'delete'
+    
+    def get_batches(self):
+        '''
+        Groups the pending entries by document class and action in the order
+        they were first seen
+        '''
+        batches = list()
+        lookup = dict()
+        for key in self.order:
+            entry = self.entries[key]
+            batch_key = (type(entry['instance']), entry['action'])
+            if batch_key not in lookup:
+                lookup[batch_key] = list()
+                batches.append((batch_key, lookup[batch_key]))
+            lookup[batch_key].append(entry)
+        return batches
+    
+    def flush(self):
+        '''
+        Writes the pending documents with one storage and index call per
+        document class and action, skipping documents that did not change
+        since they were saved, then sends the post_save and post_delete
+        signals in the order the documents were first saved or deleted.
+        '''
+        from dockit.backends import get_index_router
+        from dockit.schema.signals import post_save, post_delete
+        router = get_index_router()
+        batches = self.get_batches()
+        entries = [self.entries[key] for key in self.order]
+        self.entries = dict()
+        self.order = list()
+        
+        for (doc_class, action), batch in batches:
+            backend = doc_class._meta.get_document_backend_for_write()
+            collection = doc_class._meta.collection
+            if action == 'save':
+                to_write = list()
+                to_index = list()
+                for entry in batch:
+                    data = doc_class.to_primitive(entry['instance'])
+                    if entry['data'] != data:
+                        to_write.append(data)
+                        to_index.append((entry['instance'].get_id(), data))
+                    elif entry['created']:
+                        #written when it was saved but not indexed yet
+                        to_index.append((entry['instance'].get_id(), data))
+                if to_write:
+                    backend.save_many(doc_class, collection, to_write)
+                if to_index:
+                    router.on_save_many(doc_class, collection, to_index)
+            else:
+                doc_ids = [entry['instance'].get_id() for entry in batch]
+                backend.delete_many(doc_class, collection, doc_ids)
+                router.on_delete_many(doc_class, collection, doc_ids)
+        
+        for entry in entries:
+            instance = entry['instance']
+            if entry['action'] == 'save':
+                instance.mark_clean()
+                instance._tracked = True
+                post_save.send(sender=type(instance), instance=instance, created=entry['created'])
+            else:
+                post_delete.send(sender=type(instance), instance=instance)
+
+class unit_of_work(object):
+    '''
+    Context manager deferring Document.save() and Document.delete() until the
+    block exits. The writes are flushed inside one database transaction.
+    pre_save and pre_delete are sent when save() or delete() is called,
+    post_save and post_delete after the flush. Nested blocks join the
+    outer unit of work.
+    
+    with dockit.unit_of_work():
+        page.save()
+        page.save()
+    '''
+    def __init__(self, using=None):
+        self.using = using
+        self.unit = None
+        self.transaction = None
+    
+    def __enter__(self):
+        from django.db import transaction
+        if not hasattr(UNIT_OF_WORK, 'units'):
+            UNIT_OF_WORK.units = list()
+        if UNIT_OF_WORK.units:
+            self.unit = UNIT_OF_WORK.units[-1]
+        else:
+            self.unit = UnitOfWork()
+            self.transaction = transaction.commit_on_success(using=self.using)
+            self.transaction.__enter__()
+        UNIT_OF_WORK.units.append(self.unit)
+        return self.unit
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        UNIT_OF_WORK.units.pop()
+        if self.transaction is None:
+            return False
+        try:
+            if exc_type is None:
+                self.unit.flush()
+        except:
+            import sys
+            exc_type, exc_value, traceback = sys.exc_info()
+            self.transaction.__exit__(exc_type, exc_value, traceback)
+            raise
+        self.transaction.__exit__(exc_type, exc_value, traceback)
+        return False
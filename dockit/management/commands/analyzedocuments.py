@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from dockit.backends import get_index_router
+
+class Command(BaseCommand):
+    help = ("Collects the statistics used by the index router to pick the "
+            "cheapest index for a query.")
+    args = '[appname collection ...]'
+
+    def handle(self, *labels, **options):
+        verbosity = int(options.get('verbosity', 1))
+        router = get_index_router()
+        router.make_app_ready()
+        
+        for collection, querysets in router.registered_querysets.iteritems():
+            for query_index in querysets.itervalues():
+                document = query_index.document
+                if labels and document._meta.app_label not in labels and collection not in labels:
+                    continue
+                backend = document._meta.get_index_backend_for_write(query_index)
+                backend.analyze(query_index)
+                backend2 = document._meta.get_index_backend_for_read(query_index)
+                if backend != backend2:
+                    backend2.analyze(query_index)
+                if verbosity > 1:
+                    self.stdout.write('Analyzed %s index %s\n' % (collection, query_index._index_hash()))
@@ -0,0 +1,16 @@
+from dockit.backends.identitymap import activate_identity_map, deactivate_identity_map
+
+class IdentityMapMiddleware(object):
+    '''
+    Gives every request an identity map so a document fetched by its pk more
+    than once, for instance as the reference of many children, is loaded once
+    '''
+    def process_request(self, request):
+        activate_identity_map()
+    
+    def process_response(self, request, response):
+        deactivate_identity_map()
+        return response
+    
+    def process_exception(self, request, exception):
+        deactivate_identity_map()
@@ -0,0 +1,151 @@
+"""
+Encoders and decoders composed from the field table of a schema class.
+Schemas opt in with ``codec = True`` in their Meta, the schemas they embed
+are then converted with codecs of their own.
+"""
+from dockit.schema.serializer import PRIMITIVE_PROCESSOR
+from dockit.schema.common import DotPathList, DotPathSet, LazyDotPathList, LazyDotPathDict
+
+def _overrides(field, name):
+    from dockit.schema.fields import BaseField
+    return getattr(type(field), name).im_func is not getattr(BaseField, name).im_func
+
+def _inherits(field, cls, name):
+    return isinstance(field, cls) and getattr(type(field), name).im_func is getattr(cls, name).im_func
+
+def make_schema_encoder(schema):
+    """
+    Returns a function converting instances of the schema with the codec of
+    its field table, the codec is looked up on use as the table may be rebuilt
+    """
+    if schema._meta.typed_field:
+        return schema.to_primitive
+    def encode_schema(value):
+        if type(value) is schema: #subclasses may add fields
+            return schema._meta.fields.get_codec().encode(value)
+        return schema.to_primitive(value)
+    return encode_schema
+
+def make_schema_decoder(schema):
+    """
+    Returns a function loading instances of the schema with the codec of its
+    field table
+    """
+    if schema._meta.typed_field:
+        return lambda value, parent: schema.to_python(value, parent)
+    def decode_schema(value, parent):
+        if value is None:
+            value = dict()
+        return schema._meta.fields.get_codec().decode(schema, value, parent)
+    return decode_schema
+
+def make_encoder(field):
+    """
+    Returns a function turning a python value of the field into its primitive
+    value, or None if the value is stored as is
+    """
+    from dockit.schema.fields import BaseTypedField, ListField, DictField, SchemaField
+    if not _overrides(field, 'to_primitive'):
+        return None
+    if _inherits(field, SchemaField, 'to_primitive'):
+        return make_schema_encoder(field.schema)
+    if _inherits(field, BaseTypedField, 'to_primitive'):
+        coerce = field.coerce_function
+        if isinstance(coerce, type):
+            return lambda value: value if value is None or isinstance(value, coerce) else coerce(value)
+        return lambda value: value if value is None else coerce(value)
+    if _inherits(field, ListField, 'to_primitive') and field.subfield is not None:
+        encode_item = make_encoder(field.subfield) or (lambda item: item)
+        #typed items come out primitive, the primitive processor would leave them as they are
+        plain = isinstance(field.subfield, BaseTypedField)
+        def encode_list(value):
+            if value is None:
+                return list()
+            if isinstance(value, LazyDotPathList):
+                ret = list(value.iter_primitive(encode_item))
+            else:
+                ret = map(encode_item, value)
+            if plain:
+                return ret
+            return PRIMITIVE_PROCESSOR.to_primitive(ret)
+        return encode_list
+    if _inherits(field, DictField, 'to_primitive') and field.key_subfield is None and \
+            isinstance(field.value_subfield, SchemaField):
+        encode_value = make_encoder(field.value_subfield)
+        def encode_dict(value):
+            if value is None:
+                return dict()
+            if isinstance(value, LazyDotPathDict):
+                ret = dict(value.iter_primitive(encode_value))
+            else:
+                ret = dict([(key, encode_value(entry)) for key, entry in value.iteritems()])
+            return PRIMITIVE_PROCESSOR.to_primitive(ret)
+        return encode_dict
+    return field.to_primitive
+
+def make_decoder(field):
+    """
+    Returns a function turning a primitive value and the parent schema into
+    the python value of the field, or None if the value is used as is
+    """
+    from dockit.schema.fields import BaseTypedField, ListField, SetField, SchemaField
+    if not _overrides(field, 'to_python'):
+        return None
+    if _inherits(field, SchemaField, 'to_python'):
+        return make_schema_decoder(field.schema)
+    subfield = getattr(field, 'subfield', None)
+    typed_items = isinstance(subfield, BaseTypedField) and not _overrides(subfield, 'to_python')
+    if isinstance(field, ListField) and not field.lazy and typed_items:
+        #typed items are kept as they are, see ListField.to_python
+        if type(field).to_python.im_func is ListField.to_python.im_func:
+            return lambda value, parent: DotPathList(value or ())
+        if type(field).to_python.im_func is SetField.to_python.im_func:
+            return lambda value, parent: DotPathSet(value or ())
+    to_python = field.to_python
+    return lambda value, parent: to_python(value, parent=parent)
+
+class SchemaCodec(object):
+    """
+    Converts instances of a schema class to and from primitive data without
+    looking up how each field converts its values. The output is the same as
+    that of Schema.to_primitive and of reading every stored field.
+    """
+    def __init__(self, fields):
+        self.fields = fields
+        self.encoders = dict([(name, make_encoder(field)) for name, field in fields.iteritems()])
+        #references are left to their descriptors so loading a document does not load what it references
+        self.decoders = [(name, make_decoder(field), not name.startswith('@')) for name, field in fields.iteritems()
+                         if name not in fields.reference_fields]
+    
+    def encode(self, instance):
+        encoders = self.encoders
+        scalar_fields = self.fields.scalar_fields
+        dirty_fields = instance._dirty_fields
+        primitive_data = instance._primitive_data
+        for name, entry in instance._python_data.iteritems():
+            if name in scalar_fields and name not in dirty_fields and name in primitive_data:
+                continue #unchanged immutable values keep their primitive
+            encoder = encoders.get(name)
+            if encoder is None:
+                primitive_data[name] = entry
+            else:
+                primitive_data[name] = encoder(entry)
+        return primitive_data
+    
+    def decode(self, cls, data, parent=None):
+        """
+        Returns an instance of cls with every field found in the data converted
+        """
+        instance = cls(_primitive_data=data, _parent=parent)
+        python_data = instance._python_data
+        keep_primitive_data = cls._meta.keep_primitive_data
+        for name, decoder, droppable in self.decoders:
+            if name not in data or name in python_data:
+                continue #missing fields are left to their descriptor
+            if decoder is None:
+                python_data[name] = data[name]
+            else:
+                python_data[name] = decoder(data[name], instance)
+            if droppable and not keep_primitive_data:
+                del data[name]
+        return instance
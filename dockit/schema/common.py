@@ -4,6 +4,26 @@ class UnSet(object):
     def __nonzero__(self):
         return False
 
+class DotPathEntry(object):
+    """
+    A resolved part of a dot path, readable like a dictionary
+    """
+    __slots__ = ('value', 'field', 'part')
+    
+    def __init__(self, value=None, field=None, part=None):
+        self.value = value
+        self.field = field
+        self.part = part
+    
+    def __getitem__(self, key):
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+    
+    def __repr__(self):
+        return repr({'value':self.value, 'field':self.field, 'part':self.part})
+
 class DotPathTraverser(object):
     def __init__(self, dotpath):
         self.dotpath = dotpath
@@ -14,17 +34,13 @@ class DotPathTraverser(object):
     
     def resolve_for_schema(self, schema):
         from dockit.schema.fields import SchemaField
-        entry = {'value':None,
-                 'field':SchemaField(schema=schema),
-                 'part':None,}
+        entry = DotPathEntry(field=SchemaField(schema=schema))
         self.resolved_paths = [entry]
         self._resolve_loop()
     
     def resolve_for_instance(self, instance):
         from dockit.schema.fields import SchemaField
-        entry = {'value':instance,
-                 'field':SchemaField(schema=type(instance)),
-                 'part':None,}
+        entry = DotPathEntry(value=instance, field=SchemaField(schema=type(instance)))
         self.resolved_paths = [entry]
         self._resolve_loop()
     
@@ -36,9 +52,7 @@ class DotPathTraverser(object):
             data = schema.to_python(data)
         else:
             field = DictField()
-        entry = {'value':data,
-                 'field':field,
-                 'part':None,}
+        entry = DotPathEntry(value=data, field=field)
         self.resolved_paths = [entry]
         self._resolve_loop()
     
@@ -98,10 +112,7 @@ class DotPathTraverser(object):
             from dockit.schema.schema import Schema
             if isinstance(value, Schema):
                 field = SchemaField(schema=type(value))
-        entry = {'field':field,
-                 'value':value,
-                 'part':part,}
-        self.resolved_paths.append(entry)
+        self.resolved_paths.append(DotPathEntry(value=value, field=field, part=part))
         self._called = True
     
     def set_value(self, value):
@@ -115,6 +126,56 @@ class DotPathTraverser(object):
             assert False
 
 class DotPathList(list):
+    """
+    _validated_by is the list field that found every item to be an instance
+    of its subfield. Items added later are checked as they come in and the
+    marker is cleared if the field would reject one.
+    """
+    __slots__ = ('_validated_by',)
+    
+    def __init__(self, *args):
+        super(DotPathList, self).__init__(*args)
+        self._validated_by = None
+    
+    def _check_items(self, items):
+        field = self._validated_by
+        if field is not None:
+            for item in items:
+                if not field.is_item_instance(item):
+                    self._validated_by = None
+                    return
+    
+    def append(self, value):
+        self._check_items((value,))
+        list.append(self, value)
+    
+    def insert(self, index, value):
+        self._check_items((value,))
+        list.insert(self, index, value)
+    
+    def extend(self, values):
+        values = list(values)
+        self._check_items(values)
+        list.extend(self, values)
+    
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+    
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            self._check_items(value)
+        else:
+            self._check_items((value,))
+        list.__setitem__(self, index, value)
+    
+    def __setslice__(self, start, stop, values):
+        self.__setitem__(slice(start, stop), values)
+    
+    def __reduce__(self):
+        return (DotPathList, (list(self),))
+    
     def traverse_dot_path(self, traverser):
         if traverser.remaining_paths:
             new_value = None
@@ -139,6 +200,40 @@ class DotPathList(list):
             self[index] = value
 
 class DotPathDict(dict):
+    """
+    _validated_by is the dict field that found every entry valid, see DotPathList
+    """
+    __slots__ = ('_validated_by',)
+    
+    def __init__(self, *args, **kwargs):
+        super(DotPathDict, self).__init__(*args, **kwargs)
+        self._validated_by = None
+    
+    def _check_entries(self, entries):
+        field = self._validated_by
+        if field is not None:
+            for key, value in entries:
+                if not field.is_entry_instance(key, value):
+                    self._validated_by = None
+                    return
+    
+    def __setitem__(self, key, value):
+        self._check_entries(((key, value),))
+        dict.__setitem__(self, key, value)
+    
+    def update(self, *args, **kwargs):
+        entries = dict(*args, **kwargs)
+        self._check_entries(entries.iteritems())
+        dict.update(self, entries)
+    
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+    
+    def __reduce__(self):
+        return (DotPathDict, (dict(self),))
+    
     def traverse_dot_path(self, traverser):
         if traverser.remaining_paths:
             new_value = None
@@ -158,6 +253,40 @@ class DotPathDict(dict):
             self[attr] = value
 
 class DotPathSet(set):
+    """
+    _validated_by is the set field that found every item valid, see DotPathList
+    """
+    __slots__ = ('_validated_by',)
+    
+    def __init__(self, *args):
+        super(DotPathSet, self).__init__(*args)
+        self._validated_by = None
+    
+    def _check_items(self, items):
+        field = self._validated_by
+        if field is not None:
+            for item in items:
+                if not field.is_item_instance(item):
+                    self._validated_by = None
+                    return
+    
+    def add(self, value):
+        self._check_items((value,))
+        set.add(self, value)
+    
+    def update(self, *iterables):
+        for values in iterables:
+            values = list(values)
+            self._check_items(values)
+            set.update(self, values)
+    
+    def __ior__(self, values):
+        self.update(values)
+        return self
+    
+    def __reduce__(self):
+        return (DotPathSet, (list(self),))
+    
     def traverse_dot_path(self, traverser):
         if traverser.remaining_paths:
             raise DotPathNotFound("Cannot traverse past a set")
@@ -170,6 +299,245 @@ class DotPathSet(set):
         else:
             self.add(value)
 
+def _hydrating(base, name):
+    method = getattr(base, name)
+    def wrapper(self, *args, **kwargs):
+        self.hydrate()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+class LazyDotPathList(DotPathList):
+    """
+    Holds the primitive items of a list field and converts an item with the
+    field on first access. Operations other than indexing, iteration,
+    appending and len() convert the remaining items first.
+    """
+    __slots__ = ('field', '_pending')
+    
+    def __init__(self, field, values):
+        super(LazyDotPathList, self).__init__(values)
+        self.field = field
+        if field.caches_validation():
+            self._validated_by = field #pending items are converted by the field
+        self._pending = bytearray('\x01' * len(self)) or None #1 for unconverted items
+    
+    def _load(self, index):
+        value = list.__getitem__(self, index)
+        if self._pending is not None and self._pending[index]:
+            value = self.field.convert_item(value)
+            list.__setitem__(self, index, value)
+            self._pending[index] = 0
+        return value
+    
+    def hydrate(self):
+        """
+        Converts the remaining items
+        """
+        if self._pending is not None:
+            for index in xrange(len(self)):
+                self._load(index)
+            self._pending = None
+    
+    def is_hydrated(self):
+        return self._pending is None
+    
+    def loaded_values(self):
+        """
+        Returns the items that have been converted
+        """
+        if self._pending is None:
+            return list(list.__iter__(self))
+        return [value for value, pending in zip(list.__iter__(self), self._pending) if not pending]
+    
+    def iter_primitive(self, to_primitive):
+        """
+        Yields the primitive value of each item, unconverted items are returned as is
+        """
+        pending = self._pending
+        for index, value in enumerate(list.__iter__(self)):
+            if pending is not None and pending[index]:
+                yield value
+            else:
+                yield to_primitive(value)
+    
+    def __getitem__(self, index):
+        if self._pending is None:
+            return list.__getitem__(self, index)
+        if isinstance(index, slice):
+            return [self._load(i) for i in xrange(*index.indices(len(self)))]
+        return self._load(index)
+    
+    def __getslice__(self, start, stop):
+        return self.__getitem__(slice(start, stop))
+    
+    def __iter__(self):
+        if self._pending is None:
+            return list.__iter__(self)
+        return self._iter_loading()
+    
+    def _iter_loading(self):
+        index = 0
+        while index < len(self):
+            yield self._load(index)
+            index += 1
+        if self._pending is not None and '\x01' not in self._pending:
+            self._pending = None
+    
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self.hydrate()
+        DotPathList.__setitem__(self, index, value)
+        if self._pending is not None:
+            self._pending[index] = 0
+    
+    def append(self, value):
+        DotPathList.append(self, value)
+        if self._pending is not None:
+            self._pending.append(0)
+    
+    def __reduce__(self):
+        return (DotPathList, (list(self),))
+
+for name in ('__contains__', '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__',
+             '__reversed__', '__add__', '__mul__', '__rmul__', '__iadd__', '__imul__',
+             '__delitem__', '__delslice__', '__setslice__', '__repr__',
+             'count', 'extend', 'index', 'insert', 'pop', 'remove', 'reverse', 'sort'):
+    setattr(LazyDotPathList, name, _hydrating(DotPathList, name))
+
+class LazyDotPathDict(DotPathDict):
+    """
+    Holds the primitive values of a dict field and converts a value with the
+    field on first access. Operations other than key lookups, assignment,
+    deletion and iterating over the keys convert the remaining values first.
+    """
+    __slots__ = ('field', '_pending')
+    
+    def __init__(self, field, values):
+        super(LazyDotPathDict, self).__init__(values)
+        self.field = field
+        if field.caches_validation():
+            self._validated_by = field
+        self._pending = set(self.iterkeys()) or None #keys of unconverted values
+    
+    def _load(self, key):
+        value = dict.__getitem__(self, key)
+        if self._pending is not None and key in self._pending:
+            value = self.field.convert_value(value)
+            dict.__setitem__(self, key, value)
+            self._pending.discard(key)
+        return value
+    
+    def hydrate(self):
+        """
+        Converts the remaining values
+        """
+        if self._pending is not None:
+            for key in list(self._pending):
+                self._load(key)
+            self._pending = None
+    
+    def is_hydrated(self):
+        return self._pending is None
+    
+    def loaded_values(self):
+        """
+        Returns the values that have been converted
+        """
+        pending = self._pending or ()
+        return [value for key, value in dict.iteritems(self) if key not in pending]
+    
+    def iter_primitive(self, to_primitive):
+        """
+        Yields the key and the primitive value of each entry, unconverted
+        values are returned as is
+        """
+        pending = self._pending or ()
+        for key, value in dict.iteritems(self):
+            if key in pending:
+                yield key, value
+            else:
+                yield key, to_primitive(value)
+    
+    def __getitem__(self, key):
+        if self._pending is None:
+            return dict.__getitem__(self, key)
+        return self._load(key)
+    
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+    
+    def __setitem__(self, key, value):
+        DotPathDict.__setitem__(self, key, value)
+        if self._pending is not None:
+            self._pending.discard(key)
+    
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        if self._pending is not None:
+            self._pending.discard(key)
+    
+    def __reduce__(self):
+        self.hydrate()
+        return (DotPathDict, (dict(self),))
+
+for name in ('__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__cmp__', '__repr__',
+             'clear', 'copy', 'items', 'iteritems', 'itervalues', 'values', 'viewitems', 'viewvalues',
+             'pop', 'popitem', 'setdefault', 'update'):
+    if hasattr(DotPathDict, name): #the views are new in python 2.7
+        setattr(LazyDotPathDict, name, _hydrating(DotPathDict, name))
+
+def resolve_primitive_dot_path(data, dotpath, default=None):
+    '''
+    Walks raw primitive data (nested dictionaries and lists) following the dot path
+    without hydrating a schema. Returns the default if the path cannot be resolved.
+    '''
+    value = data
+    for part in dotpath.split('.'):
+        if isinstance(value, dict):
+            if part not in value:
+                return default
+            value = value[part]
+        elif isinstance(value, (list, tuple)):
+            try:
+                value = value[int(part)]
+            except (ValueError, IndexError):
+                return default
+        else:
+            return default
+    return value
+
+def apply_primitive_update(data, dotpath, operation, value):
+    '''
+    Applies a 'set' or 'inc' update to raw primitive data in place, creating
+    missing containers along the dot path.
+    '''
+    parts = dotpath.split('.')
+    container = data
+    for index, part in enumerate(parts[:-1]):
+        if isinstance(container, list):
+            container = container[int(part)]
+            continue
+        if container.get(part) is None:
+            if parts[index+1].isdigit():
+                container[part] = list()
+            else:
+                container[part] = dict()
+        container = container[part]
+    last = parts[-1]
+    if isinstance(container, list):
+        last = int(last)
+        if last == len(container):
+            container.append(None)
+    if operation == 'inc':
+        current = container[last] if isinstance(container, list) else container.get(last)
+        container[last] = (current or 0) + value
+    else:
+        container[last] = value
+    return data
+
 class GenericDotPathObject(object):
     traverse_types = [(list, DotPathList),
                       (dict, DotPathDict),
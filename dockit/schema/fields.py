@@ -9,14 +9,46 @@ from decimal import Decimal
 import datetime
 import copy
 
-from dockit.schema.serializer import PRIMITIVE_PROCESSOR
+from dockit.schema.serializer import PRIMITIVE_PROCESSOR, holds_typed_values
 from dockit.schema.exceptions import DotPathNotFound
-from dockit.schema.common import DotPathList, DotPathDict, DotPathSet, UnSet
+from dockit.schema.common import DotPathList, DotPathDict, DotPathSet, LazyDotPathList, LazyDotPathDict, UnSet
 from dockit.forms.fields import HiddenSchemaField, HiddenListField, HiddenDictField, SchemaChoiceField, PrimitiveListField, SchemaMultipleChoiceField
 
 class NOT_PROVIDED:
     pass
 
+class FieldDescriptor(object):
+    """
+    Installed on the schema class for every field. Converts the primitive
+    value to python on first access and caches it in _python_data.
+    """
+    def __init__(self, field):
+        self.field = field
+        self.name = field.name
+        self.droppable = not field.name.startswith('@') #document bookkeeping is always kept
+    
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.field
+        python_data = instance._python_data
+        try:
+            return python_data[self.name]
+        except KeyError:
+            pass
+        primitive_data = instance._primitive_data
+        if self.name not in primitive_data and self.name in instance._deferred_fields:
+            instance.load_deferred_fields()
+        value = python_data[self.name] = self.field.to_python(primitive_data.get(self.name), parent=instance)
+        if self.droppable and not instance._meta.keep_primitive_data:
+            primitive_data.pop(self.name, None)
+        return value
+    
+    def __set__(self, instance, value):
+        if not self.field.is_instance(value):
+            value = self.field.to_python(value)
+        instance._python_data[self.name] = value
+        instance._dirty_fields.add(self.name)
+
 class BaseField(object):
     form_field_class = forms.CharField
     form_field_choices_class = forms.ChoiceField
@@ -64,7 +96,7 @@ class BaseField(object):
         if not self.verbose_name:
             self.verbose_name = name.replace('_', ' ')
         cls._meta.fields[name] = self
-        setattr(cls, name, self)
+        setattr(cls, name, FieldDescriptor(self))
     
     def has_default(self):
         "Returns a boolean of whether this field has a default value."
@@ -502,12 +534,24 @@ class TypedSchemaField(GenericSchemaField):
     
     #TODO what about a widget?
 
+def converts_lazily(subfield):
+    """
+    Returns True if the items of a container are worth converting on access.
+    References are converted up front as missing ones are left out.
+    """
+    if subfield is None:
+        return False
+    return not isinstance(subfield, (BaseTypedField, ReferenceField, ModelReferenceField))
+
 #TODO need a more comprehensive form field and widget solution for these
 class ListField(BaseField):
     form_field_class = HiddenListField
     
     def __init__(self, subfield=None, *args, **kwargs):
         self.subfield = subfield
+        self.lazy = kwargs.pop('lazy', None)
+        if self.lazy is None:
+            self.lazy = converts_lazily(subfield)
         kwargs.setdefault('default', list)
         super(ListField, self).__init__(*args, **kwargs)
     
@@ -528,8 +572,11 @@ class ListField(BaseField):
             ret = list()
             if val is None:
                 return ret
-            for item in val:
-                ret.append(self.subfield.to_primitive(item))
+            if isinstance(val, LazyDotPathList):
+                ret.extend(val.iter_primitive(self.subfield.to_primitive))
+            else:
+                for item in val:
+                    ret.append(self.subfield.to_primitive(item))
             #run data through the primitive processor
             return PRIMITIVE_PROCESSOR.to_primitive(ret)
         return PRIMITIVE_PROCESSOR.to_primitive(val)
@@ -545,11 +592,19 @@ class ListField(BaseField):
             return PRIMITIVE_PROCESSOR.to_primitive(ret)
         return PRIMITIVE_PROCESSOR.to_primitive(val)
     
+    def convert_item(self, item):
+        if not self.subfield.is_instance(item):
+            item = self.subfield.to_python(item)
+        return PRIMITIVE_PROCESSOR.to_python(item)
+    
     def to_python(self, val, parent=None):
         if self.subfield:
             ret = DotPathList()
             if val is None:
                 return ret
+            if self.lazy and parent is not None:
+                #only stored items are left to convert, assigned ones may be python values
+                return LazyDotPathList(self, val)
             #TODO pass in parent
             for item in val:
                 if not self.subfield.is_instance(item):
@@ -559,8 +614,10 @@ class ListField(BaseField):
                         continue
                 ret.append(item)
             #run data through the primitive processor
+            if not holds_typed_values(parent):
+                return ret
             return PRIMITIVE_PROCESSOR.to_python(ret)
-        return PRIMITIVE_PROCESSOR.to_python(val)
+        return PRIMITIVE_PROCESSOR.to_python(val, typed=holds_typed_values(parent))
     
     def normalize_portable_primitives(self, val, parent=None):
         ret = list()
@@ -571,15 +628,29 @@ class ListField(BaseField):
                 ret.append(entry)
         return ret
     
+    def caches_validation(self):
+        """
+        Returns True if containers may remember that this field validated
+        them. Nested containers can change without the outer one noticing.
+        """
+        return not isinstance(self.subfield, (ListField, DictField))
+    
+    def is_item_instance(self, item):
+        return self.subfield is None or self.subfield.is_instance(item)
+    
     def is_instance(self, val):
         if val is None:
             return True
         if not isinstance(val, DotPathList):
             return False
+        if val._validated_by is self:
+            return True
         if self.subfield:
             for item in val:
                 if not self.subfield.is_instance(item):
                     return False
+        if self.caches_validation():
+            val._validated_by = self
         return True
     
     def traverse_dot_path(self, traverser):
@@ -641,18 +712,24 @@ class SetField(ListField):
                         continue
                 ret.add(item)
             #run data through the primitive processor
+            if not holds_typed_values(parent):
+                return ret
             return PRIMITIVE_PROCESSOR.to_python(ret)
-        return PRIMITIVE_PROCESSOR.to_python(val)
+        return PRIMITIVE_PROCESSOR.to_python(val, typed=holds_typed_values(parent))
     
     def is_instance(self, val):
         if val is None:
             return True
         if not isinstance(val, DotPathSet):
             return False
+        if val._validated_by is self:
+            return True
         if self.subfield:
             for item in val:
                 if not self.subfield.is_instance(item):
                     return False
+        if self.caches_validation():
+            val._validated_by = self
         return True
 
 class DictField(BaseField):
@@ -661,12 +738,22 @@ class DictField(BaseField):
     def __init__(self, key_subfield=None, value_subfield=None, **kwargs):
         self.key_subfield = key_subfield
         self.value_subfield = value_subfield
+        self.lazy = kwargs.pop('lazy', None)
+        if self.lazy is None:
+            self.lazy = key_subfield is None and converts_lazily(value_subfield)
         super(DictField, self).__init__(**kwargs)
     
     def to_primitive(self, val):
         ret = dict()
         if val is None:
             return ret
+        if isinstance(val, LazyDotPathDict):
+            def value_to_primitive(value):
+                if hasattr(value, 'to_primitive'):
+                    return type(value).to_primitive(value)
+                return value
+            ret.update(val.iter_primitive(value_to_primitive))
+            return PRIMITIVE_PROCESSOR.to_primitive(ret)
         for key, value in val.iteritems():
             if hasattr(value, 'to_primitive'):
                 value = type(value).to_primitive(value)
@@ -691,10 +778,18 @@ class DictField(BaseField):
         ret = PRIMITIVE_PROCESSOR.to_primitive(ret)
         return ret
     
+    def convert_value(self, value):
+        if self.value_subfield and not self.value_subfield.is_instance(value):
+            value = self.value_subfield.to_python(value)
+        return PRIMITIVE_PROCESSOR.to_python(value)
+    
     def to_python(self, val, parent=None):
         ret = DotPathDict()
         if val is None:
             return ret
+        if self.lazy and parent is not None:
+            #only stored values are left to convert, assigned ones may be python values
+            return LazyDotPathDict(self, val)
         for key, value in val.iteritems():
             if self.value_subfield:
                 if not self.value_subfield.is_instance(value):
@@ -704,7 +799,7 @@ class DictField(BaseField):
                     key = self.key_subfield.to_python(key)
             ret[key] = value
         #TODO run data through the primitive processor
-        ret = PRIMITIVE_PROCESSOR.to_python(ret)
+        ret = PRIMITIVE_PROCESSOR.to_python(ret, typed=holds_typed_values(parent))
         return ret
     
     def normalize_portable_primitives(self, val, parent=None):
@@ -719,11 +814,25 @@ class DictField(BaseField):
             ret[key] = value
         return ret
     
+    def caches_validation(self):
+        """
+        Returns True if containers may remember that this field validated them
+        """
+        return not isinstance(self.key_subfield, (ListField, DictField)) and \
+            not isinstance(self.value_subfield, (ListField, DictField))
+    
+    def is_entry_instance(self, key, value):
+        if self.key_subfield and not self.key_subfield.is_instance(key):
+            return False
+        return self.value_subfield is None or self.value_subfield.is_instance(value)
+    
     def is_instance(self, val):
         if val is None:
             return True
         if not isinstance(val, DotPathDict):
             return False
+        if val._validated_by is self:
+            return True
         if self.value_subfield:
             for item in val.itervalues():
                 if not self.value_subfield.is_instance(item):
@@ -732,6 +841,8 @@ class DictField(BaseField):
             for item in val.iterkeys():
                 if not self.key_subfield.is_instance(item):
                     return False
+        if self.caches_validation():
+            val._validated_by = self
         return True
     
     def traverse_dot_path(self, traverser):
@@ -764,6 +875,7 @@ class ReferenceField(BaseField):
     data_type = 'char'
     
     def __init__(self, document, *args, **kwargs):
+        self.lazy = kwargs.pop('lazy', False)
         if document == 'self':
             self.self_reference = True
             document = None
@@ -811,6 +923,9 @@ class ReferenceField(BaseField):
         try:
             if isinstance(val, dict):
                 return document.objects.get_by_natural_key(**val)
+            if self.lazy and not document._meta.typed_field:
+                from dockit.backends.lazy import lazy_reference
+                return lazy_reference(document, val)
             return document.objects.get(pk=val)
         except ObjectDoesNotExist:
             if self.null:
@@ -24,6 +24,12 @@ class Manager(object):
     def index(self, *args):
         return self.all().index(*args)
     
+    def search(self, query, dotpath=None):
+        return self.all().search(query, dotpath)
+    
+    def prefetch_references(self, *dotpaths):
+        return self.all().prefetch_references(*dotpaths)
+    
     #def values(self):
     #    return self.index_manager.values
     
@@ -33,6 +39,15 @@ class Manager(object):
     def count(self):
         return self.all().count()
     
+    def changes(self, since=0):
+        """
+        Streams the latest change of every document changed after the given
+        sequence number. Store the seq of the last change processed and pass
+        it as since to pick up from there.
+        """
+        backend = self.schema._meta.get_document_backend_for_read()
+        return backend.changes(self.schema, self.collection, since=since)
+    
     def get(self, **kwargs):
         return self.all().get(**kwargs)
     
@@ -1,27 +1,99 @@
 from dockit.backends import get_document_backend, get_document_router, get_index_router
 
 import re
+import weakref
+from copy import deepcopy
 
 from django.conf import settings
 from django.db.models.options import get_verbose_name
 from django.utils.translation import activate, deactivate_all, get_language, string_concat
 from django.utils.encoding import smart_str, force_unicode
-from django.utils.datastructures import SortedDict, MergeDict
+from django.utils.datastructures import SortedDict
 from django.db.models import FieldDoesNotExist
 
 from dockit.schema.common import DotPathTraverser
 
-class FieldsDict(MergeDict):
-    def __init__(self, *dicts):
-        self.fields = SortedDict()
-        dicts = [self.fields] + list(dicts)
-        super(FieldsDict, self).__init__(*dicts)
+class FieldsDict(SortedDict):
+    """
+    A flat table of the fields of a schema, its own fields first followed by
+    the fields inherited from the parent schemas. The table is rebuilt, along
+    with the tables of the child schemas, whenever a field is added.
+    """
+    def __init__(self, *parents):
+        super(FieldsDict, self).__init__()
+        self.local_fields = SortedDict()
+        self.parents = list(parents)
+        self.children = list()
+        for parent in self.parents:
+            parent.children.append(weakref.ref(self))
+        self.rebuild()
+    
+    def rebuild(self):
+        SortedDict.clear(self)
+        for key, value in self.local_fields.iteritems():
+            SortedDict.__setitem__(self, key, value)
+        for parent in self.parents:
+            for key, value in parent.iteritems():
+                if key not in self:
+                    SortedDict.__setitem__(self, key, value)
+        self.compute_flags()
+        children = list()
+        for ref in self.children:
+            child = ref()
+            if child is not None:
+                child.rebuild()
+                children.append(ref)
+        self.children = children
+    
+    def get_codec(self):
+        """
+        Returns the codec composed from the fields, built on first use
+        """
+        if self.codec is None:
+            from dockit.schema.codecs import SchemaCodec
+            self.codec = SchemaCodec(self)
+        return self.codec
+    
+    def compute_flags(self):
+        """
+        Precomputes which fields hold references, which run their values
+        through the primitive processor, which store python values as is and
+        which hold immutable values
+        """
+        from dockit.schema.fields import BaseField, BaseTypedField, ReferenceField, ModelReferenceField, \
+            ListField, DictField, DateField, DateTimeField, DecimalField
+        scalar_types = (BaseTypedField, DateField, DateTimeField, DecimalField, ReferenceField, ModelReferenceField)
+        reference_fields = set()
+        scalar_fields = set()
+        processed_fields = set()
+        identity_fields = set()
+        for key, field in self.iteritems():
+            subfield = getattr(field, 'subfield', None)
+            reference_types = (ReferenceField, ModelReferenceField)
+            if isinstance(field, reference_types) or (isinstance(field, ListField) and isinstance(subfield, reference_types)):
+                reference_fields.add(key)
+            if isinstance(field, (ListField, DictField)):
+                processed_fields.add(key)
+            if getattr(type(field).to_primitive, 'im_func', None) is BaseField.to_primitive.im_func:
+                identity_fields.add(key)
+            if isinstance(field, scalar_types):
+                scalar_fields.add(key)
+        self.reference_fields = frozenset(reference_fields)
+        self.processed_fields = frozenset(processed_fields)
+        self.identity_fields = frozenset(identity_fields)
+        self.codec = None
+        self.scalar_fields = frozenset(scalar_fields) #values that cannot be modified in place
     
     def __setitem__(self, key, value):
-        self.fields[key] = value
+        self.local_fields[key] = value
+        self.rebuild()
     
     def update(self, *args, **kwargs):
-        return self.fields.update(*args, **kwargs)
+        self.local_fields.update(*args, **kwargs)
+        self.rebuild()
+    
+    def __deepcopy__(self, memo):
+        return SortedDict([(key, deepcopy(value, memo)) for key, value in self.iteritems()])
 
 class SchemaOptions(object):
     """ class based on django.db.models.options. We only keep
@@ -32,7 +104,7 @@ class SchemaOptions(object):
     
     DEFAULT_NAMES = ['verbose_name', 'db_table', 'ordering', 'schema_key',
                      'app_label', 'collection', 'virtual', 'proxy', 'permissions',
-                     'typed_field', 'typed_key']
+                     'typed_field', 'typed_key', 'keep_primitive_data', 'codec', 'slots']
     
     def __init__(self, meta, app_label=None, parent_fields=[]):
         self.module_name, self.verbose_name = None, None
@@ -48,6 +120,9 @@ class SchemaOptions(object):
         self.typed_field = None
         self.typed_key = None
         self.permissions = []
+        self.keep_primitive_data = True #False drops the primitive value of a field once it is converted
+        self.codec = False #True converts instances with functions composed from the field table
+        self.slots = False #True leaves out the instance __dict__
     
     def process_values(self, cls):
         cls._meta = self
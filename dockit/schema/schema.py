@@ -28,7 +28,16 @@ class SchemaBase(type):
         options_module = cls.options_module
         
         module = attrs.pop('__module__')
-        new_class = super_new(cls, name, bases, {'__module__': module})
+        class_attrs = {'__module__': module}
+        use_slots = getattr(attrs.get('Meta', None), 'slots', None)
+        if use_slots is None: #subclasses of slotted schemas stay slotted
+            use_slots = bool([base for base in bases if getattr(getattr(base, '_meta', None), 'slots', False)])
+        slots = attrs.pop('__slots__', None)
+        if slots is None and use_slots:
+            slots = () #no instance __dict__
+        if slots is not None:
+            class_attrs['__slots__'] = slots
+        new_class = super_new(cls, name, bases, class_attrs)
         
         attr_meta = attrs.pop('Meta', None)
         if not attr_meta:
@@ -70,6 +79,7 @@ class SchemaBase(type):
         
         options = options_module(meta, app_label=app_label, parent_fields=parent_fields)
         options.process_values(new_class)
+        options.slots = use_slots
         setattr(new_class, '_meta', options)
         
         for field_name, obj in fields:
@@ -92,8 +102,24 @@ class SchemaBase(type):
         else:
             setattr(cls, name, value)
 
+def loaded_items(value):
+    """
+    Returns the items of a container that have been converted to python,
+    a value that is not a container is returned in a list
+    """
+    if hasattr(value, 'loaded_values'):
+        return value.loaded_values()
+    if isinstance(value, dict):
+        return value.values()
+    if isinstance(value, (list, set, tuple)):
+        return value
+    return [value]
+
 class Schema(object):
     __metaclass__ = SchemaBase
+    __slots__ = ('_primitive_data', '_python_data', '_parent', '_dirty_fields', '__weakref__')
+    
+    _deferred_fields = frozenset()
     
     def __init__(self, **kwargs):
         pre_init.send(sender=self.__class__, kwargs=kwargs)
@@ -101,6 +127,7 @@ class Schema(object):
         self._primitive_data = dict()
         self._python_data = dict()
         self._parent = None #TODO make parent a configurable field
+        self._dirty_fields = set()
         for key, value in kwargs.iteritems():
             if key in self._meta.fields or key in ('_primitive_data', '_python_data', '_parent'):
                 setattr(self, key, value)
@@ -108,21 +135,47 @@ class Schema(object):
                 self[key] = value
         assert isinstance(self._primitive_data, dict), str(type(self._primitive_data))
         assert isinstance(self._python_data, dict), str(type(self._python_data))
-        if self._meta.typed_field and self._meta.typed_key:
-            self[self._meta.typed_field] = self._meta.typed_key
+        #only values given as python values are changed
+        self._dirty_fields = set(self._python_data.keys())
+        typed_field = self._meta.typed_field
+        if typed_field and self._meta.typed_key:
+            self[typed_field] = self._meta.typed_key
+            if self._primitive_data.get(typed_field) == self._meta.typed_key:
+                self._dirty_fields.discard(typed_field)
         post_init.send(sender=self.__class__, instance=self)
     
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', {}))
+        for name in Schema.__slots__[:-1]:
+            state[name] = getattr(self, name)
+        return state
+    
+    def __setstate__(self, state):
+        for key, value in state.iteritems():
+            object.__setattr__(self, key, value)
+    
     @classmethod
     def to_primitive(cls, val):
         #CONSIDER shouldn't val be a schema?
-        if cls._meta.typed_field and cls._meta.typed_key:
+        if cls._meta.typed_field and cls._meta.typed_key and val[cls._meta.typed_field] != cls._meta.typed_key:
             val[cls._meta.typed_field] = cls._meta.typed_key
         if hasattr(val, '_primitive_data') and hasattr(val, '_python_data') and hasattr(val, '_meta'):
+            if val._meta.codec:
+                return val._meta.fields.get_codec().encode(val)
             #we've cached python values on access, we need to pump these back to the primitive dictionary
+            fields = val._meta.fields
+            identity_fields = fields.identity_fields
+            scalar_fields = fields.scalar_fields
+            dirty_fields = val._dirty_fields
+            primitive_data = val._primitive_data
             for name, entry in val._python_data.iteritems():
-                if name in val._meta.fields:
+                if name in scalar_fields and name not in dirty_fields and name in primitive_data:
+                    continue #unchanged immutable values keep their primitive
+                if name in identity_fields:
+                    val._primitive_data[name] = entry
+                elif name in fields:
                     try:
-                        val._primitive_data[name] = val._meta.fields[name].to_primitive(entry)
+                        val._primitive_data[name] = fields[name].to_primitive(entry)
                     except:
                         print name, val._meta.fields[name], entry
                         raise
@@ -172,8 +225,54 @@ class Schema(object):
                 except KeyError:
                     #TODO emit a warning
                     pass
+        if cls._meta.codec:
+            return cls._meta.fields.get_codec().decode(cls, val, parent)
         return cls(_primitive_data=val, _parent=parent)
     
+    def load_deferred_fields(self):
+        """
+        Loads the keys that were left out by only() or defer(). Schemas are
+        loaded whole so there is nothing to do here.
+        """
+        pass
+    
+    def _value_changed(self, name, value):
+        if isinstance(value, Schema):
+            return bool(value.get_changed_paths())
+        for item in loaded_items(value):
+            if isinstance(item, Schema) and item.get_changed_paths():
+                return True
+        if name in self._meta.fields:
+            return self._meta.fields[name].to_primitive(value) != self._primitive_data.get(name)
+        return not isinstance(value, (basestring, int, long, float, bool, type(None)))
+    
+    def get_changed_paths(self):
+        """
+        Returns the set of dot paths assigned or modified since the schema was
+        loaded. Containers modified in place are detected by comparing their
+        primitive values.
+        """
+        paths = set(self._dirty_fields)
+        scalar_fields = self._meta.fields.scalar_fields
+        for name, value in self._python_data.iteritems():
+            if name in paths or name in scalar_fields:
+                continue
+            if isinstance(value, Schema):
+                paths.update(['%s.%s' % (name, path) for path in value.get_changed_paths()])
+            elif self._value_changed(name, value):
+                paths.add(name)
+        return paths
+    
+    def mark_clean(self):
+        """
+        Forgets the changes, called once the values have been stored
+        """
+        self._dirty_fields = set()
+        for value in self._python_data.itervalues():
+            for item in loaded_items(value):
+                if isinstance(item, Schema):
+                    item.mark_clean()
+    
     def normalize_portable_primitives(self):
         changed = False
         for key, field in self._meta.fields.iteritems():
@@ -185,39 +284,16 @@ class Schema(object):
                     self._primitive_data[key] = new_entry
         return changed
     
-    def __getattribute__(self, name):
-        fields = object.__getattribute__(self, '_meta').fields
-        if name in fields:
-            try:
-                python_data = object.__getattribute__(self, '_python_data')
-            except AttributeError:
-                return object.__getattribute__(self, name)
-            if name not in python_data:
-                primitive_data = object.__getattribute__(self, '_primitive_data')
-                python_data[name] = fields[name].to_python(primitive_data.get(name), parent=self)
-            return python_data[name]
-        return object.__getattribute__(self, name)
-    
-    def __setattr__(self, name, val):
-        if name in self._meta.fields:
-            field = self._meta.fields[name]
-            if not field.is_instance(val):
-                val = field.to_python(val)
-            self._python_data[name] = val
-            #field = self._fields[name]
-            #store_val = field.to_primitive(val)
-            #self._primtive_data[name] = store_val
-        else:
-            super(Schema, self).__setattr__(name, val)
-    
     def __getitem__(self, key):
         assert isinstance(key, basestring)
         if key in self._meta.fields:
             return getattr(self, key)
+        if self._deferred_fields and key not in self._primitive_data and key not in self._python_data:
+            self.load_deferred_fields()
         if key in self._primitive_data and key not in self._python_data:
-            from dockit.schema.serializer import PRIMITIVE_PROCESSOR
+            from dockit.schema.serializer import PRIMITIVE_PROCESSOR, holds_typed_values
             r_val = self._primitive_data[key]
-            p_val = PRIMITIVE_PROCESSOR.to_python(r_val)
+            p_val = PRIMITIVE_PROCESSOR.to_python(r_val, typed=holds_typed_values(self))
             self._python_data[key] = p_val
         return self._python_data[key]
     
@@ -226,11 +302,13 @@ class Schema(object):
             setattr(self, key, value)
             return
         self._python_data[key] = value
+        self._dirty_fields.add(key)
     
     def __delitem__(self, key):
         if key in self._meta.fields:
             setattr(self, key, None)
             return
+        self._dirty_fields.add(key)
         self._python_data.pop(key, None)
         self._primitive_data.pop(key, None)
     
@@ -286,6 +364,21 @@ class Schema(object):
         else:
             self[attr] = value
     
+    def update_fields(self, **kwargs):
+        """
+        Updates the given dot paths of the stored document in place, see
+        QueryIndex.update, and applies the same changes to this instance.
+        """
+        from dockit.backends.expressions import Increment
+        if not self.pk:
+            raise ValueError('Only saved documents can be updated')
+        type(self).objects.filter(pk=self.pk).update(**kwargs)
+        for key, value in kwargs.iteritems():
+            dotpath = key.replace('__', '.')
+            if isinstance(value, Increment):
+                value = (self.dot_notation(dotpath) or 0) + value.amount
+            self.dot_notation_set_value(dotpath, value)
+    
     def serializable_value(self, field_name):
         try:
             field = self._meta.get_field_by_name(field_name)[0]
@@ -347,9 +440,15 @@ class DocumentBase(SchemaBase):
 class Document(Schema):
     __metaclass__ = DocumentBase
     
+    _lazy_reference = False
+    _tracked = False #set for documents loaded from or saved to the backend
+    
     def get_id(self):
         backend = self._meta.get_backend()
-        return str(backend.get_id(self._primitive_data))
+        doc_id = backend.get_id(self._primitive_data)
+        if doc_id is None:
+            return None #not saved yet
+        return str(doc_id)
     
     def _get_pk_val(self):
         return self.get_id()
@@ -357,10 +456,13 @@ class Document(Schema):
     pk = property(get_id)
     
     def get_or_create_natural_key(self):
+        self.load_deferred_fields()
         if '@natural_key' not in self._primitive_data:
             self._primitive_data['@natural_key'] = self.create_natural_key()
+            self._dirty_fields.add('@natural_key')
         if '@natural_key_hash' not in self._primitive_data:
             self._primitive_data['@natural_key_hash'] = self._get_natural_key_hash(self._primitive_data['@natural_key'])
+            self._dirty_fields.add('@natural_key_hash')
         return self._primitive_data['@natural_key']
     
     def create_natural_key(self):
@@ -383,31 +485,85 @@ class Document(Schema):
         vals = tuple(nkey.items())
         return str(hash(vals)) #TODO convert to hex value
     
+    def load_deferred_fields(self):
+        """
+        Fetches the keys that were left out by only() or defer() from the
+        document backend, keeping any values that were set since.
+        """
+        if not self._deferred_fields:
+            return
+        if self._lazy_reference:
+            from dockit.backends.lazy import resolve_lazy_references
+            resolve_lazy_references(self)
+            return
+        self._deferred_fields = frozenset()
+        backend = self._meta.get_document_backend_for_read()
+        data = backend.get(type(self), self._meta.collection, self.get_id())
+        for key, value in data.iteritems():
+            if key not in self._primitive_data and key not in self._python_data:
+                self._primitive_data[key] = value
+    
     @classmethod
     def to_primitive(cls, val):
+        val.load_deferred_fields()
+        from dockit.schema.serializer import UntypedData
         val.get_or_create_natural_key()
         ret = Schema.to_primitive(val)
+        if type(ret) is UntypedData:
+            #the written values may be typed
+            ret = val._primitive_data = dict(ret)
         return ret
     
     @classmethod
     def to_portable_primitive(cls, val):
+        val.load_deferred_fields()
         val.get_or_create_natural_key()
         ret = Schema.to_portable_primitive(val)
         return ret
     
+    def _update_identity_map(self, deleted=False):
+        from dockit.backends.identitymap import get_identity_map
+        identity_map = get_identity_map()
+        if identity_map is None:
+            return
+        if deleted:
+            identity_map.remove(self._meta.collection, self.get_id())
+        elif not self._deferred_fields:
+            identity_map.add(self)
+    
     def save(self):
         from dockit.backends import get_index_router
+        from dockit.backends.unitofwork import get_unit_of_work
         created = not self.pk
         pre_save.send(sender=type(self), instance=self)
-        backend = self._meta.get_document_backend_for_write()
-        data = type(self).to_primitive(self)
-        backend.save(type(self), self._meta.collection, data)
-        get_index_router().on_save(type(self), self._meta.collection, self.get_id(), data)
+        unit = get_unit_of_work()
+        if unit is not None:
+            unit.save(self, created)
+            self._update_identity_map()
+            return
+        changed_paths = None
+        if self._tracked and not created:
+            self.get_or_create_natural_key()
+            changed_paths = self.get_changed_paths()
+        if changed_paths is None or changed_paths:
+            backend = self._meta.get_document_backend_for_write()
+            data = type(self).to_primitive(self)
+            backend.save(type(self), self._meta.collection, data)
+            get_index_router().on_save(type(self), self._meta.collection, self.get_id(), data, changed_paths=changed_paths)
+            self.mark_clean()
+            self._tracked = True
+        self._update_identity_map()
         post_save.send(sender=type(self), instance=self, created=created)
     
     def delete(self):
         from dockit.backends import get_index_router
+        from dockit.backends.unitofwork import get_unit_of_work
         pre_delete.send(sender=type(self), instance=self)
+        self._update_identity_map(deleted=True)
+        unit = get_unit_of_work()
+        if unit is not None:
+            unit.delete(self)
+            return
         backend = self._meta.get_document_backend_for_write()
         backend.delete(type(self), self._meta.collection, self.get_id())
         get_index_router().on_delete(type(self), self._meta.collection, self.get_id())
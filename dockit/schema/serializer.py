@@ -92,25 +92,71 @@ def make_serializers():
     return {'encoder': JSONEncoder(handlers=handlers),
             'decoder': JSONDecoder(handlers=handlers),}
 
+PLAIN_TYPES = frozenset([unicode, str, int, long, float, bool, type(None)])
+
+class UntypedData(dict):
+    '''
+    Primitive data a backend loaded and found to hold no values encoded by a
+    handler. The marker is not stored, copies and saved data are plain dicts.
+    '''
+    pass
+
+def holds_typed_values(parent):
+    '''
+    Returns False if the document the schema belongs to was loaded as
+    UntypedData, True if it may hold typed values
+    '''
+    if parent is None:
+        return True
+    while parent._parent is not None:
+        parent = parent._parent
+    return type(parent._primitive_data) is not UntypedData
+
 class PrimitiveProcessor(object):
     def __init__(self, handlers):
         self.handlers = handlers
         self.handlers_by_key = dict([(handler.key, handler) for handler in self.handlers])
+        #exact type => handler or None, subclasses are added as they are seen
+        self.handlers_by_type = dict([(handler.instancetype, handler) for handler in self.handlers])
+        self.handlers_by_type.update([(plain_type, None) for plain_type in PLAIN_TYPES])
+    
+    def get_handler(self, obj_type):
+        try:
+            return self.handlers_by_type[obj_type]
+        except KeyError:
+            pass
+        found = None
+        for handler in self.handlers:
+            if issubclass(obj_type, handler.instancetype):
+                found = handler
+                break
+        self.handlers_by_type[obj_type] = found
+        return found
     
     def to_primitive(self, obj):
+        obj_type = type(obj)
+        if obj_type in PLAIN_TYPES:
+            return obj
         if isinstance(obj, (QuerySet, list)):
             return map(self.to_primitive, obj)
-        for handler in self.handlers:
-            if isinstance(obj, handler.instancetype):
-                return handler.encode(obj)
+        handler = self.get_handler(obj_type)
+        if handler is not None:
+            return handler.encode(obj)
         if isinstance(obj, dict):
             for key, value in obj.items():
                 obj[self.to_primitive(key)] = self.to_primitive(value)
-        elif isinstance(obj, list):
-            return map(self.to_primtive, obj)
         return obj
     
-    def to_python(self, obj):
+    def to_python(self, obj, typed=True):
+        '''
+        Decodes the typed values and wraps containers in dot path containers.
+        Pass typed=False for data known to hold no typed values.
+        '''
+        obj_type = type(obj)
+        if obj_type in PLAIN_TYPES:
+            return obj
+        if not typed:
+            return self.wrap(obj)
         if isinstance(obj, dict):
             if '__type__' in obj:
                 return self.handlers_by_key[obj['__type__']].decode(obj)
@@ -120,6 +166,19 @@ class PrimitiveProcessor(object):
         elif isinstance(obj, list):
             return DotPathList(map(self.to_python, obj))
         return obj
+    
+    def wrap(self, obj):
+        '''
+        Wraps plain containers in dot path containers without looking for typed values
+        '''
+        obj_type = type(obj)
+        if obj_type in PLAIN_TYPES:
+            return obj
+        if isinstance(obj, dict):
+            return DotPathDict([(key, self.wrap(value)) for key, value in obj.iteritems()])
+        if isinstance(obj, list):
+            return DotPathList([self.wrap(value) for value in obj])
+        return obj
 
 def make_primitive_processor():
     handlers = [ModelHandler(), DecimalHandler()]
@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+from django.utils import unittest
+
+import dockit
+
+class ImportTestCase(unittest.TestCase):
+    def assertImports(self, module):
+        #a fresh interpreter so the modules already imported by the test run do not hide a circular import
+        root = os.path.dirname(os.path.dirname(os.path.abspath(dockit.__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([root] + [path for path in sys.path if path])
+        process = subprocess.Popen([sys.executable, '-c', 'import %s' % module], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 0, output)
+    
+    def test_import_queryset(self):
+        self.assertImports('dockit.backends.queryset')
+    
+    def test_import_queryindex(self):
+        self.assertImports('dockit.backends.queryindex')
@@ -1,5 +1,12 @@
+import copy
+import datetime
+import pickle
+from decimal import Decimal
+
 from django.utils import unittest
 
+from dockit import schema
+from dockit.schema.common import DotPathList
 from common import SimpleSchema, SimpleDocument
 
 class SchemaTestCase(unittest.TestCase):
@@ -34,4 +41,173 @@ class SchemaTestCase(unittest.TestCase):
         obj.save()
         self.assertTrue('@natural_key' in obj._primitive_data)
         self.assertTrue('@natural_key_hash' in obj._primitive_data)
-
+    
+    
+    def test_field_descriptors(self):
+        self.assertTrue(isinstance(SimpleSchema.charfield, schema.CharField))
+        obj = SimpleSchema(_primitive_data={'charfield':'charmander'})
+        self.assertEqual(obj._python_data, {})
+        self.assertEqual(obj.charfield, 'charmander')
+        self.assertEqual(obj._python_data, {'charfield':'charmander'})
+        obj.charfield = 'charmeleon'
+        self.assertEqual(obj.to_primitive(obj), {'charfield':'charmeleon'})
+        self.assertFalse('charfield' in getattr(obj, '__dict__', {}))
+    
+    def test_flat_field_table(self):
+        class ChildSchema(SimpleSchema):
+            reference = schema.ReferenceField(SimpleDocument)
+            items = schema.ListField(schema.CharField())
+        
+        fields = ChildSchema._meta.fields
+        self.assertEqual(fields.keys(), ['reference', 'items', 'charfield'])
+        self.assertEqual(fields.reference_fields, frozenset(['reference']))
+        self.assertEqual(fields.processed_fields, frozenset(['items']))
+        
+        #fields added to a parent show up in the tables of its children
+        self.addCleanup(SimpleSchema._meta.fields.rebuild)
+        self.addCleanup(SimpleSchema._meta.fields.local_fields.pop, 'added')
+        self.addCleanup(delattr, SimpleSchema, 'added')
+        schema.IntegerField().contribute_to_class(SimpleSchema, 'added')
+        self.assertTrue('added' in fields)
+        self.assertEqual(ChildSchema(added=1).added, 1)
+    
+    def test_changed_paths(self):
+        class ParentSchema(schema.Schema):
+            child = schema.SchemaField(SimpleSchema)
+            items = schema.ListField(schema.CharField())
+        
+        obj = ParentSchema.to_python({'child':{'charfield':'charmander'}, 'items':['a']})
+        self.assertEqual(obj.get_changed_paths(), set())
+        obj.child.charfield = 'charmeleon'
+        self.assertEqual(obj.get_changed_paths(), set(['child.charfield']))
+        obj.items.append('b')
+        self.assertEqual(obj.get_changed_paths(), set(['child.charfield', 'items']))
+        obj.mark_clean()
+        self.assertEqual(obj.get_changed_paths(), set(['items']))
+        self.assertEqual(ParentSchema(items=[]).get_changed_paths(), set(['items']))
+    
+    def test_lazy_containers(self):
+        class ContainerSchema(schema.Schema):
+            items = schema.ListField(schema.SchemaField(SimpleSchema))
+            mapping = schema.DictField(value_subfield=schema.SchemaField(SimpleSchema))
+        
+        data = {'items':[{'charfield':'a'}, {'charfield':'b'}, {'charfield':'c'}],
+                'mapping':{'x':{'charfield':'x'}, 'y':{'charfield':'y'}}}
+        obj = ContainerSchema.to_python(copy.deepcopy(data))
+        self.assertEqual(len(obj.items), 3)
+        self.assertEqual(obj.items.loaded_values(), [])
+        self.assertEqual(obj.items[1].charfield, 'b')
+        self.assertEqual(len(obj.items.loaded_values()), 1)
+        self.assertEqual(obj.dot_notation('mapping.y.charfield'), 'y')
+        self.assertEqual(len(obj.mapping.loaded_values()), 1)
+        self.assertEqual(obj.to_primitive(obj), data)
+        self.assertEqual(obj.get_changed_paths(), set())
+        
+        obj.dot_notation_set_value('items.2', SimpleSchema(charfield='d'))
+        obj.items.append(SimpleSchema(charfield='e'))
+        self.assertEqual([item.charfield for item in obj.items], ['a', 'b', 'd', 'e'])
+        self.assertTrue(obj.items.is_hydrated())
+        self.assertEqual(obj.get_changed_paths(), set(['items']))
+        self.assertEqual(obj.to_primitive(obj)['items'][2:], [{'charfield':'d'}, {'charfield':'e'}])
+        self.assertEqual(copy.deepcopy(obj.items)[0].charfield, 'a')
+    
+    def test_validated_containers(self):
+        checked = list()
+        class CountingField(schema.IntegerField):
+            def is_instance(self, val):
+                checked.append(val)
+                return super(CountingField, self).is_instance(val)
+        
+        class NumbersSchema(schema.Schema):
+            numbers = schema.ListField(CountingField())
+        
+        obj = NumbersSchema(numbers=DotPathList([1, 2, 3]))
+        self.assertEqual(checked, [1, 2, 3])
+        obj.numbers = obj.numbers
+        obj.numbers.append(4)
+        self.assertEqual(checked, [1, 2, 3, 4])
+        self.assertTrue(NumbersSchema.numbers.is_instance(obj.numbers))
+        
+        #an item the field rejects clears the marker
+        obj.numbers.append('5')
+        self.assertEqual(obj.numbers._validated_by, None)
+        self.assertFalse(NumbersSchema.numbers.is_instance(obj.numbers))
+    
+    def test_generated_codec(self):
+        class Entry(schema.Schema):
+            title = schema.CharField()
+            price = schema.DecimalField()
+        
+        class Fields(schema.Schema):
+            title = schema.CharField()
+            count = schema.IntegerField()
+            price = schema.DecimalField()
+            published = schema.DateField()
+            tags = schema.ListField(schema.CharField())
+            entry = schema.SchemaField(Entry)
+            entries = schema.ListField(schema.SchemaField(Entry))
+            entry_map = schema.DictField(value_subfield=schema.SchemaField(Entry))
+            extra = schema.DictField()
+        
+        class Generated(Fields):
+            class Meta:
+                codec = True
+        
+        data = {'title':u'a', 'count':2, 'price':'1.50', 'published':datetime.date(2012, 1, 2),
+                'tags':[u'x', u'y'], 'entry':{'title':u'e', 'price':'2'},
+                'entries':[{'title':u'f', 'price':'3'}], 'entry_map':{'a':{'title':u'h', 'price':'5'}},
+                'extra':{'key':[1, 2]}, 'unknown':u'u'}
+        generic = Fields.to_python(copy.deepcopy(data))
+        generated = Generated.to_python(copy.deepcopy(data))
+        self.assertTrue('price' in generated._python_data)
+        #embedded schemas are converted by codecs of their own
+        self.assertTrue('price' in generated.entry._python_data)
+        self.assertFalse('price' in generic.entry._python_data)
+        for name, field in Fields._meta.fields.iteritems():
+            self.assertEqual(field.to_primitive(getattr(generic, name)), field.to_primitive(getattr(generated, name)))
+        self.assertEqual(generated.entries[0].price, Decimal('3'))
+        
+        for obj in (generic, generated):
+            obj.count = '3'
+            obj.tags.append(u'z')
+            obj.entries.append(Entry(title=u'g', price=Decimal('4')))
+            obj.entry.price = Decimal('6')
+            obj.entry_map['b'] = Entry(title=u'i', price=Decimal('7'))
+        self.assertEqual(Fields.to_primitive(generic), Generated.to_primitive(generated))
+        self.assertEqual(Generated.to_primitive(generated)['count'], 3)
+        self.assertEqual(Generated.to_primitive(generated)['entries'][1], {'title':u'g', 'price':'4'})
+        self.assertEqual(Generated.to_primitive(generated)['entry']['price'], '6')
+        self.assertEqual(Generated.to_primitive(generated)['entry_map']['b'], {'title':u'i', 'price':'7'})
+    
+    def test_compact_layout(self):
+        class CompactSchema(schema.Schema):
+            charfield = schema.CharField()
+            items = schema.ListField(schema.CharField())
+            
+            class Meta:
+                keep_primitive_data = False
+                slots = True
+        
+        class CompactChild(CompactSchema):
+            pass
+        
+        obj = CompactSchema.to_python({'charfield':'charmander', 'items':['a']})
+        self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertRaises(AttributeError, setattr, obj, 'extra', 1)
+        self.assertFalse(hasattr(CompactChild(), '__dict__'))
+        self.assertTrue(hasattr(SimpleDocument(), '__dict__'))
+        
+        #schemas keep their __dict__ unless they opt in
+        obj = SimpleSchema(charfield='charmander')
+        obj.extra = 1
+        self.assertEqual(obj.extra, 1)
+        
+        obj = CompactSchema.to_python({'charfield':'charmander', 'items':['a']})
+        self.assertEqual(obj.items, ['a'])
+        self.assertEqual(obj._primitive_data, {'charfield':'charmander'})
+        self.assertEqual(obj.to_primitive(obj), {'charfield':'charmander', 'items':['a']})
+        
+        
+        obj = SimpleSchema(charfield='charmander')
+        copied = pickle.loads(pickle.dumps(obj))
+        self.assertEqual(copied.to_primitive(copied), {'charfield':'charmander'})